@@ -1,4 +1,5 @@
 from .connections import AioRedis, create_pool  # noqa F401
 from .cron import cron  # noqa F401
+from .hooks import Hooks, JobEvent  # noqa F401
 from .version import __version__  # noqa F401
 from .worker import Retry, Worker, check_health, func, run_worker  # noqa F401
@@ -5,6 +5,8 @@ from starlette.middleware.cors import CORSMiddleware
 
 from aiorq.connections import RedisSettings, create_pool
 from .v1 import api_v1_router
+from .cache import ResponseCache
+from .stream import StatsStream
 from .config import settings
 from .db.mongodb_ import mongodb_
 from .logger import logger
@@ -23,6 +25,8 @@ def create_app():
     # register_redis(app)
     # register_mongodb(app_server)
     register_cors(app)
+    register_cache(app)
+    register_stream(app)
     register_router(app)
     # register_static_file(app_server)
 
@@ -38,7 +42,8 @@ def register_redis(app: FastAPI):
                 port=settings.REDIS_PORT,
                 database=settings.REDIS_DATABASE,
                 password=settings.REDIS_PASSWORD,
-            )
+            ),
+            accept_codecs=settings.ACCEPT_CODECS,
         )
 
     @app.on_event('shutdown')
@@ -46,6 +51,18 @@ def register_redis(app: FastAPI):
         await app.state.redis.close()
 
 
+def register_cache(app: FastAPI):
+    app.state.cache = ResponseCache(settings.CACHE_MAX_SIZE)
+
+
+def register_stream(app: FastAPI):
+    app.state.stats_stream = StatsStream(settings.STREAM_INTERVAL, settings.STREAM_KEEPALIVE)
+
+    @app.on_event('shutdown')
+    async def shutdown():
+        await app.state.stats_stream.close()
+
+
 def register_mongodb(app: FastAPI):
     @app.on_event("startup")
     async def connect_to_mongo():
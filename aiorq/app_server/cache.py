@@ -0,0 +1,98 @@
+"""
+看板接口的响应缓存
+
+按接口和查询参数缓存响应若干秒,并限制条目数量,超出时淘汰最久未使用的条目。
+同一时间相同的请求共享一次进行中的读取,多人同时打开看板时 redis 只被查询一次。
+"""
+import asyncio
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from functools import partial
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from starlette.requests import Request
+
+from .config import settings
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    # 共享了进行中的读取
+    coalesced: int = 0
+    misses: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.coalesced + self.misses
+        return {
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.coalesced) / total if total else None,
+        }
+
+
+class ResponseCache:
+    """
+    :param max_size: 最多缓存的响应数量
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        # key -> (过期时间, 响应)
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._inflight: Dict[Hashable, 'asyncio.Future[Any]'] = {}
+        self._stats: Dict[str, CacheStats] = defaultdict(CacheStats)
+
+    async def get(self, endpoint: str, key: Hashable, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        返回未过期的缓存响应,否则调用 ``fetch``,相同 key 的并发请求等待同一次 ``fetch``
+        :param ttl: 缓存秒数,不大于 0 时不缓存也不合并请求
+        """
+        stats = self._stats[endpoint]
+        if ttl <= 0:
+            stats.misses += 1
+            return await fetch()
+        key = (endpoint, key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            self._entries.move_to_end(key)
+            stats.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            stats.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._fetched, key, ttl))
+        else:
+            stats.coalesced += 1
+        # 一个请求被取消不影响其他等待同一读取的请求
+        return await asyncio.shield(task)
+
+    def _fetched(self, key: Hashable, ttl: float, task: 'asyncio.Future[Any]') -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = (monotonic() + ttl, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'endpoints': {endpoint: s.to_dict() for endpoint, s in self._stats.items()},
+        }
+
+
+async def cached(request: Request, endpoint: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    按 ``CACHE_TTL`` 中该接口的配置缓存 ``fetch`` 的结果,以排序后的查询参数区分请求
+    """
+    key = tuple(sorted(request.query_params.multi_items()))
+    ttl = settings.CACHE_TTL.get(endpoint, 0)
+    return await request.app.state.cache.get(endpoint, key, ttl, fetch)
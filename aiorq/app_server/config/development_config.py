@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
-from typing import List, Union
+from typing import Dict, List, Union
 from urllib import parse
 
 from pydantic import AnyHttpUrl, BaseSettings, validator
@@ -35,6 +35,23 @@ class Settings(BaseSettings):
             return v
         raise ValueError(v)
 
+    # 除 json 以外看板允许解码的编解码器, 如 ["msgpack"], 见 aiorq.serialize.accepted_codecs
+    ACCEPT_CODECS: List[str] = []
+
+    # 看板接口响应缓存的秒数, 0 为不缓存, 见 aiorq.app_server.cache
+    CACHE_TTL: Dict[str, float] = {
+        "index": 2,
+        "workers": 2,
+        "queued_jobs": 2,
+        "results": 2,
+        "redis_info": 5,
+    }
+    CACHE_MAX_SIZE: int = 256
+
+    # /stream 实时推送的采样间隔和保持连接的间隔秒数, 见 aiorq.app_server.stream
+    STREAM_INTERVAL: float = 1
+    STREAM_KEEPALIVE: float = 15
+
     # 缓存 key
     REDIS_CACHE_KEY = "fastapi_cache:"
     HOST_DETAIL_KEY = "host_detail:"
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional, Tuple, Dict, Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, root_validator
 
 class HealthCheckModel(BaseModel):
     j_complete: int
@@ -38,8 +38,9 @@ class IndecModel(BaseModel):
 
 class JobDefModel(BaseModel):
     function: str
-    args: Tuple[Any, ...]
-    kwargs: Dict[str, Any]
+    # 只读取头部时为 None
+    args: Optional[Tuple[Any, ...]]
+    kwargs: Optional[Dict[str, Any]]
     job_try: int
     enqueue_time: datetime
     score: Optional[int]
@@ -55,8 +56,9 @@ class JobDefsModel(BaseModel):
 
 class JobResult_(BaseModel):
     function: str
-    args: Tuple[Any, ...]
-    kwargs: Dict[str, Any]
+    # 只读取头部时为 None
+    args: Optional[Tuple[Any, ...]]
+    kwargs: Optional[Dict[str, Any]]
     job_try: int
     enqueue_time: datetime
     score: Optional[int]
@@ -67,6 +69,30 @@ class JobResult_(BaseModel):
     queue_name: str
     worker_name: str
     job_id: Optional[str] = None
+    # 各阶段毫秒时间戳
+    enqueue_ms: Optional[int] = None
+    due_ms: Optional[int] = None
+    claim_ms: Optional[int] = None
+    start_ms: Optional[int] = None
+    finish_ms: Optional[int] = None
+    record_ms: Optional[int] = None
+    # 各阶段耗时(毫秒)
+    queue_wait_ms: Optional[int] = None
+    setup_ms: Optional[int] = None
+    run_ms: Optional[int] = None
+    wrap_up_ms: Optional[int] = None
+
+    @root_validator(skip_on_failure=True)
+    def latency_breakdown(cls, values):
+        for name, end, start in (
+                ('queue_wait_ms', 'claim_ms', 'due_ms'),
+                ('setup_ms', 'start_ms', 'claim_ms'),
+                ('run_ms', 'finish_ms', 'start_ms'),
+                ('wrap_up_ms', 'record_ms', 'finish_ms'),
+        ):
+            if values.get(name) is None and values.get(end) is not None and values.get(start) is not None:
+                values[name] = values[end] - values[start]
+        return values
 
 class JobResultModel(BaseModel):
     rows: List[JobResult_]
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+看板的实时统计推送 (server-sent events)
+
+一个后台任务每隔一段时间读取一次 worker 健康检查和队列长度,只把变化的部分编码一次后推送给所有订阅者,
+redis 的负载与打开看板的人数无关。没有订阅者时后台任务停止。
+"""
+import asyncio
+import json
+import logging
+from typing import Any, AsyncGenerator, Dict, Optional, Set
+
+from aiorq.connections import AioRedis
+
+logger = logging.getLogger('aiorq.app_server.stream')
+
+Snapshot = Dict[str, Dict[str, Any]]
+
+
+def diff(old: Snapshot, new: Snapshot) -> Snapshot:
+    """
+    两次快照之间变化的条目,新增或变化的条目为新值,删除的条目为 None
+    """
+    delta: Snapshot = {}
+    for section, entries in new.items():
+        old_entries = old.get(section, {})
+        changed: Dict[str, Any] = {k: v for k, v in entries.items() if old_entries.get(k) != v}
+        changed.update({k: None for k in old_entries.keys() - entries.keys()})
+        if changed:
+            delta[section] = changed
+    return delta
+
+
+def encode_event(event: str, data: Any) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"), default=str)}\n\n'
+
+
+class StatsStream:
+    """
+    :param interval: 采样间隔秒数
+    :param keepalive: 没有变化时发送注释行保持连接的间隔秒数
+    :param max_pending: 每个订阅者最多积压的消息数,超过时丢弃积压并重新发送完整快照
+    """
+
+    def __init__(self, interval: float = 1, keepalive: float = 15, max_pending: int = 16):
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_pending = max_pending
+        self.subscribers: Set['asyncio.Queue[str]'] = set()
+        self.snapshot: Optional[Snapshot] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    async def sample(self, redis: AioRedis) -> Snapshot:
+        """
+        一次 HGETALL 和 ZRANGEBYSCORE 读取 worker,一次管道读取它们的队列长度
+        """
+        workers = await redis.get_job_workers()
+        queues = sorted({w.queue_name for w in workers})
+        async with redis.pipeline(transaction=False) as pipe:
+            for queue_name in queues:
+                pipe.zcard(queue_name)
+            depths = await pipe.execute()
+        return {
+            'workers': {
+                w.worker_name: {'queue_name': w.queue_name, 'is_action': w.is_action, **w.health_check}
+                for w in workers
+            },
+            'queues': dict(zip(queues, depths)),
+        }
+
+    async def subscribe(self, redis: AioRedis) -> AsyncGenerator[str, None]:
+        """
+        订阅者的事件流,先收到完整的 ``snapshot`` 事件,之后是 ``delta`` 事件
+        """
+        queue: 'asyncio.Queue[str]' = asyncio.Queue(self.max_pending)
+        self.subscribers.add(queue)
+        if self.snapshot is not None:
+            queue.put_nowait(encode_event('snapshot', self.snapshot))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run(redis))
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+        finally:
+            self.subscribers.discard(queue)
+
+    async def _run(self, redis: AioRedis) -> None:
+        while self.subscribers:
+            try:
+                snapshot = await self.sample(redis)
+            except Exception:
+                logger.exception('sampling stats failed')
+            else:
+                if self.snapshot is None:
+                    self.snapshot = snapshot
+                    self._publish(encode_event('snapshot', snapshot))
+                else:
+                    delta = diff(self.snapshot, snapshot)
+                    self.snapshot = snapshot
+                    if delta:
+                        self._publish(encode_event('delta', delta))
+            await asyncio.sleep(self.interval)
+        # 没有订阅者时快照不再更新,下一个订阅者重新开始
+        self.snapshot = None
+
+    def _publish(self, message: str) -> None:
+        for queue in self.subscribers:
+            if queue.full():
+                # 订阅者读取太慢,丢弃积压的变化,重新发送完整快照
+                while not queue.empty():
+                    queue.get_nowait()
+                message_ = encode_event('snapshot', self.snapshot)
+            else:
+                message_ = message
+            queue.put_nowait(message_)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
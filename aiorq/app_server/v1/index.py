@@ -1,8 +1,7 @@
-import dataclasses
-
 from fastapi import APIRouter
 from starlette.requests import Request
 
+from aiorq.app_server.cache import cached
 from aiorq.app_server.schemas import IndecModel, JobDefModel, HealthCheckModel, WorkerListModel
 
 router = APIRouter()
@@ -10,11 +9,12 @@ router = APIRouter()
 
 @router.get("/index", response_model=IndecModel)
 async def index(request: Request):
-    functions = await request.app.state.redis.get_job_funcs()
-    workers = await request.app.state.redis.get_job_workers()
-    # print(functions)
-    # print(workers)
-    return {"functions": functions, "workers": workers}
+    async def fetch():
+        functions = await request.app.state.redis.get_job_funcs()
+        workers = await request.app.state.redis.get_job_workers()
+        return {"functions": [f.to_dict() for f in functions], "workers": [w.to_dict() for w in workers]}
+
+    return await cached(request, "index", fetch)
 
 
 @router.get("/get_health_check", response_model=HealthCheckModel)
@@ -28,7 +28,7 @@ async def enqueue_job_(request: Request):
     job = await request.app.state.redis.enqueue_job('say_hello', name="wutong", queue_name="pai:queue2", job_try=1, defer_by=2)
     job_ = await job.info()
     # await job.abort()
-    return job_
+    return job_.to_dict()
 
 
 @router.get("/workers", response_model=WorkerListModel)
@@ -43,21 +43,29 @@ async def workers(
         "queue_name": queue,
         "is_action": is_action
     }
-    results_ = await request.app.state.redis.get_job_workers()
-    if query_.get("worker_name"):
-        results_ = filter(lambda result: query_.get("worker_name") in dataclasses.asdict(result).get("worker_name"), results_)
-    if query_.get("queue_name"):
-        results_ = filter(lambda result: query_.get("queue_name") in dataclasses.asdict(result).get("queue_name"), results_)
-    if query_.get("is_action") is not None:
-        results_ = filter(lambda result: query_.get("is_action") == dataclasses.asdict(result).get("is_action"), results_)
-    results_ = list(results_)
-    return {"workers": results_}
+
+    async def fetch():
+        results_ = await request.app.state.redis.get_job_workers()
+        if query_.get("worker_name"):
+            results_ = filter(lambda result: query_.get("worker_name") in result.worker_name, results_)
+        if query_.get("queue_name"):
+            results_ = filter(lambda result: query_.get("queue_name") in result.queue_name, results_)
+        if query_.get("is_action") is not None:
+            results_ = filter(lambda result: query_.get("is_action") == result.is_action, results_)
+        return {"workers": [result.to_dict() for result in results_]}
+
+    return await cached(request, "workers", fetch)
+
+
+@router.get("/cache_stats")
+async def cache_stats(request: Request):
+    return request.app.state.cache.stats()
 
 
 @router.get("/funcs")
 async def get_job_funcs(request: Request):
     results = await request.app.state.redis.get_job_funcs()
-    return results
+    return [result.to_dict() for result in results]
 
 # @router.get("/log")
 # async def logs(name: str):
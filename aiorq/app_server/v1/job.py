@@ -1,10 +1,11 @@
-import dataclasses
 from typing import Optional
 
 from fastapi import APIRouter
 from starlette.requests import Request
 
+from aiorq.app_server.cache import cached
 from aiorq.app_server.schemas import JobResultModel, JobDefsModel
+from aiorq.specs import JobDefBatch, JobResultBatch
 
 router = APIRouter()
 
@@ -16,18 +17,30 @@ async def queued_jobs(
         worker_name: str = None,
         function: str = None,
         job_id: str = None,
-        state: str = None
+        state: str = None,
+        body: bool = False,
+        offset: int = 0,
+        limit: Optional[int] = None,
 ):
-    results_ = await request.app.state.redis.queued_jobs(queue_name=queue_name)
-    if worker_name:
-        results_ = filter(lambda result: worker_name in dataclasses.asdict(result).get("worker_name"), results_)
-    if function:
-        results_ = filter(lambda result: function in dataclasses.asdict(result).get("function"), results_)
-    if job_id:
-        results_ = filter(lambda result: job_id in dataclasses.asdict(result).get("job_id"), results_)
-    if state:
-        results_ = filter(lambda result: state == dataclasses.asdict(result).get("state"), results_)
-    return {"rows": list(results_)}
+    async def fetch():
+        redis = request.app.state.redis
+        if limit:
+            # 按运行时间分页,过滤只作用于当前页
+            records = await redis.queued_jobs_page(queue_name=queue_name, offset=offset, limit=limit, with_body=body)
+        else:
+            records = await redis.queued_jobs(queue_name=queue_name, with_body=body)
+        results_ = JobDefBatch.from_records(records)
+        if worker_name:
+            results_ = results_.where("worker_name", lambda v: worker_name in v)
+        if function:
+            results_ = results_.where("function", lambda v: function in v)
+        if job_id:
+            results_ = results_.where("job_id", lambda v: job_id in v)
+        if state:
+            results_ = results_.where("state", lambda v: state == v)
+        return {"rows": results_.rows()}
+
+    return await cached(request, "queued_jobs", fetch)
 
 
 @router.get("/results", response_model=JobResultModel)
@@ -39,17 +52,44 @@ async def results(
         start_time: Optional[str] = None,
         finish_time: Optional[str] = None,
         success: bool = None,
+        body: bool = False,
+        queue_name: Optional[str] = None,
+        limit: Optional[int] = None,
+        before: Optional[int] = None,
+        before_id: Optional[str] = None,
 ):
-    results_ = await request.app.state.redis.all_job_results()
-    if worker_name:
-        results_ = filter(lambda result: worker_name in dataclasses.asdict(result).get("worker_name"), results_)
-    if function:
-        results_ = filter(lambda result: function in dataclasses.asdict(result).get("function"), results_)
-    if job_id:
-        results_ = filter(lambda result: job_id in dataclasses.asdict(result).get("job_id"), results_)
-    if success is not None:
-        results_ = filter(lambda result: success == dataclasses.asdict(result).get("success"), results_)
-    return {"rows": list(results_)}
+    async def fetch():
+        redis = request.app.state.redis
+        if limit:
+            # 按完成时间分页, before 和 before_id 为上一页最后一个结果的 score 和 job_id
+            # 函数, worker 和是否成功使用 redis 中的索引精确匹配
+            records = await redis.job_results_page(
+                queue_name, function=function, worker_name=worker_name, success=success, limit=limit, before=before,
+                before_id=before_id, with_body=body,
+            )
+            results_ = JobResultBatch.from_records(records)
+            if job_id:
+                results_ = results_.where("job_id", lambda v: job_id in v)
+            return {"rows": results_.rows()}
+
+        results_ = JobResultBatch.from_records(await redis.all_job_results(with_body=body))
+        if worker_name:
+            results_ = results_.where("worker_name", lambda v: worker_name in v)
+        if function:
+            results_ = results_.where("function", lambda v: function in v)
+        if job_id:
+            results_ = results_.where("job_id", lambda v: job_id in v)
+        if success is not None:
+            results_ = results_.where("success", lambda v: success == v)
+        return {"rows": results_.rows()}
+
+    return await cached(request, "results", fetch)
+
+
+@router.get("/profile")
+async def profile(request: Request, function: str, limit: int = 20):
+    rows = await request.app.state.redis.get_job_profile(function, limit)
+    return {"rows": rows}
 
 
 @router.delete("")
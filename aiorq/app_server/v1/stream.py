@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+router = APIRouter()
+
+
+@router.get("/stream")
+async def stream(request: Request):
+    """
+    worker 健康检查和队列长度的实时推送 (text/event-stream)
+    """
+    return StreamingResponse(
+        request.app.state.stats_stream.subscribe(request.app.state.redis),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
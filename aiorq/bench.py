@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import random
+import string
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from .connections import AioRedis, RedisSettings, create_pool
+from .constants import result_key_prefix
+from .serialize import deserialize_result
+from .utils import percentile
+from .worker import create_worker, get_kwargs
+
+if TYPE_CHECKING:
+    from .typing_ import WorkerSettingsType
+
+logger = logging.getLogger('aiorq.bench')
+
+# number of job results fetched per MGET when collecting latencies
+result_chunk_size = 500
+
+
+@dataclass
+class BenchConfig:
+    """
+    Workload for :func:`run_bench`.
+
+    :param jobs: total number of jobs to enqueue
+    :param producers: number of concurrent producers
+    :param mix: relative weight of each function, all registered functions equally if empty
+    :param kwargs: keyword arguments passed to each function
+    :param payload_size: size of a random string passed to every job as ``payload_arg``
+    :param payload_arg: keyword argument receiving the payload, no payload is sent if None
+    :param defer: defer distribution, ``none``, ``uniform:MIN:MAX`` or ``exp:MEAN`` in seconds
+    :param queue_name: queue used for the run, kept separate from real queues
+    """
+
+    jobs: int = 1000
+    producers: int = 4
+    mix: Dict[str, float] = field(default_factory=dict)
+    kwargs: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    payload_size: int = 0
+    payload_arg: Optional[str] = None
+    defer: str = 'none'
+    queue_name: str = 'aiorq:bench'
+
+
+def parse_defer(spec: str) -> Callable[[], float]:
+    """
+    Build a function returning defer times in seconds from a distribution spec.
+    """
+    name, *params = spec.split(':')
+    try:
+        if name == 'none' and not params:
+            return lambda: 0.0
+        elif name == 'uniform':
+            low, high = map(float, params)
+            return lambda: random.uniform(low, high)
+        elif name == 'exp':
+            (mean,) = map(float, params)
+            return lambda: random.expovariate(1 / mean)
+    except ValueError:
+        pass
+    raise ValueError(f'invalid defer distribution {spec!r}, use none, uniform:MIN:MAX or exp:MEAN')
+
+
+def pick_functions(config: BenchConfig, functions: List[str]) -> List[str]:
+    """
+    Choose the function of every job according to the mix.
+    """
+    mix = config.mix or {f: 1 for f in functions}
+    unknown = set(mix) - set(functions)
+    if unknown:
+        raise ValueError(f'functions not registered by the worker: {", ".join(sorted(unknown))}')
+    names, weights = zip(*mix.items())
+    return random.choices(names, weights=weights, k=config.jobs)
+
+
+async def redis_counters(redis: AioRedis) -> Tuple[int, int]:
+    """
+    Total commands processed and memory used by the redis server.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.info(section='Stats')
+        pipe.info(section='Memory')
+        stats, memory = await pipe.execute()
+    return int(stats['total_commands_processed']), int(memory['used_memory'])
+
+
+async def enqueue_all(redis: AioRedis, config: BenchConfig, job_ids: List[str], functions: List[str]) -> None:
+    defer = parse_defer(config.defer)
+    payload = ''
+    if config.payload_arg:
+        payload = ''.join(random.choices(string.ascii_letters, k=config.payload_size))
+    jobs = iter(zip(job_ids, functions))
+
+    async def producer() -> None:
+        for job_id, function in jobs:
+            kwargs = dict(config.kwargs.get(function, {}))
+            if config.payload_arg:
+                kwargs[config.payload_arg] = payload
+            await redis.enqueue_job(
+                function, job_id=job_id, queue_name=config.queue_name, defer_by=defer() or None, **kwargs
+            )
+
+    await asyncio.gather(*[producer() for _ in range(config.producers)])
+
+
+async def collect_results(redis: AioRedis, job_ids: List[str]) -> Dict[str, List[float]]:
+    """
+    Fetch the results of the run, delete them and gather per stage latencies in ms.
+    """
+    latencies: Dict[str, List[float]] = {'queue_wait': [], 'run': [], 'end_to_end': []}
+    accept = redis.job_accept
+    for i in range(0, len(job_ids), result_chunk_size):
+        keys = [result_key_prefix + job_id for job_id in job_ids[i:i + result_chunk_size]]
+        for v in await redis.mget(keys):
+            if not v:
+                continue
+            r = deserialize_result(v, deserializer=redis.job_deserializer, accept=accept)
+            if r.queue_wait_ms is not None:
+                latencies['queue_wait'].append(r.queue_wait_ms)
+            if r.run_ms is not None:
+                latencies['run'].append(r.run_ms)
+            # up to the result being recorded, the redis write of the result isn't included
+            if r.due_ms is not None and r.record_ms is not None:
+                latencies['end_to_end'].append(r.record_ms - r.due_ms)
+        await redis.delete(*keys)
+    return latencies
+
+
+async def run_bench(settings_cls: 'WorkerSettingsType', config: BenchConfig) -> Dict[str, Any]:
+    """
+    Enqueue a workload for the functions of a worker settings class, then drain it with a real worker.
+
+    Jobs are all enqueued before the worker starts so memory per queued job can be measured, the worker then
+    runs in burst mode until the queue is empty.
+    """
+    settings = get_kwargs(settings_cls)
+    redis_settings: RedisSettings = settings.get('redis_settings') or RedisSettings()
+    redis = await create_pool(
+        redis_settings,
+        job_serializer=settings.get('job_serializer'),
+        job_deserializer=settings.get('job_deserializer'),
+        accept_codecs=settings.get('accept_codecs', ()),
+        compression=settings.get('compression'),
+    )
+    worker = create_worker(
+        settings_cls, queue_name=config.queue_name, cron_jobs=[], burst=True, handle_signals=False
+    )
+    try:
+        run_id = uuid4().hex[:8]
+        job_ids = [f'bench:{run_id}:{i}' for i in range(config.jobs)]
+        functions = pick_functions(config, [n for n, f in worker.functions.items() if not hasattr(f, 'next_run')])
+
+        commands_before, memory_before = await redis_counters(redis)
+        start = perf_counter()
+        await enqueue_all(redis, config, job_ids, functions)
+        enqueue_time = perf_counter() - start
+        commands_enqueued, memory_enqueued = await redis_counters(redis)
+
+        start = perf_counter()
+        await worker.async_run()
+        drain_time = perf_counter() - start
+        commands_drained, _ = await redis_counters(redis)
+
+        latencies = await collect_results(redis, job_ids)
+    finally:
+        await worker.close()
+        await redis.close()
+
+    report: Dict[str, Any] = {
+        'jobs': config.jobs,
+        'complete': worker.jobs_complete,
+        'failed': worker.jobs_failed,
+        'retried': worker.jobs_retried,
+        'enqueue_jobs_per_s': config.jobs / enqueue_time,
+        'worker_jobs_per_s': config.jobs / drain_time,
+        # the two INFO calls of each measurement are included, which is noise for any realistic number of jobs
+        'enqueue_redis_ops_per_job': (commands_enqueued - commands_before) / config.jobs,
+        'worker_redis_ops_per_job': (commands_drained - commands_enqueued) / config.jobs,
+        'redis_bytes_per_queued_job': (memory_enqueued - memory_before) / config.jobs,
+        'latency_ms': {
+            stage: {
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': max(values),
+            }
+            for stage, values in latencies.items()
+            if values
+        },
+    }
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f'jobs:                   {report["jobs"]} ({report["complete"]} complete, {report["failed"]} failed, '
+        f'{report["retried"]} retried)',
+        f'enqueue throughput:     {report["enqueue_jobs_per_s"]:0.1f} jobs/s',
+        f'worker throughput:      {report["worker_jobs_per_s"]:0.1f} jobs/s',
+        f'redis ops per job:      {report["enqueue_redis_ops_per_job"]:0.2f} enqueue, '
+        f'{report["worker_redis_ops_per_job"]:0.2f} worker',
+        f'redis memory per job:   {report["redis_bytes_per_queued_job"]:0.0f} bytes queued',
+    ]
+    for stage, p in report['latency_ms'].items():
+        lines.append(
+            f'{stage + " latency:":<24}p50={p["p50"]:0.1f}ms p90={p["p90"]:0.1f}ms p99={p["p99"]:0.1f}ms '
+            f'max={p["max"]:0.1f}ms'
+        )
+    return '\n'.join(lines)
+
+
+def parse_mix(values: Tuple[str, ...]) -> Dict[str, float]:
+    mix = {}
+    for v in values:
+        name, _, weight = v.partition('=')
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            pass
+        if not name or not 0 <= mix.get(name, -1) < float('inf'):
+            raise ValueError(f'invalid mix {v!r}, use FUNCTION or FUNCTION=WEIGHT with a non-negative WEIGHT')
+    return mix
+
+
+def parse_kwargs(values: Tuple[str, ...]) -> Dict[str, Dict[str, Any]]:
+    kwargs = {}
+    for v in values:
+        name, _, kw = v.partition('=')
+        try:
+            kwargs[name] = json.loads(kw)
+        except ValueError:
+            pass
+        if not name or not isinstance(kwargs.get(name), dict):
+            raise ValueError(f'invalid kwargs {v!r}, use FUNCTION=JSON_OBJECT')
+    return kwargs
@@ -0,0 +1,260 @@
+"""
+Large job arguments stored once under a content hash instead of being copied into every job.
+
+Top level args and kwargs whose serialized size reaches ``AioRedis.blob_threshold`` are replaced in the job by a
+:class:`aiorq.serialize.BlobRef` and stored at ``aiorq:blob:<sha256>``, the job lists the positions of its
+references so an argument which only looks like one isn't resolved. A counter at
+``aiorq:blob-refs:<sha256>`` tracks how many enqueued jobs use the blob, it's decremented when a job finishes and
+the blob deleted when it reaches zero. Both keys expire no earlier than the last job referencing them, so blobs of
+jobs which never run don't leak.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from aioredis import Redis
+
+from .constants import blob_key_prefix, blob_refs_key_prefix, job_key_prefix, result_key_prefix
+from .exception import JobExecutionFailed, SerializationError
+from .serialize import BlobRef, Compression, Deserializer, Serializer, dumps, loads
+
+logger = logging.getLogger('aiorq.blobs')
+
+# number of blob hashes a producer remembers as already stored, so it can skip sending them again
+stored_blobs_max = 1024
+
+# returns -1 if the job or its result already exists, 0 without writing anything if a blob sent without payload
+# is missing, otherwise stores the blobs, takes a reference on each and enqueues the job
+enqueue_script = """
+if redis.call('exists', KEYS[1], KEYS[2]) > 0 then return -1 end
+local n = (#KEYS - 3) / 2
+for i = 1, n do
+  if ARGV[5 + i] == '' and redis.call('exists', KEYS[2 + 2 * i]) == 0 then return 0 end
+end
+local ttl = tonumber(ARGV[5])
+for i = 1, n do
+  local blob, refs = KEYS[2 + 2 * i], KEYS[3 + 2 * i]
+  if redis.call('exists', blob) == 0 then redis.call('set', blob, ARGV[5 + i]) end
+  redis.call('incr', refs)
+  if redis.call('pttl', blob) < ttl then
+    redis.call('pexpire', blob, ttl)
+    redis.call('pexpire', refs, ttl)
+  end
+end
+redis.call('psetex', KEYS[1], ARGV[2], ARGV[1])
+redis.call('zadd', KEYS[3], ARGV[4], ARGV[3])
+return 1
+"""
+
+release_script = """
+for i = 1, #KEYS, 2 do
+  if redis.call('decr', KEYS[i + 1]) <= 0 then redis.call('del', KEYS[i], KEYS[i + 1]) end
+end
+"""
+
+
+def is_blob_ref(v: Any) -> bool:
+    return isinstance(v, BlobRef)
+
+
+def estimate_size(v: Any, limit: int) -> int:
+    """
+    Rough serialized size of ``v``, counting stops once ``limit`` is reached so large values aren't walked in full.
+    """
+    size = 0
+    stack = [v]
+    while stack and size < limit:
+        v = stack.pop()
+        if isinstance(v, (str, bytes, bytearray)):
+            size += len(v) + 2
+        elif isinstance(v, dict):
+            size += 2
+            stack.extend(v.keys())
+            stack.extend(v.values())
+        elif isinstance(v, (list, tuple)):
+            size += 2
+            stack.extend(v)
+        else:
+            size += 8
+    return size
+
+
+def offload_blobs(
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        threshold: int,
+        serializer: Optional[Serializer],
+        compression: Optional[Compression],
+) -> Tuple[Tuple[Any, ...], Dict[str, Any], Dict[str, bytes]]:
+    """
+    Replace large top level arguments with blob references, returns the new args and kwargs and the payload
+    of each blob keyed by hash.
+    """
+    blobs: Dict[str, bytes] = {}
+    # named codecs write bytes like arguments as raw envelope segments, see :data:`aiorq.serialize.buffer_ref`
+    raw_buffers = isinstance(serializer, str)
+
+    def offload(v: Any) -> Any:
+        if not isinstance(v, (str, bytes, list, tuple, dict)) or (isinstance(v, (str, bytes)) and len(v) < threshold):
+            return v
+        if raw_buffers and isinstance(v, bytes):
+            return v
+        # containers are only serialized once they're likely to be offloaded, the payload is then the blob's
+        if isinstance(v, (list, tuple, dict)) and estimate_size(v, threshold) < threshold:
+            return v
+        try:
+            payload = dumps(v, serializer, compression)
+        except Exception as e:
+            raise SerializationError('unable to serialize blob argument') from e
+        if len(payload) < threshold:
+            return v
+        if isinstance(payload, str):
+            payload = payload.encode()
+        digest = hashlib.sha256(payload).hexdigest()
+        blobs[digest] = payload
+        return BlobRef(digest)
+
+    args = tuple(offload(a) for a in args)
+    kwargs = {k: offload(v) for k, v in kwargs.items()}
+    return args, kwargs, blobs
+
+
+def blob_refs(args: Iterable[Any], kwargs: Dict[str, Any]) -> Tuple[str, ...]:
+    """
+    Hashes of the distinct blobs referenced by a job.
+    """
+    refs = [v.digest for v in (*args, *kwargs.values()) if is_blob_ref(v)]
+    return tuple(dict.fromkeys(refs))
+
+
+def enqueue_with_blobs(
+        client: Redis,
+        job_id: str,
+        queue_name: str,
+        job: bytes,
+        score: int,
+        expires_ms: int,
+        blobs: Dict[str, bytes],
+        stored: Set[str],
+) -> Any:
+    """
+    Run :data:`enqueue_script` on ``client``, which may be a pipeline, payloads of blobs in ``stored`` are not sent.
+    """
+    keys: List[str] = [job_key_prefix + job_id, result_key_prefix + job_id, queue_name]
+    payloads: List[bytes] = []
+    for digest, payload in blobs.items():
+        keys += [blob_key_prefix + digest, blob_refs_key_prefix + digest]
+        payloads.append(b'' if digest in stored else payload)
+    return client.eval(enqueue_script, len(keys), *keys, job, expires_ms, job_id, score, expires_ms, *payloads)
+
+
+def release_blobs(client: Redis, digests: Iterable[str]) -> None:
+    """
+    Drop the references a finished job holds, ``client`` is expected to be a pipeline.
+    """
+    keys = []
+    for digest in digests:
+        keys += [blob_key_prefix + digest, blob_refs_key_prefix + digest]
+    if keys:
+        client.eval(release_script, len(keys), *keys)
+
+
+class BlobCache:
+    """
+    Least recently used cache of decoded blobs held by a worker so each distinct blob is fetched once,
+    concurrent jobs needing the same missing blob share a single fetch.
+
+    Values are shared between jobs, functions must not modify blob arguments in place.
+
+    :param max_size: maximum total size of the cached blobs' payloads in bytes
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._values: 'OrderedDict[str, Tuple[Any, int]]' = OrderedDict()
+        self._pending: Dict[str, 'asyncio.Future[Dict[str, Any]]'] = {}
+
+    def _store(self, digest: str, value: Any, size: int) -> None:
+        if size > self.max_size:
+            return
+        self._values[digest] = value, size
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._values.popitem(last=False)
+            self.size -= evicted_size
+
+    async def get_many(
+            self,
+            redis: Redis,
+            digests: Iterable[str],
+            deserializer: Optional[Deserializer] = None,
+            accept: Optional[FrozenSet[str]] = None,
+    ) -> Dict[str, Any]:
+        values: Dict[str, Any] = {}
+        fetch: List[str] = []
+        waits: Dict[str, 'asyncio.Future[Dict[str, Any]]'] = {}
+        for digest in digests:
+            cached = self._values.get(digest)
+            if cached is not None:
+                self._values.move_to_end(digest)
+                values[digest] = cached[0]
+                self.hits += 1
+            elif digest in self._pending:
+                waits[digest] = self._pending[digest]
+            else:
+                fetch.append(digest)
+
+        if fetch:
+            self.misses += len(fetch)
+            fut: 'asyncio.Future[Dict[str, Any]]' = asyncio.get_event_loop().create_future()
+            self._pending.update(dict.fromkeys(fetch, fut))
+            try:
+                fetched = {}
+                payloads = await redis.mget([blob_key_prefix + digest for digest in fetch])
+                for digest, payload in zip(fetch, payloads):
+                    if payload is None:
+                        raise JobExecutionFailed(f'blob {digest} not found')
+                    fetched[digest] = loads(payload, deserializer, accept)
+                    self._store(digest, fetched[digest], len(payload))
+            except Exception as e:
+                fut.set_exception(e)
+                # mark the exception retrieved, there may be no other job waiting for it
+                fut.exception()
+                raise
+            else:
+                fut.set_result(fetched)
+                values.update(fetched)
+            finally:
+                if not fut.done():
+                    fut.cancel()
+                for digest in fetch:
+                    del self._pending[digest]
+
+        for digest, fut in waits.items():
+            values[digest] = (await asyncio.shield(fut))[digest]
+        return values
+
+    async def resolve(
+            self,
+            redis: Redis,
+            args: Tuple[Any, ...],
+            kwargs: Dict[str, Any],
+            digests: Iterable[str],
+            deserializer: Optional[Deserializer] = None,
+            accept: Optional[FrozenSet[str]] = None,
+    ) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+        """
+        Replace blob references in args and kwargs with their values.
+        """
+        values = await self.get_many(redis, digests, deserializer, accept)
+        args = tuple(values[a.digest] if is_blob_ref(a) else a for a in args)
+        kwargs = {k: values[v.digest] if is_blob_ref(v) else v for k, v in kwargs.items()}
+        return args, kwargs
+
+    def __repr__(self) -> str:
+        return f'<BlobCache {len(self._values)} blobs {self.size} bytes hits={self.hits} misses={self.misses}>'
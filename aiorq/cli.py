@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import json
 import logging.config
 import os
+import random
 import sys
 from signal import Signals
-from typing import TYPE_CHECKING, cast
+from typing import TYPE_CHECKING, Any, Callable, cast
 
 import click
 import uvicorn
@@ -12,6 +14,7 @@ from click import Context
 from pydantic.utils import import_string
 
 from .app_server import create_app
+from .bench import BenchConfig, format_report, parse_defer, parse_kwargs, parse_mix, run_bench
 from .connections import create_pool
 from .logs import default_log_config
 from .version import __version__
@@ -24,6 +27,10 @@ burst_help = 'Batch mode: exit once no jobs are found in any queue.'
 health_check_help = 'Health Check: run a health check and exit.'
 watch_help = 'Watch a directory and reload the worker upon changes.'
 verbose_help = 'Enable verbose output.'
+profile_limit_help = 'Number of calls to show, ordered by cumulative time.'
+bench_mix_help = 'Job mix as FUNCTION=WEIGHT, may be repeated, defaults to all functions equally.'
+bench_kwargs_help = 'Keyword arguments for a function as FUNCTION=JSON, may be repeated.'
+bench_defer_help = 'Defer distribution in seconds: none, uniform:MIN:MAX or exp:MEAN.'
 
 sys.path.append(os.getcwd())
 
@@ -85,6 +92,82 @@ def server(ctx: Context, host: str, port: int):
     uvicorn.run(app=app, host=host, port=port, debug=True)
 
 
+def _parse_option(parse: Callable[[Any], Any], value: Any, param_hint: str) -> Any:
+    try:
+        return parse(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint=param_hint)
+
+
+@cli.command(help="Drive a synthetic workload through the worker's functions and report performance.")
+@click.option('--jobs', default=1000, show_default=True, help='Total number of jobs.')
+@click.option('--producers', default=4, show_default=True, help='Number of concurrent producers.')
+@click.option('--mix', multiple=True, help=bench_mix_help)
+@click.option('--kwargs', 'kwargs_', multiple=True, help=bench_kwargs_help)
+@click.option('--payload-size', default=0, show_default=True, help='Size in bytes of the payload argument.')
+@click.option('--payload-arg', default=None, help='Keyword argument receiving the payload, no payload if omitted.')
+@click.option('--defer', default='none', show_default=True, help=bench_defer_help)
+@click.option('--queue', default='aiorq:bench', show_default=True, help='Queue used for the run.')
+@click.option('--seed', default=None, type=int, help='Random seed for a reproducible workload.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+@click.pass_context
+def bench(
+        ctx: Context, jobs: int, producers: int, mix: tuple, kwargs_: tuple, payload_size: int, payload_arg: str,
+        defer: str, queue: str, seed: int, as_json: bool,
+):
+    """
+    CLI to load test the worker functions, eg. for sizing a fleet.
+    """
+    # 在导入 worker 设置和构建配置之前检查参数
+    mix_ = _parse_option(parse_mix, mix, '--mix')
+    kwargs = _parse_option(parse_kwargs, kwargs_, '--kwargs')
+    _parse_option(parse_defer, defer, '--defer')
+    worker_settings_ = cast('WorkerSettingsType', import_string(ctx.obj["worker_settings"]))
+    config = BenchConfig(
+        jobs=jobs,
+        producers=producers,
+        mix=mix_,
+        kwargs=kwargs,
+        payload_size=payload_size,
+        payload_arg=payload_arg,
+        defer=defer,
+        queue_name=queue,
+    )
+    if seed is not None:
+        random.seed(seed)
+    report = asyncio.get_event_loop().run_until_complete(run_bench(worker_settings_, config))
+    click.echo(json.dumps(report, indent=2) if as_json else format_report(report))
+
+
+@cli.command(help="Show the slowest calls of a profiled function.")
+@click.argument('function', required=True)
+@click.option('--limit', default=20, show_default=True, help=profile_limit_help)
+@click.pass_context
+def profile(ctx: Context, function: str, limit: int):
+    """
+    CLI to print aggregated profiling stats of a job function.
+    """
+    worker_settings_ = cast('WorkerSettingsType', import_string(ctx.obj["worker_settings"]))
+    rows = asyncio.get_event_loop().run_until_complete(_get_profile(worker_settings_, function, limit))
+    if not rows:
+        click.echo(f'no profile samples found for {function!r}')
+        return
+    click.echo(f'{"ncalls":>12} {"tottime":>10} {"cumtime":>10}  function')
+    for row in rows:
+        calls = str(row['calls'])
+        if row['primitive_calls'] != row['calls']:
+            calls += f'/{row["primitive_calls"]}'
+        click.echo(f'{calls:>12} {row["tottime"]:>10.4f} {row["cumtime"]:>10.4f}  {row["function"]}')
+
+
+async def _get_profile(worker_settings: 'WorkerSettingsType', function: str, limit: int):
+    redis = await create_pool(getattr(worker_settings, 'redis_settings', None))
+    try:
+        return await redis.get_job_profile(function, limit)
+    finally:
+        await redis.close()
+
+
 async def watch_reload(path: str, worker_settings: 'WorkerSettingsType') -> None:
     try:
         from watchgod import awatch
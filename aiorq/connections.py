@@ -6,8 +6,9 @@ import ssl
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from operator import attrgetter
-from typing import Any, Callable, Generator, List, Optional, Tuple, Union, Dict
-from urllib.parse import urlparse
+from typing import Any, AsyncGenerator, Callable, Dict, FrozenSet, Generator, List, Optional, Sequence, Set, Tuple, \
+    Union
+from urllib.parse import quote, urlparse
 from uuid import uuid4
 
 from aioredis import Redis, ConnectionPool
@@ -15,12 +16,28 @@ from aioredis.exceptions import RedisError, WatchError
 from aioredis.sentinel import Sentinel
 from pydantic.validators import make_arbitrary_type_validator
 
-from .constants import default_queue_name, default_worker_name, job_key_prefix, result_key_prefix, worker_key, \
-    health_check_key_suffix, func_key
+from .constants import default_queue_name, default_worker_name, job_key_prefix, result_key_prefix, workers_key, \
+    workers_health_key, workers_seen_key, worker_stale_after, func_key, results_index_key_prefix, results_filter_key_prefix, \
+    results_filters_key_prefix, in_progress_key_prefix
+from .blobs import enqueue_with_blobs, offload_blobs, stored_blobs_max
+from .hooks import Hooks, JobEvent
 from .jobs import Job
-from .serialize import Deserializer, Serializer, deserialize_job, serialize_job, deserialize_func, deserialize_worker
-from .specs import JobDef, JobResult
-from .utils import timestamp_ms, to_ms, to_unix_ms, ms_to_datetime
+from .profiler import top_functions
+from .serialize import (
+    Compression,
+    Deserializer,
+    Serializer,
+    accepted_codecs,
+    deserialize_func,
+    deserialize_job,
+    deserialize_result,
+    deserialize_worker,
+    envelope_size,
+    load_health,
+    serialize_job,
+)
+from .specs import JobDef, JobResult, JobStatus, JobWorker
+from .utils import timestamp_ms, to_ms, to_unix_ms
 
 logger = logging.getLogger('aiorq.connections')
 
@@ -74,13 +91,115 @@ class RedisSettings:
 # extra time after the job is expected to start when the job key should expire, 1 day in ms
 expires_extra_ms = 86_400_000
 
+# bytes read with GETRANGE when only the header of a job or result is needed, enough for the header of most
+header_prefetch_size = 512
+
+# COUNT hint of each SCAN when listing results, also about the number of results read per MGET
+result_scan_count = 500
+
+# jobs per page when listing queued jobs, each page is read with one pipeline
+queued_jobs_page_size = 500
+
+
+def results_index_key(queue_name: str, field: Optional[str] = None, value: Any = None) -> str:
+    """
+    Key of the finish time index of a queue's results, with ``field`` (``function``, ``worker`` or ``success``) the
+    index of only the results with that value.
+
+    Those are kept apart under :func:`results_filter_prefix` so they can't be mistaken for the index of a queue
+    whose name contains ``:function:``.
+    """
+    if field is None:
+        return results_index_key_prefix + queue_name
+    return f'{results_filter_prefix(queue_name)}{field}:{value}'
+
+
+def results_filter_prefix(queue_name: str) -> str:
+    """
+    Prefix of the keys of all the filter indexes of a queue, the queue name is quoted so it contains neither
+    ``:`` nor glob characters and the prefix can be used in a SCAN pattern.
+    """
+    return f'{results_filter_key_prefix}{quote(queue_name, safe="")}:'
+
+
+def results_filters_key(queue_name: str) -> str:
+    """
+    Key of the set of a queue's filter indexes, see :func:`index_result`.
+    """
+    return results_filters_key_prefix + queue_name
+
+
+def index_result(
+        client: Redis,
+        queue_name: str,
+        job_id: str,
+        finish_ms: int,
+        function: Optional[str],
+        worker_name: str,
+        success: bool,
+) -> None:
+    """
+    Add a result to the finish time indexes of its queue, ``client`` is expected to be a pipeline.
+
+    The filter indexes are recorded in :func:`results_filters_key` so they can be trimmed, including those of
+    previous worker names and removed functions, without scanning the keyspace.
+    """
+    score = {job_id: finish_ms}
+    client.zadd(results_index_key(queue_name), score)
+    filters = [
+        results_index_key(queue_name, 'worker', worker_name),
+        results_index_key(queue_name, 'success', int(success)),
+    ]
+    if function is not None:
+        filters.append(results_index_key(queue_name, 'function', function))
+    for key in filters:
+        client.zadd(key, score)
+    client.sadd(results_filters_key(queue_name), *filters)
+
+
+# drops the entries before ARGV[1] from the filter indexes KEYS[2:] and the emptied indexes from the set KEYS[1],
+# atomically so an index can't be dropped from the set while a result is added to it
+trim_filters_script = """
+for i = 2, #KEYS do
+  redis.call('zremrangebyscore', KEYS[i], '-inf', ARGV[1])
+  if redis.call('exists', KEYS[i]) == 0 then
+    redis.call('srem', KEYS[1], KEYS[i])
+  end
+end
+return 0
+"""
+
+
+async def trim_results_indexes(redis: Redis, queue_name: str, cutoff: int) -> None:
+    """
+    Drop the results which finished before ``cutoff`` from the finish time indexes of a queue.
+    """
+    await redis.zremrangebyscore(results_index_key(queue_name), '-inf', cutoff)
+    filters_key = results_filters_key(queue_name)
+    cursor = 0
+    while True:
+        cursor, keys = await redis.sscan(filters_key, cursor, count=result_scan_count)
+        if keys:
+            await redis.eval(trim_filters_script, len(keys) + 1, filters_key, *keys, cutoff)
+        if not cursor:
+            return
+
 
 class AioRedis(Redis):  # type: ignore
     """
     :param redis_settings: 一个实例。连接。重新定义设置。
-    :param job_serializer:将Python对象序列化为字节的函数,默认为pickle。
-    :param job_反序列化器:将字节反序列化为Python对象的函数,默认为pickle。
+    :param job_serializer:将Python对象序列化为字节的函数,或已注册编解码器的名称(json, pickle, msgpack, orjson),
+        使用名称时数据带有一个字节的格式标记,默认为不带标记的 json;使用名称时顶层的 bytes 参数以原始字节存储,
+        任务函数收到的是 memoryview,默认的 json 不支持 bytes 参数,嵌套的 bytes 只有 pickle 和 msgpack 支持
+    :param job_deserializer:反序列化不带格式标记数据的函数或编解码器名称
+    :param accept_codecs:除 ``job_serializer`` 和 ``job_deserializer`` 以外允许解码的编解码器名称,
+        带有其他格式标记的数据会被拒绝,见 :func:`aiorq.serialize.accepted_codecs`
     :param default_queue_name:要使用的默认队列名称。
+    :param hooks:任务生命周期钩子,见 :class:`aiorq.hooks.Hooks`
+    :param compression:任务数据的压缩设置,见 :class:`aiorq.serialize.Compression`,默认不压缩
+    :param queue_compression:按队列名称覆盖 ``compression``,值为 None 表示该队列不压缩
+    :param blob_threshold:序列化后(估算)达到该字节数的顶层参数只按内容哈希存储一次,任务中仅保存引用,
+        见 :mod:`aiorq.blobs`,默认不启用
     :param kwargs:关键字参数
     """
 
@@ -89,18 +208,39 @@ class AioRedis(Redis):  # type: ignore
             pool_or_conn: Optional[ConnectionPool] = None,
             job_serializer: Optional[Serializer] = None,
             job_deserializer: Optional[Deserializer] = None,
+            accept_codecs: Sequence[str] = (),
             default_queue_name: str = default_queue_name,
             default_worker_name: str = default_worker_name,
+            hooks: Optional[Hooks] = None,
+            compression: Optional[Compression] = None,
+            queue_compression: Optional[Dict[str, Optional[Compression]]] = None,
+            blob_threshold: Optional[int] = None,
             **kwargs: Any,
     ) -> None:
         self.job_serializer = job_serializer
         self.job_deserializer = job_deserializer
+        self.accept_codecs = accept_codecs
+        self.hooks = Hooks() if hooks is None else hooks
+        self.compression = compression
+        self.queue_compression = queue_compression or {}
+        self.blob_threshold = blob_threshold
+        # 已确认存储过的 blob 哈希,再次入队时不再发送内容
+        self.stored_blobs: Set[str] = set()
         self.queue_name = default_queue_name
         self.worker_name = default_worker_name
         if pool_or_conn:
             kwargs['connection_pool'] = pool_or_conn
         super().__init__(**kwargs)
 
+    @property
+    def job_accept(self) -> FrozenSet[str]:
+        # 允许解码的编解码器
+        return accepted_codecs(self.job_serializer, self.job_deserializer, self.accept_codecs)
+
+    def compression_for(self, queue_name: str) -> Optional[Compression]:
+        # 队列单独设置的压缩优先
+        return self.queue_compression.get(queue_name, self.compression)
+
     # 任务加入 redis 队列
     async def enqueue_job(
             self,
@@ -160,41 +300,310 @@ class AioRedis(Redis):  # type: ignore
 
             expires_ms = expires_ms or score - enqueue_time_ms + expires_extra_ms
 
+            if self.hooks.before_enqueue:
+                await self.hooks.emit(JobEvent(
+                    'before_enqueue', job_id, queue_name, function=function, job_try=job_try, score=score,
+                    enqueue_time_ms=enqueue_time_ms,
+                ))
+
+            compression = self.compression_for(queue_name)
+            blobs: Dict[str, bytes] = {}
+            if self.blob_threshold is not None:
+                args, kwargs, blobs = offload_blobs(
+                    args, kwargs, self.blob_threshold, self.job_serializer, compression
+                )
             job = serialize_job(function, args, kwargs, job_try, enqueue_time_ms, queue_name,
-                                serializer=self.job_serializer)
+                                serializer=self.job_serializer, compression=compression)
 
             # redis 批处理执行 添加任务id到 redis 队列
             pipe.multi()
 
-            # 如果到达 expires_ms 这个时间还未执行 redis 超市删除key 即任务取消运行
-            pipe.psetex(job_key, expires_ms, job)
-            pipe.zadd(queue_name, {job_id: score})
+            if blobs:
+                enqueue_with_blobs(pipe, job_id, queue_name, job, score, expires_ms, blobs, self.stored_blobs)
+            else:
+                # 如果到达 expires_ms 这个时间还未执行 redis 超市删除key 即任务取消运行
+                pipe.psetex(job_key, expires_ms, job)
+                pipe.zadd(queue_name, {job_id: score})
             try:
-                await pipe.execute()
+                r = await pipe.execute()
             except WatchError:
                 # job got enqueued since we checked 'job_exists'
                 return None
-        return Job(job_id, redis=self, _queue_name=queue_name, _deserializer=self.job_deserializer)
 
-    # 根据 key 获取工作结果
-    async def _get_job_result(self, key: bytes) -> JobResult:
-        # 获取组合键的后半部分
-        job_id = key[len(result_key_prefix):]
-        job_id = job_id.decode()
-        job = Job(job_id, self, _deserializer=self.job_deserializer)
-        r = await job.result_info()
-        if r is None:
-            raise KeyError(f'job "{key}" not found')
-        r.job_id = job_id
-        return r
+        if blobs:
+            if r[0] == 0:
+                # 认为已存储的 blob 已被删除,发送全部内容重试
+                self.stored_blobs.difference_update(blobs)
+                r = [await enqueue_with_blobs(self, job_id, queue_name, job, score, expires_ms, blobs, set())]
+            if r[0] == -1:
+                return None
+            if len(self.stored_blobs) > stored_blobs_max:
+                self.stored_blobs.clear()
+            self.stored_blobs.update(blobs)
+
+        if self.hooks.after_enqueue:
+            await self.hooks.emit(JobEvent(
+                'after_enqueue', job_id, queue_name, function=function, job_try=job_try, score=score,
+                enqueue_time_ms=enqueue_time_ms,
+            ))
+        return Job(
+            job_id, redis=self, _queue_name=queue_name, _deserializer=self.job_deserializer, _accept=self.job_accept
+        )
 
-    async def all_job_results(self) -> List[JobResult]:
+    async def enqueue_job_batch(
+            self,
+            function: str,
+            runs: Sequence[Tuple[Optional[str], datetime]],
+            *args: Any,
+            queue_name: Optional[str] = None,
+            expires: Union[None, int, float, timedelta] = None,
+            job_try: Optional[int] = None,
+            **kwargs: Any,
+    ) -> List[Optional[Job]]:
         """
-        获取所有工作结果
+        Enqueue the same call once per ``(job_id, defer_until)`` in ``runs``, in one pipeline round trip.
+        每个作业和 enqueue_job 一样原子地检查作业和结果是否存在,已存在的返回 None
+        :param runs: 作业id(为空时生成)和运行时间
+        其他参数同 enqueue_job
         """
-        keys = await self.keys(f'{result_key_prefix}*')
-        results = await asyncio.gather(*[self._get_job_result(k) for k in keys])
-        return sorted(results, key=attrgetter('enqueue_time'))
+        if queue_name is None:
+            queue_name = self.queue_name
+        expires_ms = to_ms(expires)
+        enqueue_time_ms = timestamp_ms()
+        compression = self.compression_for(queue_name)
+        blobs: Dict[str, bytes] = {}
+        if self.blob_threshold is not None:
+            args, kwargs, blobs = offload_blobs(args, kwargs, self.blob_threshold, self.job_serializer, compression)
+        job = serialize_job(function, args, kwargs, job_try, enqueue_time_ms, queue_name,
+                            serializer=self.job_serializer, compression=compression)
+
+        jobs = [(job_id or uuid4().hex, to_unix_ms(defer_until)) for job_id, defer_until in runs]
+        if self.hooks.before_enqueue:
+            for job_id, score in jobs:
+                await self.hooks.emit(JobEvent(
+                    'before_enqueue', job_id, queue_name, function=function, job_try=job_try, score=score,
+                    enqueue_time_ms=enqueue_time_ms,
+                ))
+        def job_expires_ms(score: int) -> int:
+            return expires_ms or max(score - enqueue_time_ms, 0) + expires_extra_ms
+
+        async with self.pipeline(transaction=False) as pipe:
+            stored: Set[str] = set()
+            for job_id, score in jobs:
+                # 第一个作业发送 blob 内容,后面的作业在同一管道中执行,只增加引用
+                enqueue_with_blobs(pipe, job_id, queue_name, job, score, job_expires_ms(score), blobs, stored)
+                stored = set(blobs)
+            r = await pipe.execute()
+        retry = [i for i, created in enumerate(r) if created == 0]
+        if retry:
+            # 发送 blob 内容的作业已存在时没有存储 blob,后面的作业发送全部内容重试
+            async with self.pipeline(transaction=False) as pipe:
+                for i in retry:
+                    job_id, score = jobs[i]
+                    enqueue_with_blobs(pipe, job_id, queue_name, job, score, job_expires_ms(score), blobs, set())
+                for i, created in zip(retry, await pipe.execute()):
+                    r[i] = created
+
+        enqueued = []
+        accept = self.job_accept
+        for (job_id, score), created in zip(jobs, r):
+            if created != 1:
+                enqueued.append(None)
+                continue
+            if self.hooks.after_enqueue:
+                await self.hooks.emit(JobEvent(
+                    'after_enqueue', job_id, queue_name, function=function, job_try=job_try, score=score,
+                    enqueue_time_ms=enqueue_time_ms,
+                ))
+            enqueued.append(
+                Job(job_id, redis=self, _queue_name=queue_name, _deserializer=self.job_deserializer, _accept=accept)
+            )
+        return enqueued
+
+    async def _get_header(self, key: Union[str, bytes]) -> Optional[bytes]:
+        """
+        读取数据时只读取信封头部,不是信封格式的旧数据读取全部
+        """
+        v = await self.getrange(key, 0, header_prefetch_size - 1)
+        if not v:
+            return None
+        size = envelope_size(v)
+        if size is None:
+            return v if len(v) < header_prefetch_size else await self.get(key)
+        if size > len(v):
+            v = await self.getrange(key, 0, size - 1)
+        return v
+
+    async def _get_headers(self, keys: Sequence[Union[str, bytes]]) -> List[Optional[bytes]]:
+        """
+        _get_header 的批量版本,每轮读取只需一次管道往返
+        """
+        async with self.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.getrange(key, 0, header_prefetch_size - 1)
+            values: List[Optional[bytes]] = await pipe.execute()
+        return await self._complete_headers(keys, values)
+
+    async def _complete_headers(
+            self, keys: Sequence[Union[str, bytes]], values: List[Optional[bytes]]
+    ) -> List[Optional[bytes]]:
+        """
+        补全预读的头部,头部超过预读长度的信封和旧数据需要再读一次
+        """
+        incomplete = []
+        async with self.pipeline(transaction=False) as pipe:
+            for i, v in enumerate(values):
+                if not v:
+                    values[i] = None
+                    continue
+                size = envelope_size(v)
+                if size is None and len(v) >= header_prefetch_size:
+                    pipe.get(keys[i])
+                elif size is not None and size > len(v):
+                    pipe.getrange(keys[i], 0, size - 1)
+                else:
+                    continue
+                incomplete.append(i)
+            if incomplete:
+                for i, v in zip(incomplete, await pipe.execute()):
+                    values[i] = v or None
+        return values
+
+    async def iter_job_results(
+            self, *, with_body: bool = True, count: int = result_scan_count
+    ) -> AsyncGenerator[JobResult, None]:
+        """
+        逐批获取工作结果,用 SCAN 遍历结果键,不像 KEYS 一样阻塞 redis,每批键用一次 MGET 读取
+        结果没有顺序,遍历期间写入的结果可能不包含在内,SCAN 也可能返回同一个结果两次
+        :param with_body: 见 :meth:`all_job_results`
+        :param count: 每次 SCAN 的 COUNT,即每批大约检查的键数量
+        """
+        accept = self.job_accept
+        cursor = 0
+        while True:
+            cursor, keys = await self.scan(cursor, match=f'{result_key_prefix}*', count=count)
+            if keys:
+                values = await self.mget(keys) if with_body else await self._get_headers(keys)
+                for key, v in zip(keys, values):
+                    if not v:
+                        # 遍历后已过期
+                        continue
+                    r = deserialize_result(v, deserializer=self.job_deserializer, accept=accept, with_body=with_body)
+                    r.job_id = key[len(result_key_prefix):].decode()
+                    yield r
+            if not cursor:
+                return
+
+    async def all_job_results(self, *, with_body: bool = True) -> List[JobResult]:
+        """
+        获取所有工作结果,按入队时间排序,见 :meth:`iter_job_results`
+        :param with_body:为 False 时只解码头部, ``args``, ``kwargs`` 和 ``result`` 为 None,
+            可用 :meth:`aiorq.jobs.Job.result_info` 按需读取。只有以命名编解码器写入的数据有单独的头部,
+            默认的 json 和自定义序列化函数写入的数据仍然完整读取和解码,只是返回时不带这些字段
+        """
+        results = {r.job_id: r async for r in self.iter_job_results(with_body=with_body)}
+        return sorted(results.values(), key=attrgetter('enqueue_ms'))
+
+    async def job_results_page(
+            self,
+            queue_name: Optional[str] = None,
+            *,
+            function: Optional[str] = None,
+            worker_name: Optional[str] = None,
+            success: Optional[bool] = None,
+            limit: int = 50,
+            before: Optional[int] = None,
+            before_id: Optional[str] = None,
+            after: Optional[int] = None,
+            with_body: bool = True,
+    ) -> List[JobResult]:
+        """
+        按完成时间从新到旧分页获取队列的工作结果,从每个队列的结果索引读取,不需要遍历所有结果
+        同一毫秒完成的结果按作业id倒序排列,返回结果的 ``score`` 为索引中的完成时间
+        :param function: 只返回该函数的结果
+        :param worker_name: 只返回该 worker 的结果
+        :param success: 只返回成功或失败的结果,多个条件时读取最小的筛选索引并检查作业是否在其他索引中
+        :param limit: 每页数量
+        :param before: 只返回在该 unix 毫秒时间之前完成的结果
+        :param before_id: 与 ``before`` 一起作为游标,也返回在 ``before`` 同一毫秒完成且作业id更小的结果,
+            下一页传入上一页最后一个结果的 ``score`` 和 ``job_id``,同一毫秒完成的结果跨页也不会遗漏
+        :param after: 只返回在该 unix 毫秒时间之后完成的结果
+        :param with_body: 见 :meth:`all_job_results`
+        """
+        queue_name = queue_name or self.queue_name
+        index_key = results_index_key(queue_name)
+        filters = [
+            results_index_key(queue_name, field, value)
+            for field, value in (
+                ('function', function),
+                ('worker', worker_name),
+                ('success', None if success is None else int(success)),
+            )
+            if value is not None
+        ]
+        source, others = (filters or [index_key])[0], filters[1:]
+        if others:
+            # 多个条件时按分数读取最小的索引,再检查作业是否在其他索引中,不求完整的交集
+            async with self.pipeline(transaction=False) as pipe:
+                for key in filters:
+                    pipe.zcard(key)
+                sizes = await pipe.execute()
+            source, *others = [key for _, key in sorted(zip(sizes, filters))]
+
+        max_score: Union[str, float] = '+inf' if before is None else f'({before}'
+        min_score = '-inf' if after is None else f'({after}'
+        # 游标为分数和作业id,分数等于游标的作业只返回id更小的,ties 为每批从游标分数开始时需要多读的数量上限
+        cursor_id: Optional[bytes] = None
+        ties = 0
+        if before is not None and before_id is not None:
+            max_score, cursor_id = before, before_id.encode()
+            ties = await self.zcount(source, before, before)
+        results: List[JobResult] = []
+        accept = self.job_accept
+        while len(results) < limit:
+            num = limit - len(results)
+            if others:
+                num = max(num, result_scan_count)
+            batch = await self.zrevrangebyscore(source, max_score, min_score, start=0, num=num + ties, withscores=True)
+            fetched = len(batch)
+            if cursor_id is not None:
+                batch = [(job_id, score) for job_id, score in batch if score != max_score or job_id < cursor_id]
+            if not batch:
+                break
+            # 批次之间完成的结果分数更高,不会使同一页出现重复
+            last_score = batch[-1][1]
+            ties = (fetched - len(batch) if last_score == max_score else 0) + sum(s == last_score for _, s in batch)
+            max_score, cursor_id = last_score, batch[-1][0]
+
+            if others:
+                async with self.pipeline(transaction=False) as pipe:
+                    for job_id, _ in batch:
+                        for key in others:
+                            pipe.zscore(key, job_id)
+                    scores = await pipe.execute()
+                n = len(others)
+                batch = [b for i, b in enumerate(batch) if all(s is not None for s in scores[i * n:(i + 1) * n])]
+                batch = batch[:limit - len(results)]
+            if not batch:
+                continue
+            keys = [result_key_prefix + job_id.decode() for job_id, _ in batch]
+            values = await self.mget(keys) if with_body else await self._get_headers(keys)
+            expired = []
+            for (job_id, score), v in zip(batch, values):
+                if not v:
+                    expired.append(job_id)
+                    continue
+                r = deserialize_result(v, deserializer=self.job_deserializer, accept=accept, with_body=with_body)
+                r.job_id = job_id.decode()
+                r.score = int(score)
+                results.append(r)
+            if expired:
+                # 结果已过期,从读取的索引中删除
+                async with self.pipeline(transaction=False) as pipe:
+                    for key in {index_key, *filters}:
+                        pipe.zrem(key, *expired)
+                    await pipe.execute()
+        return results[:limit]
 
     async def get_job_funcs(self) -> List[Dict]:
         """
@@ -202,44 +611,138 @@ class AioRedis(Redis):  # type: ignore
         v = await self.get(func_key)
         return deserialize_func(v)
 
-    async def get_job_workers(self) -> List[Dict]:
+    async def get_job_profile(self, function_name: str, limit: int = 20) -> List[Dict[str, Any]]:
         """
+        获取函数采样分析结果中累计耗时最高的 ``limit`` 个调用
         """
-        keys = await self.keys(f'{worker_key}*')
+        return await top_functions(self, function_name, limit)
+
+    async def get_job_workers(self, *, stale_after: float = worker_stale_after) -> List[JobWorker]:
+        """
+        获取所有 worker 及其健康检查,一次管道读取两个哈希和不再活跃的 worker
+        :param stale_after: 超过该秒数未活跃的 worker 不返回,并从注册表中删除
+        """
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.hgetall(workers_key)
+            pipe.hgetall(workers_health_key)
+            pipe.zrangebyscore(workers_seen_key, '-inf', timestamp_ms() - int(stale_after * 1000))
+            registry, health, stale = await pipe.execute()
+        stale = {name.decode() for name in stale}
+        if stale:
+            async with self.pipeline(transaction=False) as pipe:
+                pipe.hdel(workers_key, *stale)
+                pipe.hdel(workers_health_key, *stale)
+                pipe.zrem(workers_seen_key, *stale)
+                await pipe.execute()
+
+        now_ms = timestamp_ms()
         workers_ = []
-        for key_ in keys:
-            v = await self.get(key_)
+        for name, v in registry.items():
+            if name.decode() in stale:
+                continue
             dw_ = deserialize_worker(v)
-            dw_.health_check = await self._get_health_check(dw_.worker_name)
+            # 与健康检查键一样,超过 health_check_interval + 1 秒未更新的健康检查不返回
+            dw_.health_check = load_health(health.get(name), now_ms)
             workers_.append(dw_)
         return workers_
 
     async def _get_health_check(self, worker_name: str) -> Dict:
-        v = await self.get(f"{health_check_key_suffix}{worker_name}")
-        return json.loads(v) if v else {}
-
-    async def _get_job_def(self, job_id: bytes, queue_name: str, score: int) -> JobDef:
-        job_id_ = job_id.decode()
-        v = await self.get(job_key_prefix + job_id_)
-        jd = deserialize_job(v, deserializer=self.job_deserializer)
-        j = Job(job_id=job_id_, redis=self, _queue_name=queue_name)
-        state = await j.status()
-        # print("ms_to_datetime(score): ",ms_to_datetime(score))
-        jd.score = score
-        jd.job_id = job_id_
-        jd.start_time = ms_to_datetime(score)
-        jd.state = state
-        jd.queue_name = queue_name
-        jd.worker_name = self.worker_name
-        print(jd)
-        return jd
-
-    async def queued_jobs(self, *, queue_name: str = default_queue_name) -> List[JobDef]:
+        return load_health(await self.hget(workers_health_key, worker_name))
+
+    async def _get_job_defs(
+            self, jobs: Sequence[Tuple[bytes, float]], queue_name: str, with_body: bool = True
+    ) -> List[JobDef]:
+        """
+        一次管道读取一页作业的内容和状态标志,读取前已出队的作业不返回
+        """
+        job_ids = [job_id.decode() for job_id, _ in jobs]
+        keys = [job_key_prefix + job_id for job_id in job_ids]
+        async with self.pipeline(transaction=False) as pipe:
+            for job_id, key in zip(job_ids, keys):
+                if with_body:
+                    pipe.get(key)
+                else:
+                    pipe.getrange(key, 0, header_prefetch_size - 1)
+                pipe.exists(result_key_prefix + job_id)
+                pipe.exists(in_progress_key_prefix + job_id)
+            r = await pipe.execute()
+        values = r[0::3]
+        if not with_body:
+            values = await self._complete_headers(keys, values)
+
+        now_ms = timestamp_ms()
+        accept = self.job_accept
+        job_defs = []
+        for job_id, (_, score), v, complete, in_progress in zip(job_ids, jobs, values, r[1::3], r[2::3]):
+            if not v:
+                continue
+            jd = deserialize_job(v, deserializer=self.job_deserializer, accept=accept, with_body=with_body)
+            score = int(score)
+            if complete:
+                jd.state = JobStatus.complete
+            elif in_progress:
+                jd.state = JobStatus.in_progress
+            else:
+                jd.state = JobStatus.deferred if score > now_ms else JobStatus.queued
+            jd.score = score
+            jd.job_id = job_id
+            jd.start_ms = score
+            jd.queue_name = queue_name
+            jd.worker_name = self.worker_name
+            job_defs.append(jd)
+        return job_defs
+
+    async def queued_jobs_page(
+            self,
+            *,
+            queue_name: str = default_queue_name,
+            offset: int = 0,
+            limit: int = queued_jobs_page_size,
+            with_body: bool = True,
+    ) -> List[JobDef]:
+        """
+        按运行时间排序的一页排队作业,一次 ZRANGE 加一次管道
+        """
+        jobs = await self.zrange(queue_name, withscores=True, start=offset, end=offset + limit - 1)
+        return await self._get_job_defs(jobs, queue_name, with_body)
+
+    async def iter_queued_jobs(
+            self,
+            *,
+            queue_name: str = default_queue_name,
+            page_size: int = queued_jobs_page_size,
+            with_body: bool = True,
+    ) -> AsyncGenerator[JobDef, None]:
+        """
+        按运行时间遍历所有排队作业,以分数为游标逐页读取,遍历期间出队的作业不会使后面的作业被跳过
+        """
+        min_score: Union[str, float] = '-inf'
+        # 分数等于游标的已返回作业,下一页从同一分数开始时跳过
+        seen: Set[bytes] = set()
+        while True:
+            jobs = await self.zrangebyscore(
+                queue_name, min_score, '+inf', start=0, num=page_size + len(seen), withscores=True
+            )
+            jobs = [(job_id, score) for job_id, score in jobs if job_id not in seen]
+            if not jobs:
+                return
+            for jd in await self._get_job_defs(jobs, queue_name, with_body):
+                yield jd
+            last_score = jobs[-1][1]
+            if last_score != min_score:
+                seen = set()
+            seen.update(job_id for job_id, score in jobs if score == last_score)
+            min_score = last_score
+
+    async def queued_jobs(self, *, queue_name: str = default_queue_name, with_body: bool = True) -> List[JobDef]:
         """
         Get information about queued, mostly useful when testing.
+
+        With ``with_body=False`` only job headers are read and ``args`` and ``kwargs`` are None,
+        use :meth:`aiorq.jobs.Job.info` to get them. Only jobs written with a named codec have a separate header,
+        the default json and serializer functions write plain payloads which are still read and decoded in full.
         """
-        jobs = await self.zrange(queue_name, withscores=True, start=0, end=-1)
-        return await asyncio.gather(*[self._get_job_def(job_id, queue_name, int(score)) for job_id, score in jobs])
+        return [jd async for jd in self.iter_queued_jobs(queue_name=queue_name, with_body=with_body)]
 
     async def redis_info(self) -> Dict[str, Any]:
         return await self.info()
@@ -251,7 +754,12 @@ async def create_pool(
         retry: int = 0,
         job_serializer: Optional[Serializer] = None,
         job_deserializer: Optional[Deserializer] = None,
+        accept_codecs: Sequence[str] = (),
         default_queue_name: str = default_queue_name,
+        hooks: Optional[Hooks] = None,
+        compression: Optional[Compression] = None,
+        queue_compression: Optional[Dict[str, Optional[Compression]]] = None,
+        blob_threshold: Optional[int] = None,
 ) -> AioRedis:
     """
     Create a new redis pool, retrying up to ``conn_retries`` times if the connection fails.
@@ -288,7 +796,13 @@ async def create_pool(
         pool = pool_factory(db=settings.database, password=settings.password, encoding='utf8')
         pool.job_serializer = job_serializer
         pool.job_deserializer = job_deserializer
+        pool.accept_codecs = accept_codecs
         pool.default_queue_name = default_queue_name
+        if hooks is not None:
+            pool.hooks = hooks
+        pool.compression = compression
+        pool.queue_compression = queue_compression or {}
+        pool.blob_threshold = blob_threshold
         await pool.ping()  # ping
 
     except (ConnectionError, OSError, RedisError, asyncio.TimeoutError) as e:
@@ -316,7 +830,12 @@ async def create_pool(
         retry=retry + 1,
         job_serializer=job_serializer,
         job_deserializer=job_deserializer,
+        accept_codecs=accept_codecs,
         default_queue_name=default_queue_name,
+        hooks=hooks,
+        compression=compression,
+        queue_compression=queue_compression,
+        blob_threshold=blob_threshold,
     )
 
 
@@ -8,6 +8,19 @@ abort_jobs_ss = 'aiorq:abort'
 abort_job_max_age = 60
 health_check_key_suffix = 'aiorq:health-check:'
 keep_cronjob_progress = 60
-worker_key = "aiorq:worker"
+workers_key = 'aiorq:workers'
+workers_health_key = 'aiorq:workers-health'
+workers_seen_key = 'aiorq:workers-seen'
 func_key = "aiorq:function"
-worker_key_close_expire = 60 * 60 * 24 * 7
+worker_stale_after = 60 * 60
+profile_key_prefix = 'aiorq:profile:'
+profile_keep_samples = 50
+blob_key_prefix = 'aiorq:blob:'
+blob_refs_key_prefix = 'aiorq:blob-refs:'
+cron_leader_key_prefix = 'aiorq:cron-leader:'
+cron_last_run_key_prefix = 'aiorq:cron-last-run:'
+results_index_key_prefix = 'aiorq:results:'
+results_filter_key_prefix = 'aiorq:results-by:'
+results_index_trim_interval = 60
+# set of the filter indexes of a queue's results, trimmed without scanning the keyspace
+results_filters_key_prefix = 'aiorq:results-filters:'
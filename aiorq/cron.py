@@ -1,25 +1,254 @@
-from ast import keyword
 import asyncio
-import dataclasses
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Any, Dict, Optional, Tuple, Union
+import hashlib
+from bisect import bisect_left, bisect_right
+from collections import deque
+from calendar import monthrange
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Sequence, Tuple, Union, cast
 
 from pydantic.utils import import_string
 
 from .typing_ import WEEKDAYS, OptionType, SecondsTimedelta, WeekdayOptionType, WorkerCoroutine
-from .utils import to_seconds
+from .utils import ms_to_datetime, to_seconds, to_unix_ms
 
+# the gregorian calendar repeats every 400 years, a schedule with no match within that is never due
+max_search_years = 400
 
-@dataclass
-class Options:
-    month: OptionType
-    day: OptionType
-    weekday: WeekdayOptionType
-    hour: OptionType
-    minute: OptionType
-    second: OptionType
+catch_up_modes = 'none', 'latest', 'all'
+# most missed runs enqueued for one cron job on startup with ``catch_up='all'``, the latest are kept
+catch_up_max_runs = 1000
+
+crontab_macros = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+crontab_month_names = {n: i for i, n in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1
+)}
+# crontab week days start on sunday, 7 is sunday too
+crontab_weekday_names = {n: i for i, n in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))}
+
+
+def get_zone(name: str) -> tzinfo:
+    try:
+        from zoneinfo import ZoneInfo
+    except ImportError:  # pragma: no cover
+        try:
+            from backports.zoneinfo import ZoneInfo
+        except ImportError as e:
+            raise ImportError('zoneinfo not available, use `pip install backports.zoneinfo`') from e
+    return ZoneInfo(name)
+
+
+def _allowed(name: str, v: OptionType, low: int, high: int) -> Tuple[int, ...]:
+    if v is None:
+        return tuple(range(low, high + 1))
+    values = (v,) if isinstance(v, int) else v
+    assert isinstance(values, (set, frozenset, list, tuple)), v
+    allowed = tuple(sorted(set(values)))
+    if not allowed or allowed[0] < low or allowed[-1] > high:
+        raise ValueError(f'{name} must be between {low} and {high}, got {v!r}')
+    return allowed
+
+
+def _parse_crontab_field(name: str, field_: str, low: int, high: int, names: Dict[str, int]) -> Tuple[int, ...]:
+    """
+    Values of a crontab field, a comma separated list of ``*``, ``N``, ``N-M``, each optionally followed by
+    ``/STEP``, ``N/STEP`` runs from N to the end of the range.
+    """
+
+    def value(v: str) -> int:
+        n = names.get(v.lower())
+        if n is not None:
+            return n
+        try:
+            return int(v)
+        except ValueError:
+            raise ValueError(f'invalid {name} {v!r} in crontab field {field_!r}') from None
+
+    values = set()
+    for part in field_.split(','):
+        range_, slash, step_ = part.partition('/')
+        step = value(step_) if slash else 1
+        if range_ == '*':
+            start, stop = low, high
+        else:
+            start_, dash, stop_ = range_.partition('-')
+            start = value(start_)
+            stop = value(stop_) if dash else high if slash else start
+        if step < 1:
+            raise ValueError(f'invalid crontab field {field_!r}, steps must be at least 1')
+        if not low <= start <= stop <= high:
+            raise ValueError(f'invalid crontab field {field_!r}, {name} must be between {low} and {high}')
+        values.update(range(start, stop + 1, step))
+    return tuple(sorted(values))
+
+
+@dataclass(frozen=True)
+class Schedule:
+    """
+    Sorted allowed values of each field of a cron schedule, so the next run can be found by jumping to the next
+    allowed value of each field rather than stepping through time.
+    """
+
+    months: Tuple[int, ...]
+    days: Tuple[int, ...]
+    #: None if any week day is allowed
+    weekdays: Optional[FrozenSet[int]]
+    hours: Tuple[int, ...]
+    minutes: Tuple[int, ...]
+    seconds: Tuple[int, ...]
     microsecond: int
+    #: a day matches if either its day of month or its week day is allowed rather than both, as in crontab when
+    #: both fields are restricted
+    days_or_weekdays: bool = False
+    #: zone the fields are wall clock times in, None for the naive times of older versions
+    tz: Optional[tzinfo] = None
+
+    @classmethod
+    def from_options(
+        cls,
+        *,
+        month: OptionType = None,
+        day: OptionType = None,
+        weekday: WeekdayOptionType = None,
+        hour: OptionType = None,
+        minute: OptionType = None,
+        second: OptionType = 0,
+        microsecond: int = 123_456,
+        days_or_weekdays: bool = False,
+        tz: Union[None, str, tzinfo] = None,
+    ) -> 'Schedule':
+        if isinstance(weekday, str):
+            weekday = WEEKDAYS.index(weekday.lower())
+        if not 0 <= microsecond < 1_000_000:
+            raise ValueError(f'microsecond must be between 0 and 999999, got {microsecond!r}')
+        schedule = cls(
+            months=_allowed('month', month, 1, 12),
+            days=_allowed('day', day, 1, 31),
+            weekdays=None if weekday is None else frozenset(_allowed('weekday', weekday, 0, 6)),
+            hours=_allowed('hour', hour, 0, 23),
+            minutes=_allowed('minute', minute, 0, 59),
+            seconds=_allowed('second', second, 0, 59),
+            microsecond=microsecond,
+            days_or_weekdays=days_or_weekdays and weekday is not None,
+            tz=get_zone(tz) if isinstance(tz, str) else tz,
+        )
+        if not schedule.days_or_weekdays and schedule.days[0] > max(monthrange(2000, m)[1] for m in schedule.months):
+            raise ValueError(f'no month in {schedule.months} has day {schedule.days[0]}')
+        return schedule
+
+    @classmethod
+    def from_crontab(
+        cls, expression: str, *, microsecond: int = 123_456, tz: Union[None, str, tzinfo] = None
+    ) -> 'Schedule':
+        """
+        Compile a crontab expression: five fields ``minute hour day month weekday``, six fields with a leading
+        ``second`` field, or one of the ``@hourly``, ``@daily``, ``@weekly``, ``@monthly`` and ``@yearly`` macros.
+
+        Fields take ``*``, values, ``N-M`` ranges, ``/STEP`` steps and comma separated lists, months and week days
+        also take three letter names, week days run from 0 (sunday) to 6 with 7 as sunday too. As in cron, when
+        both day and weekday are restricted (don't start with ``*``) a day matching either runs the job.
+        """
+        fields = crontab_macros.get(expression.strip().lower(), expression).split()
+        if len(fields) == 5:
+            fields.insert(0, '0')
+        elif len(fields) != 6:
+            raise ValueError(f'crontab expression {expression!r} must have 5 or 6 fields')
+        second, minute, hour, day, month, weekday = fields
+        weekdays = None
+        if weekday != '*':
+            crontab_weekdays = _parse_crontab_field('weekday', weekday, 0, 7, crontab_weekday_names)
+            weekdays = {(d - 1) % 7 for d in crontab_weekdays}
+        return cls.from_options(
+            month=set(_parse_crontab_field('month', month, 1, 12, crontab_month_names)),
+            day=set(_parse_crontab_field('day', day, 1, 31, {})),
+            weekday=weekdays,
+            hour=set(_parse_crontab_field('hour', hour, 0, 23, {})),
+            minute=set(_parse_crontab_field('minute', minute, 0, 59, {})),
+            second=set(_parse_crontab_field('second', second, 0, 59, {})),
+            microsecond=microsecond,
+            days_or_weekdays=not day.startswith('*') and not weekday.startswith('*'),
+            tz=tz,
+        )
+
+    def next_after(self, previous_dt: datetime) -> datetime:
+        """
+        The first time matching the schedule in a later second than ``previous_dt``.
+
+        With ``tz`` the fields are wall clock times in that zone, a naive ``previous_dt`` is taken as local time and
+        the result is aware. Wall clock times repeated when clocks go back run once, at their first occurrence,
+        times skipped when clocks go forward run after the change, later by the size of the change.
+        """
+        if self.tz is None:
+            return self._next_wall_time(previous_dt)
+        previous = previous_dt.astimezone(self.tz)
+        previous_utc = previous.astimezone(timezone.utc)
+        wall = previous.replace(tzinfo=None)
+        while True:
+            wall = self._next_wall_time(wall)
+            # without fold a repeated time is its first occurrence and a skipped time uses the offset before the change
+            next_utc = wall.replace(tzinfo=self.tz).astimezone(timezone.utc)
+            if next_utc > previous_utc:
+                return next_utc.astimezone(self.tz)
+
+    def _next_wall_time(self, previous_dt: datetime) -> datetime:
+        dt = previous_dt + timedelta(seconds=1)
+        start_date = dt.year, dt.month, dt.day
+        first_time = self.hours[0], self.minutes[0], self.seconds[0]
+        for year in range(dt.year, dt.year + max_search_years + 1):
+            months = self.months[bisect_left(self.months, dt.month):] if year == dt.year else self.months
+            for month in months:
+                days = self._month_days(year, month)
+                if (year, month) == start_date[:2]:
+                    days = days[bisect_left(days, dt.day):]
+                for day in days:
+                    if (year, month, day) == start_date:
+                        time = self._next_time(dt.hour, dt.minute, dt.second)
+                        if time is None:
+                            continue
+                    else:
+                        time = first_time
+                    return datetime(year, month, day, *time, self.microsecond, tzinfo=dt.tzinfo)
+        raise ValueError(f'no time matches {self} within {max_search_years} years of {previous_dt}')
+
+    def _month_days(self, year: int, month: int) -> Sequence[int]:
+        """
+        The allowed days of a month in order.
+        """
+        first_weekday, last_day = monthrange(year, month)
+        weekdays = self.weekdays
+        if weekdays is None:
+            return self.days[:bisect_right(self.days, last_day)]
+        elif self.days_or_weekdays:
+            return [d for d in range(1, last_day + 1) if d in self.days or (first_weekday + d - 1) % 7 in weekdays]
+        else:
+            return [d for d in self.days if d <= last_day and (first_weekday + d - 1) % 7 in weekdays]
+
+    def _next_time(self, hour: int, minute: int, second: int) -> Optional[Tuple[int, int, int]]:
+        """
+        The first allowed time of day at or after ``hour:minute:second``, None if there's none left in the day.
+        """
+        i = bisect_left(self.hours, hour)
+        if i < len(self.hours) and self.hours[i] == hour:
+            j = bisect_left(self.minutes, minute)
+            if j < len(self.minutes) and self.minutes[j] == minute:
+                k = bisect_left(self.seconds, second)
+                if k < len(self.seconds):
+                    return hour, minute, self.seconds[k]
+                j += 1
+            if j < len(self.minutes):
+                return hour, self.minutes[j], self.seconds[0]
+            i += 1
+        if i < len(self.hours):
+            return self.hours[i], self.minutes[0], self.seconds[0]
+        return None
 
 
 def next_cron(
@@ -36,61 +265,20 @@ def next_cron(
     """
     Find the next datetime matching the given parameters.
     """
-    dt = previous_dt + timedelta(seconds=1)
-    if isinstance(weekday, str):
-        weekday = WEEKDAYS.index(weekday.lower())
-    options = Options(
-        month=month,
-        day=day,
-        weekday=weekday,
-        hour=hour,
-        minute=minute,
-        second=second,
-        microsecond=microsecond
+    schedule = Schedule.from_options(
+        month=month, day=day, weekday=weekday, hour=hour, minute=minute, second=second, microsecond=microsecond
     )
+    return schedule.next_after(previous_dt)
 
-    while True:
-        next_dt = _get_next_dt(dt, options)
-        # print(dt, next_dt)
-        if next_dt is None:
-            return dt
-        dt = next_dt
-
-
-def _get_next_dt(dt_: datetime, options: Options) -> Optional[datetime]:  # noqa: C901
-    for field, v in dataclasses.asdict(options).items():
-        if v is None:
-            continue
-        next_v = dt_.weekday() if field == 'weekday' else getattr(dt_, field)
-        if isinstance(v, int):
-            mismatch = next_v != v
-        else:
-            assert isinstance(v, (set, list, tuple)), v
-            mismatch = next_v not in v
-        # print(field, v, next_v, mismatch)
-        if mismatch:
-            micro = max(dt_.microsecond - options.microsecond, 0)
-            if field == 'month':
-                if dt_.month == 12:
-                    return datetime(dt_.year + 1, 1, 1)
-                else:
-                    return datetime(dt_.year, dt_.month + 1, 1)
-            elif field in ('day', 'weekday'):
-                return (
-                    dt_
-                    + timedelta(days=1)
-                    - timedelta(hours=dt_.hour, minutes=dt_.minute, seconds=dt_.second, microseconds=micro)
-                )
-            elif field == 'hour':
-                return dt_ + timedelta(hours=1) - timedelta(minutes=dt_.minute, seconds=dt_.second, microseconds=micro)
-            elif field == 'minute':
-                return dt_ + timedelta(minutes=1) - timedelta(seconds=dt_.second, microseconds=micro)
-            elif field == 'second':
-                return dt_ + timedelta(seconds=1) - timedelta(microseconds=micro)
-            else:
-                assert field == 'microsecond', field
-                return dt_ + timedelta(microseconds=options.microsecond - dt_.microsecond)
-    return None
+
+def hash_jitter(name: str, jitter_s: Optional[float]) -> timedelta:
+    """
+    Offset within ``[0, jitter_s)`` picked from a hash of the cron job's name, the same on every worker and restart.
+    """
+    if not jitter_s:
+        return timedelta(0)
+    fraction = int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], 'big') / 2 ** 64
+    return timedelta(milliseconds=int(fraction * jitter_s * 1000))
 
 
 @dataclass
@@ -111,24 +299,64 @@ class CronJob:
     keep_result_s: Optional[float]
     keep_result_forever: Optional[bool]
     max_tries: Optional[int]
+    profile_sample_rate: Optional[float]
     next_run: Optional[datetime] = None
+    crontab: Optional[str] = None
+    tz: Union[None, str, tzinfo] = None
+    catch_up: str = 'none'
+    catch_up_window_s: Optional[float] = None
+    jitter_s: Optional[float] = None
+    schedule: Schedule = field(init=False, repr=False)
+    jitter_offset: timedelta = field(init=False)
 
-
-
-    def calculate_next(self, prev_run: datetime) -> None:
-        self.next_run = next_cron(
-            prev_run,
+    def __post_init__(self) -> None:
+        self.jitter_offset = hash_jitter(self.name, self.jitter_s)
+        if self.crontab is not None:
+            self.schedule = Schedule.from_crontab(self.crontab, microsecond=self.microsecond, tz=self.tz)
+            return
+        self.schedule = Schedule.from_options(
             month=self.month,
             day=self.day,
             weekday=self.weekday,
             hour=self.hour,
             minute=self.minute,
             second=self.second,
-            microsecond=self.microsecond
+            microsecond=self.microsecond,
+            tz=self.tz,
         )
 
+    def calculate_next(self, prev_run: datetime) -> None:
+        self.next_run = self.schedule.next_after(prev_run)
+
+    @property
+    def run_at(self) -> datetime:
+        """
+        When the job is due, ``next_run`` shifted by the job's jitter. Job ids are built from ``next_run`` so they're
+        the same whatever the jitter.
+        """
+        return cast(datetime, self.next_run) + self.jitter_offset
+
+    def missed_runs(self, last_run_ms: int, now: datetime) -> List[datetime]:
+        """
+        Runs scheduled after the one at ``last_run_ms`` and up to ``now``, limited to the catch up window, with
+        ``catch_up='latest'`` only the last of them.
+        """
+        if self.catch_up == 'none':
+            return []
+        now_ms = to_unix_ms(now)
+        run = ms_to_datetime(last_run_ms)
+        if self.catch_up_window_s is not None and now_ms - last_run_ms > self.catch_up_window_s * 1000:
+            run = now - timedelta(seconds=self.catch_up_window_s)
+        limit = 1 if self.catch_up == 'latest' else catch_up_max_runs
+        runs: Deque[datetime] = deque(maxlen=limit)
+        while True:
+            run = self.schedule.next_after(run)
+            if to_unix_ms(run) > now_ms:
+                return list(runs)
+            runs.append(run)
+
     def __repr__(self) -> str:
-        return f"<CronJob {' '.join((f'{k}={v}' for k, v in self.__dict__.items()))}>"
+        return f"<CronJob {' '.join((f'{k}={v}' for k, v in self.__dict__.items() if k != 'schedule'))}>"
 
 
 def cron(
@@ -136,6 +364,8 @@ def cron(
     *,
     name: Optional[str] = None,
     kwargs: dict,
+    crontab: Optional[str] = None,
+    tz: Union[None, str, tzinfo] = None,
     month: OptionType = None,
     day: OptionType = None,
     weekday: WeekdayOptionType = None,
@@ -148,7 +378,11 @@ def cron(
     timeout: Optional[SecondsTimedelta] = None,
     keep_result: Optional[float] = 0,
     keep_result_forever: Optional[bool] = False,
-    max_tries: Optional[int] = 1
+    max_tries: Optional[int] = 1,
+    profile_sample_rate: Optional[float] = None,
+    catch_up: str = 'none',
+    catch_up_window: Optional[SecondsTimedelta] = timedelta(days=1),
+    jitter: Optional[SecondsTimedelta] = None,
 ) -> CronJob:
     """
     Create a cron job, eg. it should be executed at specific times.
@@ -158,6 +392,10 @@ def cron(
 
     :param coroutine: coroutine function to run
     :param name: name of the job, if None, the name of the coroutine is used
+    :param crontab: crontab expression to run the job on, eg. ``*/15 9-17 * * mon-fri``, instead of the month to
+        second options, see :meth:`aiorq.cron.Schedule.from_crontab`
+    :param tz: zone, name or ``tzinfo``, the schedule is in, eg. ``Europe/Paris``, runs are then aware datetimes
+        and follow the zone's DST changes, see :meth:`aiorq.cron.Schedule.next_after`; by default naive local time
     :param month: month(s) to run the job on, 1 - 12
     :param day: day(s) to run the job on, 1 - 31
     :param weekday: week day(s) to run the job on, 0 - 6 or mon - sun
@@ -172,6 +410,15 @@ def cron(
     :param keep_result: how long to keep the result for
     :param keep_result_forever: whether to keep results forever
     :param max_tries: maximum number of tries for the job
+    :param profile_sample_rate: fraction of runs to profile with cProfile, if None use Worker default
+    :param catch_up: runs to enqueue when a worker starts after runs were missed because no worker was running,
+        ``none``, ``latest`` or ``all``; the last run is recorded in redis, catch up starts once one was recorded.
+        Every worker starting without a cron leader lease catches up, so this requires ``unique``, the job ids of
+        the caught up runs keep them from being enqueued twice
+    :param catch_up_window: only runs missed within this long before the worker started are caught up,
+        None for no limit besides the latest 1000 runs
+    :param jitter: spread runs of many jobs scheduled at the same time, each job runs this long at most after its
+        scheduled times, by an offset fixed for its name
     """
 
     if isinstance(coroutine, str):
@@ -182,6 +429,11 @@ def cron(
         coroutine_ = coroutine
 
     assert asyncio.iscoroutinefunction(coroutine_), f'{coroutine_} is not a coroutine function'
+    assert crontab is None or (month, day, weekday, hour, minute, second) == (None, None, None, None, None, 0), (
+        'use either crontab or the month to second options, not both'
+    )
+    assert catch_up in catch_up_modes, f'catch_up must be one of {", ".join(catch_up_modes)}'
+    assert unique or catch_up == 'none', 'catch_up requires unique, or every starting worker would enqueue the runs'
     timeout = to_seconds(timeout)
     keep_result = to_seconds(keep_result)
 
@@ -201,5 +453,11 @@ def cron(
         timeout,
         keep_result,
         keep_result_forever,
-        max_tries
+        max_tries,
+        profile_sample_rate,
+        crontab=crontab,
+        tz=tz,
+        catch_up=catch_up,
+        catch_up_window_s=to_seconds(catch_up_window),
+        jitter_s=to_seconds(jitter),
     )
@@ -0,0 +1,114 @@
+import inspect
+import logging
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger('aiorq.hooks')
+
+hook_names = 'before_enqueue', 'after_enqueue', 'job_claimed', 'job_started', 'job_finished', 'result_written'
+
+Hook = Callable[['JobEvent'], Any]
+
+
+class JobEvent:
+    """
+    Light weight record passed to lifecycle hooks, timings are unix epoch milliseconds and are None
+    when not (yet) known at the point the hook is called.
+    """
+
+    __slots__ = (
+        'hook',
+        'job_id',
+        'queue_name',
+        'function',
+        'job_try',
+        'score',
+        'enqueue_time_ms',
+        'claim_ms',
+        'start_ms',
+        'finish_ms',
+        'result_ms',
+        'success',
+    )
+
+    def __init__(
+            self,
+            hook: str,
+            job_id: str,
+            queue_name: str,
+            *,
+            function: Optional[str] = None,
+            job_try: Optional[int] = None,
+            score: Optional[int] = None,
+            enqueue_time_ms: Optional[int] = None,
+            claim_ms: Optional[int] = None,
+            start_ms: Optional[int] = None,
+            finish_ms: Optional[int] = None,
+            result_ms: Optional[int] = None,
+            success: Optional[bool] = None,
+    ):
+        self.hook = hook
+        self.job_id = job_id
+        self.queue_name = queue_name
+        self.function = function
+        self.job_try = job_try
+        self.score = None if score is None else int(score)
+        self.enqueue_time_ms = enqueue_time_ms
+        self.claim_ms = claim_ms
+        self.start_ms = start_ms
+        self.finish_ms = finish_ms
+        self.result_ms = result_ms
+        self.success = success
+
+    def __repr__(self) -> str:
+        fields = ' '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__ if getattr(self, k) is not None)
+        return f'<JobEvent {fields}>'
+
+
+class Hooks:
+    """
+    Registry of job lifecycle hooks, each hook may be a plain function or a coroutine function taking
+    a :class:`aiorq.hooks.JobEvent`.
+
+    Every hook point is a list attribute, callers check it's not empty before building an event so
+    registering no hooks costs nothing on the hot path. Worker hooks run in the job's own task, a slow
+    ``job_claimed`` hook delays its job but not the claiming of other jobs.
+
+    :param hooks: initial hooks, keyed by hook name
+    """
+
+    __slots__ = hook_names
+
+    def __init__(self, **hooks: Iterable[Hook]):
+        unknown = set(hooks) - set(hook_names)
+        assert not unknown, f'unknown hooks: {", ".join(sorted(unknown))}'
+        for name in hook_names:
+            setattr(self, name, list(hooks.get(name, ())))
+
+    def register(self, name: str, hook: Hook) -> Hook:
+        assert name in hook_names, f'unknown hook {name!r}'
+        getattr(self, name).append(hook)
+        return hook
+
+    def on(self, name: str) -> Callable[[Hook], Hook]:
+        """
+        Decorator form of :meth:`register`.
+        """
+        return lambda hook: self.register(name, hook)
+
+    def remove(self, name: str, hook: Hook) -> None:
+        getattr(self, name).remove(hook)
+
+    async def emit(self, event: JobEvent) -> None:
+        """
+        Call every hook registered for ``event.hook``, errors are logged and never propagate into the job.
+        """
+        for hook in getattr(self, event.hook):
+            try:
+                r = hook(event)
+                if inspect.isawaitable(r):
+                    await r
+            except Exception:
+                logger.exception('%s hook %r failed', event.hook, hook)
+
+    def __repr__(self) -> str:
+        return f"<Hooks {' '.join(f'{n}={len(getattr(self, n))}' for n in hook_names)}>"
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import warnings
-from typing import Any, Optional
+from typing import Any, FrozenSet, Optional
 
 from aioredis import Redis
 
@@ -19,7 +19,7 @@ class Job:
     Holds data a reference to a job.
     """
 
-    __slots__ = 'job_id', '_redis', '_queue_name', '_deserializer'
+    __slots__ = 'job_id', '_redis', '_queue_name', '_deserializer', '_accept'
 
     def __init__(
             self,
@@ -28,12 +28,14 @@ class Job:
             _queue_name: str = default_queue_name,
             _worker_name: str = None,
             _deserializer: Optional[Deserializer] = None,
+            _accept: Optional[FrozenSet[str]] = None,
     ):
         self.job_id = job_id
         # print("self.job_id:", self.job_id)
         self._redis = redis
         self._queue_name = _queue_name
         self._deserializer = _deserializer
+        self._accept = _accept
 
     async def result(
             self, timeout: Optional[float] = None, *, poll_delay: float = 0.5, pole_delay: float = None
@@ -76,7 +78,7 @@ class Job:
         if not info:
             v = await self._redis.get(job_key_prefix + self.job_id)
             if v:
-                info = deserialize_job(v, deserializer=self._deserializer)
+                info = deserialize_job(v, deserializer=self._deserializer, accept=self._accept)
         if info:
             # 获取到了就把 score 值附上去并返回
             info.score = await self._redis.zscore(self._queue_name, self.job_id)
@@ -88,7 +90,9 @@ class Job:
         这里会立即返回结果  如果还没有结果 那就返回 None
         """
         v = await self._redis.get(result_key_prefix + self.job_id)
-        return deserialize_result(v, deserializer=self._deserializer) if v else None
+        if not v:
+            return None
+        return deserialize_result(v, deserializer=self._deserializer, accept=self._accept)
 
     async def status(self) -> JobStatus:
         """
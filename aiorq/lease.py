@@ -0,0 +1,73 @@
+"""
+A lease on a redis key, used to elect the one worker of a queue which enqueues cron jobs.
+
+The holder stores a random token at the key with a TTL and extends it while it's alive, other workers try to take
+the key with ``SET NX`` and succeed once the holder stops renewing and the TTL lapses. Renewing and releasing
+check the token so a worker which lost the lease, eg. after stalling past the TTL, can't affect the new holder.
+"""
+import logging
+from time import monotonic
+from typing import Optional
+from uuid import uuid4
+
+from aioredis import Redis
+
+logger = logging.getLogger('aiorq.lease')
+
+# extends the lease if it's still held by this token
+renew_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+release_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class Lease:
+    """
+    :param key: redis key of the lease
+    :param ttl: seconds the lease lasts without being renewed
+    :param name: prefix of the token, to identify the holder when inspecting redis
+    """
+
+    def __init__(self, key: str, ttl: float, name: str = ''):
+        self.key = key
+        self.ttl = ttl
+        self.token = f'{name}:{uuid4().hex}' if name else uuid4().hex
+        self.held = False
+        # monotonic() of the last renewal, so wall clock adjustments can't delay or hasten it
+        self._checked: Optional[float] = None
+
+    async def check(self, redis: Redis) -> bool:
+        """
+        Renew or try to take the lease, at most every third of the TTL, and return whether it's held.
+
+        A holder which is partitioned from redis for longer than the TTL can believe it still holds the lease for
+        up to a third of the TTL after another worker took it.
+        """
+        now = monotonic()
+        if self._checked is not None and now - self._checked < self.ttl / 3:
+            return self.held
+        self._checked = now
+        ttl_ms = int(self.ttl * 1000)
+        was_held = self.held
+        if self.held:
+            self.held = bool(await redis.eval(renew_script, 1, self.key, self.token, ttl_ms))
+        if not self.held:
+            self.held = bool(await redis.set(self.key, self.token, nx=True, px=ttl_ms))
+        if self.held != was_held:
+            logger.info('%s lease %s', 'acquired' if self.held else 'lost', self.key)
+        return self.held
+
+    async def release(self, redis: Redis) -> None:
+        if self.held:
+            await redis.eval(release_script, 1, self.key, self.token)
+            self.held = False
+            self._checked = None
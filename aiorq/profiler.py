@@ -0,0 +1,118 @@
+import cProfile
+import logging
+import marshal
+import pstats
+from random import random
+from typing import Any, Coroutine, Dict, Generator, List, Optional
+
+from aioredis import Redis
+
+from .constants import profile_keep_samples, profile_key_prefix
+
+logger = logging.getLogger('aiorq.profiler')
+
+
+class _ProfiledAwaitable:
+    """
+    Drives a coroutine step by step, only enabling the profiler while the coroutine itself is running so
+    time spent in other tasks on the event loop isn't attributed to the job.
+    """
+
+    __slots__ = 'coro', 'profiler'
+
+    def __init__(self, coro: Coroutine[Any, Any, Any], profiler: cProfile.Profile):
+        self.coro = coro
+        self.profiler = profiler
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        send_value: Any = None
+        throw_exc: Optional[BaseException] = None
+        while True:
+            self.profiler.enable()
+            try:
+                if throw_exc is None:
+                    future = self.coro.send(send_value)
+                else:
+                    future = self.coro.throw(throw_exc)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.profiler.disable()
+
+            try:
+                send_value, throw_exc = (yield future), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                send_value, throw_exc = None, e
+
+
+async def profile_coroutine(coro: Coroutine[Any, Any, Any], profiler: cProfile.Profile) -> Any:
+    """
+    Run ``coro`` with ``profiler`` enabled while (and only while) it's executing.
+    """
+    return await _ProfiledAwaitable(coro, profiler)
+
+
+def sample_profiler(sample_rate: Optional[float]) -> Optional[cProfile.Profile]:
+    """
+    Return a new profiler for a fraction ``sample_rate`` of calls, otherwise None.
+    """
+    if sample_rate and random() < sample_rate:
+        return cProfile.Profile()
+    return None
+
+
+async def save_profile(redis: Redis, function_name: str, profiler: cProfile.Profile) -> None:
+    """
+    Push the stats of one profiled run onto the function's capped list of samples.
+    """
+    profiler.create_stats()
+    key = profile_key_prefix + function_name
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.lpush(key, marshal.dumps(profiler.stats))  # type: ignore[attr-defined]
+        pipe.ltrim(key, 0, profile_keep_samples - 1)
+        await pipe.execute()
+
+
+class _MarshaledStats:
+    """
+    Minimal stand-in for a profiler which ``pstats.Stats`` can load stats from.
+    """
+
+    def __init__(self, data: bytes):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self) -> None:
+        pass
+
+
+async def load_profile(redis: Redis, function_name: str) -> Optional[pstats.Stats]:
+    """
+    Aggregate all stored samples for a function, None if the function has never been profiled.
+    """
+    samples = await redis.lrange(profile_key_prefix + function_name, 0, -1)
+    if not samples:
+        return None
+    return pstats.Stats(*[_MarshaledStats(s) for s in samples])
+
+
+async def top_functions(redis: Redis, function_name: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Get the ``limit`` functions with the highest cumulative time across all samples of a job function.
+    """
+    stats = await load_profile(redis, function_name)
+    if stats is None:
+        return []
+    rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)  # type: ignore[attr-defined]
+    return [
+        {
+            'function': pstats.func_std_string(func_),
+            'primitive_calls': cc,
+            'calls': nc,
+            'tottime': tt,
+            'cumtime': ct,
+        }
+        for func_, (cc, nc, tt, ct, _) in rows[:limit]
+    ]
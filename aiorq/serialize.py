@@ -1,15 +1,360 @@
+import copyreg
+import io
 import json
 import logging
-from typing import Any, Callable, Dict, Optional, Tuple
+import lzma
+import pickle
+import zlib
+from typing import Any, Callable, Collection, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, Union
 
 from .exception import SerializationError, DeserializationError
 from .specs import JobWorker, JobFunc, JobDef, JobResult
-from .utils import ms_to_datetime
+from .utils import timestamp_ms
 
 logger = logging.getLogger('aiorq.serialize')
 
-Serializer = Callable[[Dict[str, Any]], bytes]
-Deserializer = Callable[[bytes], Dict[str, Any]]
+# a serializer is either the name of a registered codec, whose payloads carry a one byte format tag,
+# or a plain function whose payloads are untagged as in older versions
+Serializer = Union[str, Callable[[Dict[str, Any]], bytes]]
+Deserializer = Union[str, Callable[[bytes], Dict[str, Any]]]
+
+
+class Codec(NamedTuple):
+    name: str
+    tag: int
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+codecs_by_name: Dict[str, Codec] = {}
+codecs_by_tag: Dict[int, Codec] = {}
+
+
+class Compression(NamedTuple):
+    """
+    Compression of job and result payloads, payloads shorter than ``threshold`` bytes are stored as is.
+
+    :param method: ``zlib`` or ``lzma``
+    :param threshold: minimum payload size to compress
+    :param level: zlib level or lzma preset, the library default if None
+    """
+
+    method: str = 'zlib'
+    threshold: int = 1024
+    level: Optional[int] = None
+
+
+class Compressor(NamedTuple):
+    flag: int
+    compress: Callable[[bytes, Optional[int]], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+# compressed payloads start with a flag byte from the range reserved for aiorq so they can't be mistaken for
+# codec tags, what follows the flag is the tagged or untagged payload as it would otherwise have been stored
+compressors: Dict[str, Compressor] = {
+    'zlib': Compressor(0x0e, lambda b, level: zlib.compress(b, -1 if level is None else level), zlib.decompress),
+    'lzma': Compressor(0x0f, lambda b, level: lzma.compress(b, preset=level), lzma.decompress),
+}
+compressors_by_flag: Dict[int, Compressor] = {c.flag: c for c in compressors.values()}
+
+# jobs and results written with a named codec are envelopes: this flag, the header length as 4 bytes big endian,
+# a small json header and a body as written by :func:`dumps`, listing jobs and results only reads the header,
+# the default untagged json and serializer functions keep the plain layout older readers expect, so listing them
+# with with_body=False still reads and decodes the whole payload
+envelope_flag = 0x0d
+envelope_prefix_size = 5
+job_body_fields = 'args', 'kwargs'
+result_body_fields = 'args', 'kwargs', 'result'
+
+# bytes like top level args, kwargs and results of envelopes are written as raw segments between the header and
+# the body, their sizes listed in the header as "buffers", and replaced in the body by {'__aiorq_buf__': <index>},
+# they're decoded as memoryviews over the payload so any codec can carry them without copying them again, the
+# default untagged json has no envelope and can't carry bytes, nested bytes are left to the codec
+buffer_ref = '__aiorq_buf__'
+binary_types = (bytes, bytearray, memoryview)
+
+# arguments stored as blobs, see :mod:`aiorq.blobs`, are written as {'__aiorq_blob__': <sha256>} and their positions
+# listed in the job's "blobs" field, a plain dict argument of the same shape isn't in the list and stays a dict
+blob_ref = '__aiorq_blob__'
+
+
+class BlobRef(dict):
+    """
+    Reference to an argument stored as a blob, a dict so it's written by any codec and kept as is in results.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, digest: str):
+        super().__init__({blob_ref: digest})
+
+    @property
+    def digest(self) -> str:
+        return self[blob_ref]
+
+
+def register_codec(name: str, tag: int, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]) -> Codec:
+    """
+    Register a codec usable as ``job_serializer`` by name.
+
+    Tags must be below 0x20 so a tagged payload can never be mistaken for untagged json, msgpack or pickle data,
+    0x00 - 0x0f are reserved for aiorq.
+    """
+    assert 0 < tag < 0x20, 'codec tags must be between 0x01 and 0x1f'
+    assert tag not in compressors_by_flag and tag != envelope_flag, f'tag {tag:#04x} is reserved by aiorq'
+    existing = codecs_by_tag.get(tag)
+    assert existing is None or existing.name == name, f'tag {tag:#04x} already used by {existing.name!r}'
+    codec = Codec(name, tag, dumps, loads)
+    codecs_by_name[name] = codecs_by_tag[tag] = codec
+    return codec
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return codecs_by_name[name]
+    except KeyError:
+        raise ValueError(f'unknown serializer {name!r}, registered: {", ".join(codecs_by_name)}') from None
+
+
+def accepted_codecs(
+        serializer: Optional[Serializer] = None,
+        deserializer: Optional[Deserializer] = None,
+        accept: Collection[str] = (),
+) -> FrozenSet[str]:
+    """
+    Names of the codecs whose tagged payloads may be decoded: the configured serializer and deserializer, json
+    when either is left as the default, and the codecs listed in ``accept``. Payloads tagged with any other codec
+    are refused so a reader never runs, for instance, ``pickle.loads`` on data it wasn't configured for.
+    """
+    names = {c for c in (serializer, deserializer) if isinstance(c, str)}
+    if serializer is None or deserializer is None:
+        names.add('json')
+    for name in accept:
+        get_codec(name)
+        names.add(name)
+    return frozenset(names)
+
+
+def _msgpack_dumps(data: Any) -> bytes:
+    try:
+        import msgpack
+    except ImportError as e:  # pragma: no cover
+        raise ImportError('msgpack not installed, use `pip install msgpack`') from e
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_loads(r: bytes) -> Any:
+    try:
+        import msgpack
+    except ImportError as e:  # pragma: no cover
+        raise ImportError('msgpack not installed, use `pip install msgpack`') from e
+    return msgpack.unpackb(r, raw=False)
+
+
+# buffers of envelopes are decoded as memoryviews which pickle refuses, job functions may return them nested in
+# their result
+pickle_dispatch_table = {**copyreg.dispatch_table, memoryview: lambda v: (bytes, (v.tobytes(),))}
+
+
+def _pickle_dumps(data: Any) -> bytes:
+    try:
+        return pickle.dumps(data)
+    except TypeError:
+        pass
+    f = io.BytesIO()
+    pickler = pickle.Pickler(f)
+    pickler.dispatch_table = pickle_dispatch_table
+    pickler.dump(data)
+    return f.getvalue()
+
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _orjson_dumps(data: Any) -> bytes:
+    if orjson is None:  # pragma: no cover
+        raise ImportError('orjson not installed, use `pip install orjson`')
+    return orjson.dumps(data)
+
+
+register_codec('json', 0x01, lambda d: json.dumps(d).encode(), json.loads)
+register_codec('pickle', 0x02, _pickle_dumps, pickle.loads)
+register_codec('msgpack', 0x03, _msgpack_dumps, _msgpack_loads)
+# orjson output is plain json, so workers without orjson can still read it
+register_codec('orjson', 0x04, _orjson_dumps, json.loads if orjson is None else orjson.loads)
+
+
+def compress(payload: Union[str, bytes], compression: Optional[Compression]) -> Union[str, bytes]:
+    """
+    Compress a serialized payload if it's at least ``compression.threshold`` long, payloads which don't shrink
+    are returned unchanged.
+    """
+    if compression is None or len(payload) < compression.threshold:
+        return payload
+    try:
+        compressor = compressors[compression.method]
+    except KeyError:
+        raise ValueError(f'unknown compression method {compression.method!r}, use zlib or lzma') from None
+    raw = payload.encode() if isinstance(payload, str) else payload
+    compressed = compressor.compress(raw, compression.level)
+    if len(compressed) + 1 >= len(raw):
+        return payload
+    return bytes((compressor.flag,)) + compressed
+
+
+def dumps(
+        data: Dict[str, Any], serializer: Optional[Serializer] = None, compression: Optional[Compression] = None
+) -> Union[str, bytes]:
+    if serializer is None:
+        payload: Union[str, bytes] = json.dumps(data)
+    elif isinstance(serializer, str):
+        codec = get_codec(serializer)
+        payload = bytes((codec.tag,)) + codec.dumps(data)
+    else:
+        payload = serializer(data)
+    return compress(payload, compression)
+
+
+def dumps_envelope(
+        data: Dict[str, Any],
+        body_fields: Tuple[str, ...],
+        serializer: Optional[Serializer] = None,
+        compression: Optional[Compression] = None,
+) -> Union[str, bytes]:
+    """
+    Write a job or result, with a named codec ``body_fields`` are written as the body of an envelope and the
+    other fields as its json header, other serializers write a plain payload as before.
+    """
+    if not isinstance(serializer, str):
+        return dumps(data, serializer, compression)
+    buffers: List[memoryview] = []
+
+    def extract(v: Any) -> Any:
+        if not isinstance(v, binary_types):
+            return v
+        view = memoryview(v)
+        buffers.append(view.cast('B') if view.c_contiguous else memoryview(view.tobytes()))
+        return {buffer_ref: len(buffers) - 1}
+
+    header_data = {k: v for k, v in data.items() if k not in body_fields}
+    body_data = {k: _map_body_field(k, data[k], extract) for k in body_fields}
+    if buffers:
+        header_data['buffers'] = [b.nbytes for b in buffers]
+    header = json.dumps(header_data, separators=(',', ':')).encode()
+    body = dumps(body_data, serializer, compression)
+    # a single copy of each buffer, into the value sent to redis
+    return b''.join((bytes((envelope_flag,)), len(header).to_bytes(4, 'big'), header, *buffers, body))
+
+
+def _map_body_field(name: str, value: Any, f: Callable[[Any], Any]) -> Any:
+    """
+    Apply ``f`` to each top level argument or to the result.
+    """
+    if name == 'args':
+        return type(value)(f(v) for v in value)
+    elif name == 'kwargs':
+        return {k: f(v) for k, v in value.items()}
+    else:
+        return f(value)
+
+
+def envelope_size(r: Union[str, bytes]) -> Optional[int]:
+    """
+    Number of leading bytes of an envelope needed to decode its header, None if ``r`` isn't an envelope.
+    """
+    if isinstance(r, (bytes, bytearray)) and len(r) >= envelope_prefix_size and r[0] == envelope_flag:
+        return envelope_prefix_size + int.from_bytes(r[1:envelope_prefix_size], 'big')
+    return None
+
+
+def loads_header(
+        r: Union[str, bytes], deserializer: Optional[Deserializer] = None, accept: Optional[FrozenSet[str]] = None
+) -> Dict[str, Any]:
+    """
+    Decode only the header of an envelope, ``r`` may be truncated after the header, other payloads are
+    decoded in full.
+    """
+    size = envelope_size(r)
+    if size is None:
+        return loads(r, deserializer, accept)
+    header = json.loads(r[envelope_prefix_size:size])
+    header.pop('buffers', None)
+    return header
+
+
+def _loads_envelope(
+        r: bytes, size: int, deserializer: Optional[Deserializer], accept: Optional[FrozenSet[str]]
+) -> Dict[str, Any]:
+    header = json.loads(r[envelope_prefix_size:size])
+    buffer_sizes = header.pop('buffers', None)
+    if not buffer_sizes:
+        return {**header, **loads(r[size:], deserializer, accept)}
+    view = memoryview(r)
+    buffers = []
+    for n in buffer_sizes:
+        buffers.append(view[size:size + n])
+        size += n
+
+    def restore(v: Any) -> Any:
+        if type(v) is dict and len(v) == 1 and buffer_ref in v:
+            return buffers[v[buffer_ref]]
+        return v
+
+    body = loads(r[size:], deserializer, accept)
+    return {**header, **{k: _map_body_field(k, v, restore) for k, v in body.items()}}
+
+
+def loads(
+        r: Union[str, bytes], deserializer: Optional[Deserializer] = None, accept: Optional[FrozenSet[str]] = None
+) -> Dict[str, Any]:
+    """
+    Decode a payload, compressed payloads are decompressed first, tagged payloads are decoded by their codec
+    if it's in ``accept``, ``deserializer`` is only used for untagged payloads.
+
+    :param accept: names of the codecs allowed, see :func:`accepted_codecs`, by default only ``deserializer``
+        or json if it's not a codec name
+    """
+    size = envelope_size(r)
+    if size is not None:
+        return _loads_envelope(r, size, deserializer, accept)
+    if isinstance(r, (bytes, bytearray)) and r and r[0] in compressors_by_flag:
+        r = compressors_by_flag[r[0]].decompress(memoryview(r)[1:])
+    if isinstance(r, (bytes, bytearray)) and r and r[0] in codecs_by_tag:
+        codec = codecs_by_tag[r[0]]
+        if accept is None:
+            accept = accepted_codecs(deserializer=deserializer)
+        if codec.name not in accept:
+            raise DeserializationError(
+                f'payload encoded with {codec.name!r} which is not an accepted codec, '
+                f'accepted: {", ".join(sorted(accept))}'
+            )
+        return codec.loads(r[1:])
+    elif deserializer is None:
+        return json.loads(r)
+    elif isinstance(deserializer, str):
+        return get_codec(deserializer).loads(r)
+    else:
+        return deserializer(r)
+
+
+def _restore_blob_refs(d: Dict[str, Any]) -> None:
+    """
+    Turn the arguments listed in a job's "blobs" field back into :class:`BlobRef`.
+    """
+    blobs = d.get('blobs')
+    if not blobs:
+        return
+    args = list(d['args'])
+    for key, digest in blobs:
+        if isinstance(key, int):
+            args[key] = BlobRef(digest)
+        else:
+            d['kwargs'][key] = BlobRef(digest)
+    d['args'] = type(d['args'])(args)
 
 
 def serialize_job(
@@ -21,7 +366,8 @@ def serialize_job(
         queue_name: str,
         *,
         serializer: Optional[Serializer] = None,
-) -> Optional[str]:
+        compression: Optional[Compression] = None,
+) -> Optional[Union[str, bytes]]:
     data = {
         'job_try': job_try,
         'function': function_name,
@@ -30,31 +376,39 @@ def serialize_job(
         'enqueue_time': enqueue_time_ms,
         'queue_name': queue_name
     }
-    if serializer is None:
-        serializer = json.dumps
+    blobs = [[i, v.digest] for i, v in enumerate(args) if isinstance(v, BlobRef)]
+    blobs += [[k, v.digest] for k, v in kwargs.items() if isinstance(v, BlobRef)]
+    if blobs:
+        data['blobs'] = blobs
     try:
-        return serializer(data)
+        return dumps_envelope(data, job_body_fields, serializer, compression)
     except Exception as e:
-        raise SerializationError(f'unable to serialize job "{function_name}"') from e
+        msg = f'unable to serialize job "{function_name}"'
+        if serializer is None and any(isinstance(v, binary_types) for v in (*args, *kwargs.values())):
+            msg += ', bytes arguments need a named job_serializer such as "json" or "msgpack"'
+        raise SerializationError(msg) from e
 
 
-def deserialize_job(r: bytes, *, deserializer: Optional[Deserializer] = None) -> JobDef:
-    if deserializer is None:
-        deserializer = json.loads
+def deserialize_job(
+        r: bytes,
+        *,
+        deserializer: Optional[Deserializer] = None,
+        accept: Optional[FrozenSet[str]] = None,
+        with_body: bool = True,
+) -> JobDef:
+    """
+    With ``with_body=False`` only the header is decoded and ``args`` and ``kwargs`` are None.
+    """
     try:
-        d = deserializer(r)
+        d = loads(r, deserializer, accept) if with_body else loads_header(r, deserializer, accept)
+        if with_body:
+            _restore_blob_refs(d)
         return JobDef(
             function=d['function'],
-            args=d['args'],
-            kwargs=d['kwargs'],
+            args=d['args'] if with_body else None,
+            kwargs=d['kwargs'] if with_body else None,
             job_try=d['job_try'],
-            enqueue_time=ms_to_datetime(d['enqueue_time']),
-            score=None,
-            state=None,
-            job_id=None,
-            start_time=None,
-            queue_name=None,
-            worker_name=None,
+            enqueue_ms=d['enqueue_time'],
         )
     except Exception as e:
         raise DeserializationError('unable to deserialize job') from e
@@ -63,12 +417,12 @@ def deserialize_job(r: bytes, *, deserializer: Optional[Deserializer] = None) ->
 def deserialize_job_raw(
         r: bytes,
         *,
-        deserializer: Optional[Deserializer] = None
+        deserializer: Optional[Deserializer] = None,
+        accept: Optional[FrozenSet[str]] = None,
 ) -> Tuple[str, Tuple[Any, ...], Dict[str, Any], int, int]:
-    if deserializer is None:
-        deserializer = json.loads
     try:
-        d = deserializer(r)
+        d = loads(r, deserializer, accept)
+        _restore_blob_refs(d)
         return d['function'], d['args'], d['kwargs'], d['job_try'], d['enqueue_time']
     except Exception as e:
         raise DeserializationError('unable to deserialize job') from e
@@ -89,8 +443,16 @@ def serialize_result(
         worker_name: str,
         job_id: str,
         *,
+        due_ms: Optional[int] = None,
+        claim_ms: Optional[int] = None,
         serializer: Optional[Serializer] = None,
-) -> Optional[str]:
+        compression: Optional[Compression] = None,
+) -> Optional[Union[str, bytes]]:
+    """
+    ``due_ms`` is the time the job was scheduled to run (its queue score), ``claim_ms`` the time the worker
+    marked it in progress. The time the result is recorded, now, is stored as ``record_ms``, it's taken before
+    serializing so it doesn't include serialization or the redis write.
+    """
     data = {
         'job_try': job_try,
         'function': function,
@@ -101,46 +463,56 @@ def serialize_result(
         'result': result,
         'start_ms': start_ms,
         'finished_ms': finished_ms,
+        'due_ms': due_ms,
+        'claim_ms': claim_ms,
+        'record_ms': timestamp_ms(),
         'queue_name': queue_name,
         'worker_name': worker_name,
         'job_id':job_id
     }
-    if serializer is None:
-        serializer = json.dumps
-    # try:
-    return serializer(data)
-    # except Exception:
-    #     logger.warning('error serializing result of %s', ref, exc_info=True)
+    try:
+        return dumps_envelope(data, result_body_fields, serializer, compression)
+    except Exception:
+        logger.warning('error serializing result of %s', ref, exc_info=True)
 
     # use string in case serialization fails again
-    data.update(r='unable to serialize result', s=False)
+    data.update(result='unable to serialize result', success=False)
     try:
-        return serializer(data)
+        return dumps_envelope(data, result_body_fields, serializer, compression)
     except Exception:
         logger.critical('error serializing result of %s even after replacing result', ref, exc_info=True)
     return None
 
 
-def deserialize_result(r: bytes, *, deserializer: Optional[Deserializer] = None) -> JobResult:
-    if deserializer is None:
-        deserializer = json.loads
+def deserialize_result(
+        r: bytes,
+        *,
+        deserializer: Optional[Deserializer] = None,
+        accept: Optional[FrozenSet[str]] = None,
+        with_body: bool = True,
+) -> JobResult:
+    """
+    With ``with_body=False`` only the header is decoded and ``args``, ``kwargs`` and ``result`` are None.
+    """
     try:
-        d = deserializer(r)
+        d = loads(r, deserializer, accept) if with_body else loads_header(r, deserializer, accept)
         return JobResult(
             job_try=d['job_try'],
             function=d['function'],
-            args=d['args'],
-            kwargs=d['kwargs'],
-            enqueue_time=ms_to_datetime(d['enqueue_time_ms']),
-            score=None,
+            args=d['args'] if with_body else None,
+            kwargs=d['kwargs'] if with_body else None,
             success=d['success'],
-            result=d['result'],
-            start_time=ms_to_datetime(d['start_ms']),
-            finish_time=ms_to_datetime(d['finished_ms']),
+            result=d['result'] if with_body else None,
             queue_name=d.get('queue_name', '<unknown>'),
             worker_name=d.get('worker_name', '<unknown>'),
             job_id=d.get('job_id'),
-            state=d.get('state')
+            state=d.get('state'),
+            enqueue_ms=d['enqueue_time_ms'],
+            due_ms=d.get('due_ms'),
+            claim_ms=d.get('claim_ms'),
+            start_ms=d['start_ms'],
+            finish_ms=d['finished_ms'],
+            record_ms=d.get('record_ms'),
         )
     except Exception as e:
         raise DeserializationError('unable to deserialize job result') from e
@@ -160,7 +532,7 @@ def deserialize_func(
                 function_name=dd["function_name"],
                 coroutine_name=dd["coroutine_name"],
                 is_timer=dd["is_timer"],
-                enqueue_time=ms_to_datetime(dd['enqueue_time']))
+                enqueue_time=dd['enqueue_time'])
             for dd in d
         ]
     except Exception as e:
@@ -180,8 +552,27 @@ def deserialize_worker(
             worker_name=d["worker_name"],
             queue_name=d["queue_name"],
             functions=d["functions"],
-            enqueue_time=ms_to_datetime(d['enqueue_time']),
+            enqueue_time=d['enqueue_time'],
             is_action=d["is_action"]
         )
     except Exception as e:
         raise DeserializationError('unable to deserialize job worker') from e
+
+
+def dump_health(health: Dict[str, Any], expire_ms: int) -> str:
+    """
+    Health check as stored in the worker registry hash, with the time it expires since hash fields have no TTL.
+    """
+    return json.dumps({'expire_ms': expire_ms, 'health': health})
+
+
+def load_health(r: Optional[bytes], now_ms: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Inverse of :func:`dump_health`, an empty dict if there's no health check or it has expired.
+    """
+    if not r:
+        return {}
+    d = json.loads(r)
+    if d['expire_ms'] <= (timestamp_ms() if now_ms is None else now_ms):
+        return {}
+    return d['health']
@@ -1,7 +1,8 @@
-from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, ClassVar, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .utils import ms_to_datetime, to_unix_ms
 
 
 class JobStatus(str, Enum):
@@ -20,49 +21,376 @@ class JobStatus(str, Enum):
     not_found = 'not_found'
 
 
-@dataclass
-class JobWorker:
-    worker_name: str
-    queue_name: str
-    functions: list
-    enqueue_time: int
-    is_action: bool
-    health_check: Dict[str, Any] = None
+class MsDatetime:
+    """
+    ``datetime`` view of an int unix ms attribute, built on first access and cached until the ms value changes.
+
+    Setting a datetime sets the ms attribute, setting an int treats it as ms.
+    """
+
+    def __init__(self, ms_name: str):
+        self.ms_name = ms_name
+        self.cache_name = ''
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.cache_name = f'_{name}'
+
+    def __get__(self, obj: Any, owner: Optional[type] = None) -> Any:
+        if obj is None:
+            return self
+        ms = getattr(obj, self.ms_name)
+        cached = getattr(obj, self.cache_name)
+        if cached is not None and cached[0] == ms:
+            return cached[1]
+        if ms is None:
+            return None
+        dt = ms_to_datetime(ms)
+        setattr(obj, self.cache_name, (ms, dt))
+        return dt
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        if isinstance(value, datetime):
+            ms: Optional[int] = to_unix_ms(value)
+        elif isinstance(value, int):
+            ms, value = value, None
+        else:
+            ms = None
+        setattr(obj, self.ms_name, ms)
+        setattr(obj, self.cache_name, None if value is None else (ms, value))
+
+
+class Record:
+    """
+    Base of the slotted record types, ``fields`` are the public attributes in constructor order,
+    ``compare_fields`` those used for equality.
+    """
+
+    __slots__ = ()
+    fields: ClassVar[Tuple[str, ...]] = ()
+    compare_fields: ClassVar[Tuple[str, ...]] = ()
+    #: datetime attributes and the int ms attributes they're built from
+    time_fields: ClassVar[Dict[str, str]] = {}
+
+    def __init_subclass__(cls) -> None:
+        cls.time_fields = {
+            name: attr.ms_name for klass in cls.__mro__ for name, attr in vars(klass).items()
+            if isinstance(attr, MsDatetime)
+        }
+
+    def to_dict(self, *, datetimes: bool = True) -> Dict[str, Any]:
+        """
+        Public attributes as a dict, with ``datetimes=False`` datetime attributes are given as int unix ms.
+        """
+        d = {f: getattr(self, f) for f in self.fields if datetimes or f not in self.time_fields}
+        if not datetimes:
+            d.update({f: getattr(self, ms_name) for f, ms_name in self.time_fields.items() if f in self.fields})
+        return d
+
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.compare_fields)
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({', '.join(f'{f}={getattr(self, f)!r}' for f in self.fields)})"
+
+
+class JobWorker(Record):
+    __slots__ = ('worker_name', 'queue_name', 'functions', 'enqueue_ms', 'is_action', 'health_check', '_enqueue_time')
+    fields = 'worker_name', 'queue_name', 'functions', 'enqueue_time', 'is_action', 'health_check'
+    compare_fields = fields
 
+    enqueue_time = MsDatetime('enqueue_ms')
 
-@dataclass
-class JobFunc:
-    function_name: str
-    coroutine_name: str
-    enqueue_time: datetime
-    is_timer: bool
+    def __init__(
+            self,
+            worker_name: str,
+            queue_name: str,
+            functions: list,
+            enqueue_time: Any,
+            is_action: bool,
+            health_check: Optional[Dict[str, Any]] = None,
+    ):
+        self.worker_name = worker_name
+        self.queue_name = queue_name
+        self.functions = functions
+        self.enqueue_time = enqueue_time
+        self.is_action = is_action
+        self.health_check = health_check
 
 
-@dataclass
-class JobDef:
-    function: str
-    args: Tuple[Any, ...]
-    kwargs: Dict[str, Any]
-    job_try: int
-    enqueue_time: datetime
-    score: Optional[int]
-    state: Optional[str]
-    job_id: Optional[str]
-    start_time: Optional[datetime]
-    queue_name: Optional[str]
-    worker_name: Optional[str]
+class JobFunc(Record):
+    __slots__ = ('function_name', 'coroutine_name', 'enqueue_ms', 'is_timer', '_enqueue_time')
+    fields = 'function_name', 'coroutine_name', 'enqueue_time', 'is_timer'
+    compare_fields = fields
+
+    enqueue_time = MsDatetime('enqueue_ms')
+
+    def __init__(self, function_name: str, coroutine_name: str, enqueue_time: Any, is_timer: bool):
+        self.function_name = function_name
+        self.coroutine_name = coroutine_name
+        self.enqueue_time = enqueue_time
+        self.is_timer = is_timer
+
+
+class JobDef(Record):
+    """
+    A job as stored in redis, times are kept as int unix ms, ``enqueue_time`` and ``start_time`` are
+    built from them on first access.
+    """
 
+    __slots__ = (
+        'function',
+        'args',
+        'kwargs',
+        'job_try',
+        'enqueue_ms',
+        'score',
+        'state',
+        'job_id',
+        'start_ms',
+        'queue_name',
+        'worker_name',
+        '_enqueue_time',
+        '_start_time',
+    )
+    fields = (
+        'function',
+        'args',
+        'kwargs',
+        'job_try',
+        'enqueue_time',
+        'score',
+        'state',
+        'job_id',
+        'start_time',
+        'queue_name',
+        'worker_name',
+    )
+    compare_fields = fields
 
-    def __post_init__(self) -> None:
-        if isinstance(self.score, float):
-            self.score = int(self.score)
+    enqueue_time = MsDatetime('enqueue_ms')
+    start_time = MsDatetime('start_ms')
+
+    def __init__(
+            self,
+            function: str,
+            args: Optional[Tuple[Any, ...]] = None,
+            kwargs: Optional[Dict[str, Any]] = None,
+            job_try: Optional[int] = None,
+            enqueue_time: Optional[datetime] = None,
+            score: Optional[int] = None,
+            state: Optional[str] = None,
+            job_id: Optional[str] = None,
+            start_time: Optional[datetime] = None,
+            queue_name: Optional[str] = None,
+            worker_name: Optional[str] = None,
+            *,
+            enqueue_ms: Optional[int] = None,
+            start_ms: Optional[int] = None,
+    ):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.job_try = job_try
+        self.score = int(score) if isinstance(score, float) else score
+        self.state = state
+        self.job_id = job_id
+        self.queue_name = queue_name
+        self.worker_name = worker_name
+        self.enqueue_ms = enqueue_ms
+        self._enqueue_time = None
+        if enqueue_time is not None:
+            self.enqueue_time = enqueue_time
+        self.start_ms = start_ms
+        self._start_time = None
+        if start_time is not None:
+            self.start_time = start_time
 
 
-@dataclass
 class JobResult(JobDef):
-    success: bool
-    result: Any
-    finish_time: datetime
+    __slots__ = ('success', 'result', 'finish_ms', 'due_ms', 'claim_ms', 'record_ms', '_finish_time')
+    # full precision unix ms timestamps of each stage, None for results written by older versions
+    fields = JobDef.fields + (
+        'success',
+        'result',
+        'finish_time',
+        'enqueue_ms',
+        'due_ms',
+        'claim_ms',
+        'start_ms',
+        'finish_ms',
+        'record_ms',
+    )
+    compare_fields = JobDef.fields + ('success', 'result', 'finish_time')
+
+    finish_time = MsDatetime('finish_ms')
+
+    def __init__(
+            self,
+            function: str,
+            args: Optional[Tuple[Any, ...]] = None,
+            kwargs: Optional[Dict[str, Any]] = None,
+            job_try: Optional[int] = None,
+            enqueue_time: Optional[datetime] = None,
+            score: Optional[int] = None,
+            state: Optional[str] = None,
+            job_id: Optional[str] = None,
+            start_time: Optional[datetime] = None,
+            queue_name: Optional[str] = None,
+            worker_name: Optional[str] = None,
+            success: Optional[bool] = None,
+            result: Any = None,
+            finish_time: Optional[datetime] = None,
+            *,
+            enqueue_ms: Optional[int] = None,
+            due_ms: Optional[int] = None,
+            claim_ms: Optional[int] = None,
+            start_ms: Optional[int] = None,
+            finish_ms: Optional[int] = None,
+            record_ms: Optional[int] = None,
+    ):
+        super().__init__(
+            function,
+            args,
+            kwargs,
+            job_try,
+            enqueue_time,
+            score,
+            state,
+            job_id,
+            start_time,
+            queue_name,
+            worker_name,
+            enqueue_ms=enqueue_ms,
+            start_ms=start_ms,
+        )
+        self.success = success
+        self.result = result
+        self.due_ms = due_ms
+        self.claim_ms = claim_ms
+        self.record_ms = record_ms
+        self.finish_ms = finish_ms
+        self._finish_time = None
+        if finish_time is not None:
+            self.finish_time = finish_time
+
+    @property
+    def queue_wait_ms(self) -> Optional[int]:
+        """
+        time between the job being due and a worker claiming it
+        """
+        if self.claim_ms is None or self.due_ms is None:
+            return None
+        return self.claim_ms - self.due_ms
+
+    @property
+    def setup_ms(self) -> Optional[int]:
+        """
+        time between the claim and the job function starting, eg. fetching and deserializing the payload
+        """
+        if self.start_ms is None or self.claim_ms is None:
+            return None
+        return self.start_ms - self.claim_ms
+
+    @property
+    def run_ms(self) -> Optional[int]:
+        if self.finish_ms is None or self.start_ms is None:
+            return None
+        return self.finish_ms - self.start_ms
+
+    @property
+    def wrap_up_ms(self) -> Optional[int]:
+        """
+        time between the job function finishing and the worker recording its result, eg. logging and hooks,
+        serializing and writing the result aren't included
+        """
+        if self.record_ms is None or self.finish_ms is None:
+            return None
+        return self.record_ms - self.finish_ms
+
+
+class RecordBatch:
+    """
+    Column oriented list of records for list endpoints, one list per column rather than one object per record.
+
+    Times are kept as int unix ms, :meth:`rows` only builds datetimes for the rows actually returned.
+    """
+
+    __slots__ = ('columns',)
+    column_names: ClassVar[Tuple[str, ...]] = ()
+    #: datetimes added to each row by :meth:`rows` and the int ms columns they're built from
+    time_columns: ClassVar[Dict[str, str]] = {}
+
+    def __init__(self, columns: Optional[Dict[str, List[Any]]] = None):
+        self.columns: Dict[str, List[Any]] = columns or {c: [] for c in self.column_names}
+
+    @classmethod
+    def from_records(cls, records: Iterable[Record]) -> 'RecordBatch':
+        batch = cls()
+        for record in records:
+            batch.append(record)
+        return batch
+
+    def append(self, record: Record) -> None:
+        for name, column in self.columns.items():
+            column.append(getattr(record, name))
+
+    def __len__(self) -> int:
+        return len(self.columns[self.column_names[0]])
+
+    def take(self, indices: Sequence[int]) -> 'RecordBatch':
+        return self.__class__({name: [column[i] for i in indices] for name, column in self.columns.items()})
+
+    def where(self, name: str, predicate: Callable[[Any], bool]) -> 'RecordBatch':
+        """
+        Rows for which ``predicate`` is true for the value of column ``name``.
+        """
+        return self.take([i for i, v in enumerate(self.columns[name]) if predicate(v)])
+
+    def sort(self, name: str, *, reverse: bool = False) -> 'RecordBatch':
+        column = self.columns[name]
+        return self.take(sorted(range(len(column)), key=column.__getitem__, reverse=reverse))
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Rows ``start`` to ``stop`` as dicts.
+        """
+        names = list(self.columns)
+        rows = []
+        for values in zip(*(self.columns[n][start:stop] for n in names)):
+            row = dict(zip(names, values))
+            for time_name, ms_name in self.time_columns.items():
+                ms = row[ms_name]
+                row[time_name] = None if ms is None else ms_to_datetime(ms)
+            rows.append(row)
+        return rows
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__} {len(self)} rows>'
+
+
+class JobDefBatch(RecordBatch):
+    __slots__ = ()
+    column_names = (
+        'function',
+        'args',
+        'kwargs',
+        'job_try',
+        'enqueue_ms',
+        'score',
+        'state',
+        'job_id',
+        'start_ms',
+        'queue_name',
+        'worker_name',
+    )
+    time_columns = JobDef.time_fields
+
 
-    def __post_init__(self) -> None:
-        ...
+class JobResultBatch(RecordBatch):
+    __slots__ = ()
+    column_names = JobDefBatch.column_names + ('success', 'result', 'finish_ms', 'due_ms', 'claim_ms', 'record_ms')
+    time_columns = JobResult.time_fields
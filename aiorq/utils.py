@@ -1,10 +1,11 @@
 import asyncio
 import getpass
 import logging
+import math
 import uuid
 from datetime import datetime, timedelta
 from time import time
-from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, Optional, Sequence, overload
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, List, Optional, Sequence, overload
 
 logger = logging.getLogger('aiorq.utils')
 
@@ -29,7 +30,7 @@ def to_unix_ms(dt: datetime) -> int:
 
 def ms_to_datetime(unix_ms: int) -> datetime:
     # tz_ = timezone(timedelta(hours=8))
-    return datetime.fromtimestamp(int(unix_ms / 1000), tz=None)
+    return datetime.fromtimestamp(unix_ms / 1000, tz=None)
 
 
 @overload
@@ -79,6 +80,15 @@ async def poll(step: float = 0.5) -> AsyncGenerator[float, None]:
         await asyncio.sleep(wait)
 
 
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a non empty list, ``pct`` between 0 and 100.
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
 DEFAULT_CURTAIL = 80
 
 
@@ -1,5 +1,5 @@
 import asyncio
-import dataclasses
+import heapq
 import inspect
 import json
 import logging
@@ -10,6 +10,7 @@ import traceback
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from functools import partial
+from itertools import count
 from signal import Signals
 from time import time
 from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union, cast
@@ -17,25 +18,35 @@ from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence,
 from aioredis.exceptions import ResponseError, WatchError
 from pydantic.utils import import_string
 
-from .connections import RedisSettings, create_pool, log_redis_info, AioRedis
+from .connections import RedisSettings, create_pool, log_redis_info, AioRedis, index_result, trim_results_indexes
 from .constants import (
     abort_job_max_age,
     abort_jobs_ss,
+    cron_last_run_key_prefix,
+    cron_leader_key_prefix,
     default_queue_name,
     health_check_key_suffix,
     in_progress_key_prefix,
     job_key_prefix,
     keep_cronjob_progress,
     result_key_prefix,
+    results_index_trim_interval,
     retry_key_prefix,
-    worker_key,
-    worker_key_close_expire,
+    workers_health_key,
+    workers_key,
+    workers_seen_key,
     default_worker_name,
     func_key
 )
 from .cron import CronJob
 from .exception import FailedJobs, Retry, JobExecutionFailed, RetryJob, SerializationError
-from .serialize import Serializer, Deserializer, deserialize_job_raw, serialize_result
+from .blobs import BlobCache, blob_refs, release_blobs
+from .hooks import Hooks, JobEvent
+from .lease import Lease
+from .profiler import profile_coroutine, sample_profiler, save_profile
+from .serialize import (
+    Compression, Serializer, Deserializer, accepted_codecs, deserialize_job_raw, dump_health, serialize_result
+)
 from .specs import JobWorker,JobFunc
 from .utils import args_to_string, ms_to_datetime, poll, timestamp_ms, to_ms, to_seconds, to_unix_ms, truncate
 from .version import __version__
@@ -55,6 +66,7 @@ class Function:
     keep_result_s: Optional[float]
     keep_result_forever: Optional[bool]
     max_tries: Optional[int]
+    profile_sample_rate: Optional[float]
 
 
 def func(
@@ -65,6 +77,7 @@ def func(
         timeout: Optional['SecondsTimedelta'] = None,
         keep_result_forever: Optional[bool] = None,
         max_tries: Optional[int] = None,
+        profile_sample_rate: Optional[float] = None,
 ) -> Function:
     """
     Wrapper for a job function which lets you configure more settings.
@@ -74,6 +87,7 @@ def func(
     :param keep_result_forever: whether to keep results forever, if None use Worker default, wins over ``keep_result``
     :param timeout: maximum time the job should take
     :param max_tries: maximum number of tries allowed for the function, use 1 to prevent retrying
+    :param profile_sample_rate: fraction of runs to profile with cProfile, if None use Worker default
     """
     if isinstance(coroutine, Function):
         return coroutine
@@ -87,7 +101,10 @@ def func(
     assert asyncio.iscoroutinefunction(coroutine_), f'{coroutine_} is not a coroutine function'
     timeout = to_seconds(timeout)
     keep_result = to_seconds(keep_result)
-    return Function(name or coroutine_.__qualname__, coroutine_, timeout, keep_result, keep_result_forever, max_tries)
+    return Function(
+        name or coroutine_.__qualname__, coroutine_, timeout, keep_result, keep_result_forever, max_tries,
+        profile_sample_rate
+    )
 
 
 class Worker:
@@ -114,8 +131,19 @@ class Worker:
     :param retry_jobs:是否在重试时重试作业或取消错误
     :param allow_abort_jobs:是否在调用:func:aiorq时中止作业。乔布斯。工作流产
     :param max_burst_jobs:在突发模式下要处理的最大作业数（使用负值禁用）
-    :param job_serializer:将Python对象序列化为字节的函数,默认为pickle。倾倒
-    :param job_deserializer:将字节反序列化为Python对象的函数,默认为pickle。荷载
+    :param job_serializer:将Python对象序列化为字节的函数,或已注册编解码器的名称,见 :class:`aiorq.connections.AioRedis`,
+        不使用 redis_pool 的设置;任务带有 bytes 参数时需要与生产者一样使用编解码器名称,否则结果无法写回
+    :param job_deserializer:反序列化不带格式标记数据的函数或编解码器名称
+    :param accept_codecs:除 ``job_serializer`` 和 ``job_deserializer`` 以外允许解码的编解码器名称,
+        见 :func:`aiorq.serialize.accepted_codecs`
+    :param profile_sample_rate:默认使用 cProfile 分析的作业比例,0 表示不分析
+    :param hooks:任务生命周期钩子,见 :class:`aiorq.hooks.Hooks`,同时传递给 worker 创建的 redis 连接池;
+        传入 ``redis_pool`` 时默认使用它的钩子,该连接池的钩子不会被修改,入队钩子需要直接设置在连接池上
+    :param compression:任务结果的压缩设置,见 :class:`aiorq.serialize.Compression`,
+        默认使用 ``redis_pool`` 对该队列的设置
+    :param blob_cache_size:本地缓存的 blob 参数的最大总字节数,见 :mod:`aiorq.blobs`
+    :param cron_leader_lease:设置后同一队列的 worker 通过 redis 租约选出一个主节点,只有主节点调度定时任务,
+        主节点停止续约后其他 worker 最迟在 4/3 个租约时间后接替,见 :mod:`aiorq.lease`
     """
 
     def __init__(
@@ -146,6 +174,12 @@ class Worker:
             max_burst_jobs: int = -1,
             job_serializer: Optional[Serializer] = None,
             job_deserializer: Optional[Deserializer] = None,
+            accept_codecs: Sequence[str] = (),
+            profile_sample_rate: float = 0,
+            hooks: Optional[Hooks] = None,
+            compression: Optional[Compression] = None,
+            blob_cache_size: int = 64 * 1024 * 1024,
+            cron_leader_lease: Optional['SecondsTimedelta'] = None,
     ):
         self.functions: Dict[str, Union[Function, CronJob]] = {f.name: f for f in map(func, functions)}
 
@@ -156,12 +190,18 @@ class Worker:
                 raise ValueError('If queue_name is absent, redis_pool must be present.')
         self.queue_name = queue_name
         self.worker_name = worker_name or self.name
-        self.cron_jobs: List[CronJob] = []
+        # 定时任务按 run_at (加上抖动的 next_run) 保存在最小堆中,每次心跳只取出到期的任务
+        # 堆中的元素为 (run_at 的 unix 毫秒, 序号, 定时任务),带时区与不带时区的 next_run 可以比较
+        # 移除的任务不从堆中删除,序号与 _cron_entries 中的不一致即为失效
+        self._cron_jobs: Dict[str, CronJob] = {}
+        self._cron_heap: List[Tuple[int, int, CronJob]] = []
+        self._cron_entries: Dict[str, int] = {}
+        self._cron_pending: Dict[str, CronJob] = {}
+        self._cron_seq = count()
         if cron_jobs is not None:
             assert all(isinstance(cj, CronJob) for cj in cron_jobs), 'cron_jobs, must be instances of CronJob'
-            self.cron_jobs = list(cron_jobs)
-            # 普通任务 + 定时任务
-            self.functions.update({cj.name: cj for cj in self.cron_jobs})
+            for cj in cron_jobs:
+                self.add_cron_job(cj)
 
         # 方法列表 > 0
         assert len(self.functions) > 0, 'at least one function or cron_job must be registered'
@@ -211,6 +251,7 @@ class Worker:
         self.jobs_failed = 0
         self.j_ongoing = 0
         self._last_health_check: float = 0
+        self._last_results_trim: float = 0
         self._last_health_check_log: Optional[str] = None
 
         # 信号
@@ -229,6 +270,24 @@ class Worker:
         self.max_burst_jobs = max_burst_jobs
         self.job_serializer = job_serializer
         self.job_deserializer = job_deserializer
+        self.accept_codecs = accept_codecs
+        # 只解码配置的编解码器写入的数据,不会对其他格式标记的数据调用 pickle.loads 等
+        self.job_accept = accepted_codecs(job_serializer, job_deserializer, accept_codecs)
+        self.profile_sample_rate = profile_sample_rate
+        if hooks is None:
+            hooks = Hooks() if redis_pool is None else redis_pool.hooks
+        self.hooks = hooks
+        if compression is None and redis_pool is not None:
+            compression = redis_pool.compression_for(queue_name)
+        self.compression = compression
+        self.blob_cache = BlobCache(blob_cache_size)
+        self.cron_lease: Optional[Lease] = None
+        if cron_leader_lease is not None:
+            self.cron_lease = Lease(
+                cron_leader_key_prefix + self.queue_name, cast(float, to_seconds(cron_leader_lease)), self.worker_name
+            )
+        # 曾作为从节点跳过定时任务调度
+        self._cron_followed = False
 
     @property
     def name(self):
@@ -236,6 +295,42 @@ class Worker:
         shortname, _, _ = hostname.partition('.')
         return f'{shortname}.{os.getpid()}'
 
+    @property
+    def cron_jobs(self) -> List[CronJob]:
+        return list(self._cron_jobs.values())
+
+    def add_cron_job(self, cron_job: CronJob) -> None:
+        """
+        添加定时任务,可在运行中调用,下一次心跳时开始调度
+        同名的定时任务会被替换
+        """
+        assert isinstance(cron_job, CronJob), 'cron_job, must be an instance of CronJob'
+        self._cron_entries.pop(cron_job.name, None)
+        self._cron_jobs[cron_job.name] = cron_job
+        self._cron_pending[cron_job.name] = cron_job
+        # 普通任务 + 定时任务
+        self.functions[cron_job.name] = cron_job
+
+    def remove_cron_job(self, name: str) -> Optional[CronJob]:
+        """
+        移除定时任务,不再调度;已入队的运行仍会执行
+        """
+        cron_job = self._cron_jobs.pop(name, None)
+        if cron_job is None:
+            return None
+        self._cron_entries.pop(name, None)
+        self._cron_pending.pop(name, None)
+        # 失效元素过多时重建堆
+        if len(self._cron_heap) > 2 * len(self._cron_entries) + 64:
+            self._cron_heap = [e for e in self._cron_heap if self._cron_entries.get(e[2].name) == e[1]]
+            heapq.heapify(self._cron_heap)
+        return cron_job
+
+    def _push_cron_job(self, cron_job: CronJob) -> None:
+        seq = next(self._cron_seq)
+        self._cron_entries[cron_job.name] = seq
+        heapq.heappush(self._cron_heap, (to_unix_ms(cron_job.run_at), seq, cron_job))
+
     async def _set_worker_state(self, _pool, worker_name):
         w_ = JobWorker(
             queue_name=self.queue_name,
@@ -243,8 +338,20 @@ class Worker:
             functions=list(self.functions.keys()),
             enqueue_time=timestamp_ms(),
             is_action=True)
-        worker_ = dataclasses.asdict(w_)
-        await _pool.set(f'{worker_key}:{self.worker_name}', json.dumps(worker_))
+        worker_ = w_.to_dict(datetimes=False)
+        await self._set_worker_registry(_pool, json.dumps(worker_))
+
+    async def _set_worker_registry(self, _pool: AioRedis, worker: str) -> None:
+        """
+        所有 worker 的信息和健康检查分别保存在两个以 worker 名称为字段的哈希中,
+        最后活跃时间保存在有序集合中,用于找出并清理不再活跃的 worker
+        启动和停止时清除上一次的健康检查
+        """
+        async with _pool.pipeline(transaction=False) as pipe:
+            pipe.hset(workers_key, self.worker_name, worker)
+            pipe.hdel(workers_health_key, self.worker_name)
+            pipe.zadd(workers_seen_key, {self.worker_name: timestamp_ms()})
+            await pipe.execute()
 
     async def _set_functions_state(self, _pool):
         _ = []
@@ -256,7 +363,7 @@ class Worker:
                 is_timer=isinstance(func, CronJob),
             )
 
-            function_ = dataclasses.asdict(f_)
+            function_ = f_.to_dict(datetimes=False)
             _.append(function_)
         await _pool.set(f'{func_key}', json.dumps(_))
 
@@ -309,7 +416,10 @@ class Worker:
                 self.redis_settings,
                 job_deserializer=self.job_deserializer,
                 job_serializer=self.job_serializer,
+                accept_codecs=self.accept_codecs,
                 default_queue_name=self.queue_name,
+                hooks=self.hooks,
+                compression=self.compression,
             )
 
         # 设置 redis 值
@@ -441,14 +551,18 @@ class Worker:
                     self.sem.release()
                     logger.debug('multi-exec error, job %s already started elsewhere', job_id)
                 else:
-                    # 调用创建 任务 并执行任务
-                    t = self.loop.create_task(self.run_job(job_id, score, worke_namer))
+                    # 调用创建 任务 并执行任务, job_claimed 钩子在任务中调用,不阻塞认领后续作业
+                    t = self.loop.create_task(self.run_job(job_id, score, worke_namer, timestamp_ms()))
                     # 回调方法 释放锁
                     t.add_done_callback(lambda _: self.sem.release())
                     self.tasks[job_id] = t
 
     # 运行任务
-    async def run_job(self, job_id: str, score: int, worker_name: str) -> None:  # noqa: C901
+    async def run_job(  # noqa: C901
+            self, job_id: str, score: int, worker_name: str, claim_ms: Optional[int] = None
+    ) -> None:
+        if claim_ms is not None and self.hooks.job_claimed:
+            await self.hooks.emit(JobEvent('job_claimed', job_id, self.queue_name, score=score, claim_ms=claim_ms))
         start_ms = timestamp_ms()
         async with self.pool.pipeline(transaction=True) as pipe:
             pipe.get(job_key_prefix + job_id)
@@ -464,6 +578,7 @@ class Worker:
         function_name, enqueue_time_ms = '<unknown>', 0
         args: Tuple[Any, ...] = ()
         kwargs: Dict[Any, Any] = {}
+        blobs: Tuple[str, ...] = ()
 
         # 任务失败时
         async def job_failed(exc: BaseException) -> None:
@@ -480,11 +595,19 @@ class Worker:
                 finished_ms=timestamp_ms(),
                 ref=f'{job_id}:{function_name}',
                 serializer=self.job_serializer,
+                compression=self.compression,
                 queue_name=self.queue_name,
                 worker_name=worker_name,
-                job_id=job_id
+                job_id=job_id,
+                due_ms=int(score),
+                claim_ms=claim_ms,
             )
-            await asyncio.shield(self.finish_failed_job(job_id, result_data_))
+            await asyncio.shield(self.finish_failed_job(job_id, result_data_, blobs, function_name))
+            if self.hooks.result_written:
+                await self.hooks.emit(JobEvent(
+                    'result_written', job_id, self.queue_name, function=function_name, job_try=job_try, score=score,
+                    enqueue_time_ms=enqueue_time_ms, claim_ms=claim_ms, result_ms=timestamp_ms(), success=False,
+                ))
 
         # 任务id 失效, 直接调用错误
         if not v:
@@ -494,11 +617,12 @@ class Worker:
         try:
             # 反序列化取出 function_name, args, kwargs, enqueue_job_try, enqueue_time_ms
             function_name, args, kwargs, enqueue_job_try, enqueue_time_ms = deserialize_job_raw(
-                v, deserializer=self.job_deserializer
+                v, deserializer=self.job_deserializer, accept=self.job_accept
             )
         except SerializationError as e:
             logger.exception('deserializing job %s failed', job_id)
             return await job_failed(e)
+        blobs = blob_refs(args, kwargs)
 
         # 这里是判断该方法是否已经加入、存在于中止队列中,如果在 abort_job 为 True,直接抛出 asyncio.CancelledError
         # 因为如果调用了 abort 方法 会将其 job_id 加入到中止队列,所以这里要判断是否存在于 中止队列中
@@ -515,6 +639,17 @@ class Worker:
             logger.warning('job %s, function %r not found', job_id, function_name)
             return await job_failed(JobExecutionFailed(f'function {function_name!r} not found'))
 
+        # 结果中保留 blob 引用,只有调用函数时使用 blob 的值
+        call_args, call_kwargs = args, kwargs
+        if blobs:
+            try:
+                call_args, call_kwargs = await self.blob_cache.resolve(
+                    self.pool, args, kwargs, blobs, self.job_deserializer, self.job_accept
+                )
+            except (JobExecutionFailed, SerializationError) as e:
+                logger.warning('job %s, %s', job_id, e)
+                return await job_failed(e)
+
         # 包含属性 next_run 有就是定时任务
         if hasattr(function, 'next_run'):
             # 定时任务 需要 keep_in_progress (一直在进行中)
@@ -553,9 +688,18 @@ class Worker:
                 self.queue_name,
                 worker_name,
                 job_id,
+                due_ms=int(score),
+                claim_ms=claim_ms,
                 serializer=self.job_serializer,
+                compression=self.compression,
             )
-            return await asyncio.shield(self.finish_failed_job(job_id, result_data))
+            await asyncio.shield(self.finish_failed_job(job_id, result_data, blobs, function_name))
+            if self.hooks.result_written:
+                await self.hooks.emit(JobEvent(
+                    'result_written', job_id, self.queue_name, function=function_name, job_try=job_try, score=score,
+                    enqueue_time_ms=enqueue_time_ms, claim_ms=claim_ms, result_ms=timestamp_ms(), success=False,
+                ))
+            return None
         result = no_result
         exc_extra = None
         finish = False
@@ -568,15 +712,28 @@ class Worker:
             'score': score,
         }
         ctx = {**self.ctx, **job_ctx}
+        # 按采样率决定本次执行是否使用 cProfile 分析
+        profile_sample_rate = (
+            self.profile_sample_rate if function.profile_sample_rate is None else function.profile_sample_rate
+        )
+        profiler = sample_profiler(profile_sample_rate)
         start_ms = timestamp_ms()
         success = False
+        if self.hooks.job_started:
+            await self.hooks.emit(JobEvent(
+                'job_started', job_id, self.queue_name, function=function_name, job_try=job_try, score=score,
+                enqueue_time_ms=enqueue_time_ms, claim_ms=claim_ms, start_ms=start_ms,
+            ))
         try:
             s = args_to_string(args, kwargs)
             extra = f' job_try={job_try}' if job_try > 1 else ''
             if (start_ms - score) > 1200:
                 extra += f' delayed={(start_ms - score) / 1000:0.2f}s'
             logger.info('%6.2fs → %s(%s)%s', (start_ms - enqueue_time_ms) / 1000, ref, s, extra)
-            self.job_tasks[job_id] = task = self.loop.create_task(function.coroutine(ctx, *args, **kwargs))
+            coro = function.coroutine(ctx, *call_args, **call_kwargs)
+            if profiler is not None:
+                coro = profile_coroutine(coro, profiler)
+            self.job_tasks[job_id] = task = self.loop.create_task(coro)
 
             # 如果超过预定的超时时间做 取消处理
             cancel_handler = self.loop.call_at(self.loop.time() + timeout_s, task.cancel)
@@ -624,6 +781,19 @@ class Worker:
             self.jobs_complete += 1
             logger.info('%6.2fs ← %s ● %s', (finished_ms - start_ms) / 1000, ref, result_str)
 
+        if profiler is not None:
+            try:
+                await save_profile(self.pool, function_name, profiler)
+            except Exception:
+                logger.exception('saving profile of %s failed', ref)
+
+        if self.hooks.job_finished:
+            await self.hooks.emit(JobEvent(
+                'job_finished', job_id, self.queue_name, function=function_name, job_try=job_try, score=score,
+                enqueue_time_ms=enqueue_time_ms, claim_ms=claim_ms, start_ms=start_ms, finish_ms=finished_ms,
+                success=success,
+            ))
+
         async def complete_job():
             keep_result_forever = (
                 self.keep_result_forever if function.keep_result_forever is None else function.keep_result_forever
@@ -645,14 +815,24 @@ class Worker:
                     self.queue_name,
                     worker_name,
                     job_id,
+                    due_ms=int(score),
+                    claim_ms=claim_ms,
                     serializer=self.job_serializer,
+                    compression=self.compression,
                 )
 
             await asyncio.shield(
                 self.finish_complete_job(
-                    job_id, finish, result_data, result_timeout_s, keep_result_forever, incr_score, keep_in_progress
+                    job_id, finish, result_data, result_timeout_s, keep_result_forever, incr_score, keep_in_progress,
+                    blobs, finished_ms, function_name, success,
                 )
             )
+            if result_data and finish and self.hooks.result_written:
+                await self.hooks.emit(JobEvent(
+                    'result_written', job_id, self.queue_name, function=function_name, job_try=job_try, score=score,
+                    enqueue_time_ms=enqueue_time_ms, claim_ms=claim_ms, start_ms=start_ms, finish_ms=finished_ms,
+                    result_ms=timestamp_ms(), success=success,
+                ))
 
         await complete_job()
 
@@ -666,6 +846,10 @@ class Worker:
             keep_result_forever: bool,
             incr_score: Optional[int],
             keep_in_progress: Optional[float],
+            blobs: Tuple[str, ...] = (),
+            finish_ms: Optional[int] = None,
+            function_name: Optional[str] = None,
+            success: bool = True,
     ) -> None:
         async with self.pool.pipeline(transaction=True) as pipe:
             await pipe.unwatch()
@@ -681,9 +865,15 @@ class Worker:
                 if result_data:
                     expire = None if keep_result_forever else result_timeout_s
                     pipe.set(result_key_prefix + job_id, result_data, px=to_ms(expire))
+                    # 按完成时间索引结果,用于分页查询
+                    index_result(
+                        pipe, self.queue_name, job_id, finish_ms or timestamp_ms(), function_name, self.worker_name,
+                        success,
+                    )
                 delete_keys += [retry_key_prefix + job_id, job_key_prefix + job_id]
                 pipe.zrem(abort_jobs_ss, job_id)
                 pipe.zrem(self.queue_name, job_id)
+                release_blobs(pipe, blobs)
             elif incr_score:
                 pipe.zincrby(self.queue_name, incr_score, job_id)
 
@@ -692,7 +882,13 @@ class Worker:
             await pipe.execute()
 
     # 失败完成工作任务
-    async def finish_failed_job(self, job_id: str, result_data: Optional[bytes]) -> None:
+    async def finish_failed_job(
+            self,
+            job_id: str,
+            result_data: Optional[bytes],
+            blobs: Tuple[str, ...] = (),
+            function_name: Optional[str] = None,
+    ) -> None:
         async with self.pool.pipeline(transaction=True) as pipe:
             await pipe.unwatch()
             pipe.multi()
@@ -703,19 +899,71 @@ class Worker:
             )
             pipe.zrem(abort_jobs_ss, job_id)
             pipe.zrem(self.queue_name, job_id)
+            release_blobs(pipe, blobs)
             # result_data would only be None if serializing the result fails
             keep_result = self.keep_result_forever or self.keep_result_s > 0
             if result_data is not None and keep_result:  # pragma: no branch
                 expire = 0 if self.keep_result_forever else self.keep_result_s
                 pipe.set(result_key_prefix + job_id, result_data, px=to_ms(expire))
+                index_result(pipe, self.queue_name, job_id, timestamp_ms(), function_name, self.worker_name, False)
             await pipe.execute()
 
     # 定时健康检查
     async def heart_beat(self) -> None:
         now = datetime.now()
         await self.record_health()
+        await self.trim_results_index()
         cron_window_size = max(self.poll_delay_s, 0.5)  # Clamp the cron delay to 0.5
-        await self.run_cron(now, cron_window_size)
+        if await self._is_cron_leader(now):
+            await self.run_cron(now, cron_window_size)
+
+    async def trim_results_index(self) -> None:
+        """
+        从结果索引中删除结果已过期的作业id,按所有函数中最长的保留时长清理,有永久保留结果的函数时不清理
+        清理记录在队列筛选索引集合中的所有索引,包括重启前的 worker 名称和已移除函数的索引,同一队列的 worker 应使用相同的保留时长
+        读取索引时也会删除结果已不存在的作业id
+        """
+        now_ts = time()
+        if now_ts - self._last_results_trim < results_index_trim_interval:
+            return
+        self._last_results_trim = now_ts
+        if self.keep_result_forever:
+            return
+        keep_ms = [to_ms(self.keep_result_s)]
+        for function in self.functions.values():
+            if function.keep_result_forever:
+                return
+            if function.keep_result_s is not None:
+                keep_ms.append(to_ms(function.keep_result_s))
+        await trim_results_indexes(self.pool, self.queue_name, timestamp_ms() - max(keep_ms))
+
+    async def _is_cron_leader(self, n: datetime) -> bool:
+        """
+        未启用选主时总是返回 True,启用时只有持有租约的 worker 调度定时任务
+        """
+        if self.cron_lease is None or not self._cron_jobs:
+            return True
+        was_leader = self.cron_lease.held
+        if not await self.cron_lease.check(self.pool):
+            self._cron_followed = True
+            return False
+        if not was_leader and self._cron_followed:
+            self._skip_missed_cron_runs(n)
+        return True
+
+    def _skip_missed_cron_runs(self, n: datetime) -> None:
+        """
+        从节点接替为主节点:之前的运行已由原主节点入队,从现在开始计算下一次运行,也不再执行 run_at_startup
+        """
+        self._cron_heap = []
+        self._cron_entries.clear()
+        n_ms = to_unix_ms(n)
+        for name, cron_job in self._cron_jobs.items():
+            # 与入队时一样按 run_at 判断,加上抖动后尚未到期的运行原主节点还没有入队
+            if cron_job.next_run is None or to_unix_ms(cron_job.run_at) < n_ms:
+                cron_job.calculate_next(n)
+            if name not in self._cron_pending:
+                self._push_cron_job(cron_job)
 
     # 执行定时任务
     async def run_cron(self, n: datetime, delay: float, num_windows: int = 2) -> None:
@@ -723,31 +971,84 @@ class Worker:
 
         cron_delay = timedelta(seconds=delay * num_windows)
 
-        this_hb_cutoff = n + cron_delay
+        this_hb_cutoff = to_unix_ms(n + cron_delay)
+        last_runs: Dict[str, int] = {}
+
+        catch_up = [cj for cj in self._cron_pending.values() if cj.next_run is None and cj.catch_up != 'none']
+        if catch_up:
+            await self._catch_up_cron_jobs(catch_up, n)
 
-        for cron_job in self.cron_jobs:
+        # 新加入的定时任务, 计算首次运行时间后放入堆中
+        later: List[CronJob] = []
+        for cron_job in self._cron_pending.values():
             if cron_job.next_run is None:
                 if cron_job.run_at_startup:
                     cron_job.next_run = n
                 else:
                     cron_job.calculate_next(n)
                     # 在任何情况下,都不会运行此迭代。
+                    later.append(cron_job)
                     continue
-
-            # 如果下一次执行时间是在下一个时间段,我们将cron排队
-            # delay * num_windows (by default 0.5 * 2 = 1 second).
-            if cron_job.next_run < this_hb_cutoff:
-                job_id = f'{cron_job.name}:{to_unix_ms(cron_job.next_run)}' if cron_job.unique else None
-                job_futures.add(
-                    self.pool.enqueue_job(
-                        cron_job.name, **cron_job.kwargs, job_id=job_id, queue_name=self.queue_name,
-                        defer_until=cron_job.next_run
-                    )
+            self._push_cron_job(cron_job)
+        self._cron_pending.clear()
+
+        # 如果下一次执行时间是在下一个时间段,我们将cron排队
+        # delay * num_windows (by default 0.5 * 2 = 1 second).
+        while self._cron_heap and self._cron_heap[0][0] < this_hb_cutoff:
+            _, seq, cron_job = heapq.heappop(self._cron_heap)
+            if self._cron_entries.get(cron_job.name) != seq:
+                # 已移除或被替换
+                continue
+            job_id = f'{cron_job.name}:{to_unix_ms(cron_job.next_run)}' if cron_job.unique else None
+            job_futures.add(
+                self.pool.enqueue_job(
+                    cron_job.name, **cron_job.kwargs, job_id=job_id, queue_name=self.queue_name,
+                    defer_until=cron_job.run_at
                 )
-                cron_job.calculate_next(cron_job.next_run)
-
+            )
+            if cron_job.catch_up != 'none':
+                last_runs[cron_job.name] = to_unix_ms(cron_job.next_run)
+            cron_job.calculate_next(cron_job.next_run)
+            # 每次心跳每个定时任务最多入队一次
+            later.append(cron_job)
+
+        for cron_job in later:
+            self._push_cron_job(cron_job)
+
+        if last_runs:
+            # 记录最后一次运行时间,用于停机后补跑
+            job_futures.add(self.pool.hset(cron_last_run_key_prefix + self.queue_name, mapping=last_runs))
         job_futures and await asyncio.gather(*job_futures)
 
+    async def _catch_up_cron_jobs(self, cron_jobs: List[CronJob], n: datetime) -> None:
+        """
+        补跑所有 worker 停止期间错过的运行,每个定时任务的全部运行通过一次管道批量入队
+        """
+        last_run_key = cron_last_run_key_prefix + self.queue_name
+        last_runs = await self.pool.hmget(last_run_key, [cron_job.name for cron_job in cron_jobs])
+        batches = []
+        caught_up: Dict[str, int] = {}
+        for cron_job, last_run in zip(cron_jobs, last_runs):
+            if last_run is None:
+                continue
+            runs = cron_job.missed_runs(int(last_run), n)
+            if not runs:
+                continue
+            logger.info('cron:%s catching up %d missed runs', cron_job.name, len(runs))
+            batches.append(self.pool.enqueue_job_batch(
+                cron_job.name,
+                [
+                    (f'{cron_job.name}:{to_unix_ms(run)}' if cron_job.unique else None, run + cron_job.jitter_offset)
+                    for run in runs
+                ],
+                queue_name=self.queue_name,
+                **cron_job.kwargs,
+            ))
+            caught_up[cron_job.name] = to_unix_ms(runs[-1])
+        if batches:
+            await asyncio.gather(*batches)
+            await self.pool.hset(last_run_key, mapping=caught_up)
+
     # 健康检查详情
     async def record_health(self) -> None:
         now_ts = time()
@@ -765,7 +1066,13 @@ class Worker:
             "queued": queued
         }
         # print("健康检查:", info)
-        await self.pool.psetex(self.health_check_key, int((self.health_check_interval + 1) * 1000), json.dumps(info))
+        ttl_ms = int((self.health_check_interval + 1) * 1000)
+        async with self.pool.pipeline(transaction=False) as pipe:
+            pipe.psetex(self.health_check_key, ttl_ms, json.dumps(info))
+            # 哈希字段不能单独过期,与健康检查键相同的过期时间随值保存,读取时忽略已过期的健康检查
+            pipe.hset(workers_health_key, self.worker_name, dump_health(info, timestamp_ms() + ttl_ms))
+            pipe.zadd(workers_seen_key, {self.worker_name: timestamp_ms()})
+            await pipe.execute()
 
     def _add_signal_handler(self, signum: Signals, handler: Callable[[Signals], None]) -> None:
         try:
@@ -798,7 +1105,7 @@ class Worker:
         if not self._pool:
             return
 
-        # redis 键设置为 删除或者延迟  默认一周
+        # 标记为停止,不再活跃 worker_stale_after 秒后从注册表中清理
         w_ = JobWorker(
             is_action=False,
             queue_name=self.queue_name,
@@ -806,13 +1113,14 @@ class Worker:
             functions=[],
             enqueue_time=timestamp_ms()
         )
-        worker_ = dataclasses.asdict(w_)
-        await self.pool.psetex(f'{worker_key}:{self.worker_name}',
-                               int(worker_key_close_expire * 1000),
-                               json.dumps(worker_))
+        worker_ = w_.to_dict(datetimes=False)
+        await self._set_worker_registry(self.pool, json.dumps(worker_))
 
         await asyncio.gather(*self.tasks.values())
         await self.pool.delete(self.health_check_key)
+        if self.cron_lease is not None:
+            # 主动释放租约,其他 worker 无需等待租约过期
+            await self.cron_lease.release(self.pool)
 
         if self.on_shutdown:
             await self.on_shutdown(self.ctx)
@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for aiorq, see ``python -m benchmarks --help``.
+"""
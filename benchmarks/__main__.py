@@ -0,0 +1,100 @@
+"""
+Run the aiorq benchmark suite against a local redis-server.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json --threshold 0.2
+
+The selected redis database is flushed repeatedly, never point this at a database holding real data.
+"""
+import asyncio
+import json
+import platform
+import random
+import sys
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import click
+
+from aiorq.connections import RedisSettings, create_pool
+from aiorq.version import __version__
+
+from .cases import CASES, BenchContext
+from .compare import compare, format_changes
+
+
+async def run_cases(
+        dsn: str, cases: Tuple[str, ...], jobs: int, samples: int, repeat: int, poll_delay: float
+) -> Dict[str, Any]:
+    redis = await create_pool(RedisSettings.from_dsn(dsn))
+    try:
+        info = await redis.info(section='Server')
+        ctx = BenchContext(redis, jobs=jobs, samples=samples, repeat=repeat, poll_delay=poll_delay)
+        metrics: Dict[str, float] = {}
+        for name in cases or CASES:
+            click.echo(f'running {name}...', err=True)
+            metrics.update(await CASES[name](ctx))
+        await redis.flushdb()
+    finally:
+        await redis.close()
+
+    return {
+        'meta': {
+            'aiorq_version': __version__,
+            'python_version': platform.python_version(),
+            'redis_version': info.get('redis_version', '?'),
+            'time': datetime.now().isoformat(),
+            'jobs': jobs,
+            'samples': samples,
+            'repeat': repeat,
+            'poll_delay': poll_delay,
+        },
+        'metrics': metrics,
+    }
+
+
+@click.command()
+@click.option('--redis', 'dsn', default='redis://localhost:6379/15', show_default=True, help='Redis DSN, flushed!')
+@click.option('--case', 'cases', multiple=True, type=click.Choice(list(CASES)), help='Cases to run, default all.')
+@click.option('--jobs', default=2000, show_default=True, help='Jobs per throughput case.')
+@click.option('--samples', default=200, show_default=True, help='Samples per latency case.')
+@click.option('--repeat', default=3, show_default=True, help='Repeats per throughput case, best is kept.')
+@click.option('--poll-delay', default=0.05, show_default=True, help='Worker poll delay for latency cases.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results JSON to this file.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Results JSON to compare against.')
+@click.option('--threshold', default=0.2, show_default=True, help='Allowed regression as a fraction of baseline.')
+def main(
+        dsn: str,
+        cases: Tuple[str, ...],
+        jobs: int,
+        samples: int,
+        repeat: int,
+        poll_delay: float,
+        seed: int,
+        output: Optional[str],
+        baseline: Optional[str],
+        threshold: float,
+) -> None:
+    random.seed(seed)
+    results = asyncio.get_event_loop().run_until_complete(run_cases(dsn, cases, jobs, samples, repeat, poll_delay))
+    results_json = json.dumps(results, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(results_json + '\n')
+    else:
+        click.echo(results_json)
+
+    if baseline:
+        with open(baseline) as f:
+            baseline_metrics = json.load(f)['metrics']
+        changes = compare(baseline_metrics, results['metrics'], threshold)
+        click.echo(format_changes(changes), err=True)
+        regressions = [c.metric for c in changes if c.regressed]
+        if regressions:
+            click.echo(f'{len(regressions)} metrics regressed by more than {threshold:.0%}', err=True)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
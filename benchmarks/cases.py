@@ -0,0 +1,342 @@
+import asyncio
+import os
+import pickle
+import random
+import string
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiorq.connections import AioRedis
+from aiorq.cron import Schedule, next_cron
+from aiorq.exception import SerializationError
+from aiorq.constants import job_key_prefix
+from aiorq.serialize import (
+    Compression,
+    codecs_by_name,
+    deserialize_job_raw,
+    deserialize_result,
+    serialize_job,
+    serialize_result,
+)
+from aiorq.utils import percentile
+from aiorq.worker import Worker, func
+
+from . import stepwise_cron
+
+Metrics = Dict[str, float]
+# the benchmarks decode payloads they wrote themselves with every codec
+accept_all = frozenset(codecs_by_name)
+
+
+@dataclass
+class BenchContext:
+    redis: AioRedis
+    #: number of jobs used by each throughput case
+    jobs: int
+    #: number of samples used by each latency case
+    samples: int
+    #: number of times each throughput case is repeated, the best run is kept
+    repeat: int
+    #: poll delay of the workers used for latency cases
+    poll_delay: float
+    queue_name: str = 'aiorq:bench'
+
+
+async def noop(ctx: Dict[Any, Any], *args: Any) -> None:
+    pass
+
+
+def make_worker(ctx: BenchContext, **kwargs: Any) -> Worker:
+    kwargs.setdefault('poll_delay', 0)
+    kwargs.setdefault('redis_pool', ctx.redis)
+    return Worker(
+        functions=[func(noop, name='noop', keep_result=3600)],
+        queue_name=ctx.queue_name,
+        handle_signals=False,
+        **kwargs,
+    )
+
+
+async def best_of(ctx: BenchContext, run: Callable[[], Awaitable[float]]) -> float:
+    """
+    Run a throughput case ``ctx.repeat`` times on a clean database and keep the highest rate.
+    """
+    rates = []
+    for _ in range(ctx.repeat):
+        await ctx.redis.flushdb()
+        rates.append(await run())
+    return max(rates)
+
+
+def time_per_op_us(f: Callable[[], Any], number: int) -> float:
+    start = perf_counter()
+    for _ in range(number):
+        f()
+    return (perf_counter() - start) / number * 1e6
+
+
+async def bench_serializers(ctx: BenchContext) -> Metrics:
+    metrics: Metrics = {}
+    payloads = {'small': ({'a': 1, 'b': 'x' * 20},), 'large': ({'data': ['x' * 100 for _ in range(100)]},)}
+    number = max(ctx.jobs, 1000)
+    serializers: Dict[str, Optional[str]] = {'default': None, **{name: name for name in codecs_by_name}}
+    for codec, serializer in serializers.items():
+        for size, args in payloads.items():
+            try:
+                job = serialize_job('noop', args, {}, 1, 0, ctx.queue_name, serializer=serializer)
+            except SerializationError:
+                # optional codec dependency not installed
+                continue
+            result = serialize_result(
+                'noop', args, {}, 1, 0, True, args[0], 0, 0, 'ref', ctx.queue_name, 'bench', 'id', serializer=serializer
+            )
+            prefix = f'serializer.{codec}.{size}'
+            metrics[f'{prefix}.serialize_job_us'] = time_per_op_us(
+                lambda: serialize_job('noop', args, {}, 1, 0, ctx.queue_name, serializer=serializer), number
+            )
+            metrics[f'{prefix}.deserialize_job_us'] = time_per_op_us(
+                lambda: deserialize_job_raw(job, accept=accept_all), number
+            )
+            metrics[f'{prefix}.serialize_result_us'] = time_per_op_us(
+                lambda: serialize_result(
+                    'noop', args, {}, 1, 0, True, args[0], 0, 0, 'ref', ctx.queue_name, 'bench', 'id',
+                    serializer=serializer,
+                ),
+                number,
+            )
+            metrics[f'{prefix}.deserialize_result_us'] = time_per_op_us(
+                lambda: deserialize_result(result, accept=accept_all), number
+            )
+            metrics[f'{prefix}.job_bytes'] = len(job)
+    return metrics
+
+
+async def bench_compression(ctx: BenchContext) -> Metrics:
+    """
+    Size in redis, cpu cost and enqueue throughput of jobs carrying ~200KB of json args with each compression
+    method, the per queue override of the pool is used to switch method.
+    """
+    rows = [
+        {
+            'id': i,
+            'name': ''.join(random.choices(string.ascii_lowercase, k=12)),
+            'tags': random.sample(['red', 'green', 'blue', 'cyan', 'magenta', 'yellow'], 3),
+            'score': round(random.random(), 6),
+        }
+        for i in range(2500)
+    ]
+    args = (rows,)
+    number = max(ctx.jobs // 20, 20)
+    jobs = max(ctx.jobs // 10, 20)
+    metrics: Metrics = {}
+    methods: Dict[str, Optional[Compression]] = {'none': None, 'zlib': Compression('zlib'), 'lzma': Compression('lzma')}
+    for method, compression in methods.items():
+        job = serialize_job('noop', args, {}, 1, 0, ctx.queue_name, compression=compression)
+        prefix = f'compression.{method}'
+        metrics[f'{prefix}.job_bytes'] = len(job)
+        metrics[f'{prefix}.serialize_job_us'] = time_per_op_us(
+            lambda: serialize_job('noop', args, {}, 1, 0, ctx.queue_name, compression=compression), number
+        )
+        metrics[f'{prefix}.deserialize_job_us'] = time_per_op_us(lambda: deserialize_job_raw(job), number)
+
+        async def enqueue() -> float:
+            start = perf_counter()
+            for i in range(jobs):
+                await ctx.redis.enqueue_job('noop', *args, job_id=f'c{i}', queue_name=ctx.queue_name)
+            return jobs / (perf_counter() - start)
+
+        ctx.redis.queue_compression[ctx.queue_name] = compression
+        try:
+            metrics[f'{prefix}.enqueue.jobs_per_s'] = await best_of(ctx, enqueue)
+            metrics[f'{prefix}.redis_bytes_per_job'] = await ctx.redis.memory_usage(job_key_prefix + 'c0')
+        finally:
+            del ctx.redis.queue_compression[ctx.queue_name]
+    return metrics
+
+
+async def bench_listing(ctx: BenchContext) -> Metrics:
+    """
+    Listing job results with and without decoding their bodies, each result carries ~2KB of args, and reading the
+    latest page of them. Uses the named 'json' codec, the default untagged json has no header to read on its own.
+    """
+    await ctx.redis.flushdb()
+    redis = AioRedis(ctx.redis.connection_pool, job_serializer='json')
+    payload = ''.join(random.choices(string.ascii_letters, k=2000))
+    for _ in range(ctx.jobs):
+        await redis.enqueue_job('noop', payload, queue_name=ctx.queue_name)
+    await make_worker(ctx, redis_pool=redis, job_serializer='json', burst=True, max_jobs=50).main()
+
+    metrics: Metrics = {}
+    for name, with_body in (('body', True), ('header', False)):
+        rates = []
+        for _ in range(ctx.repeat):
+            start = perf_counter()
+            results = await redis.all_job_results(with_body=with_body)
+            rates.append(len(results) / (perf_counter() - start))
+        metrics[f'listing.results.{name}.jobs_per_s'] = max(rates)
+
+    # the latest page from the finish time index, independent of the number of results
+    latencies = []
+    for _ in range(ctx.samples):
+        start = perf_counter()
+        await redis.job_results_page(ctx.queue_name, limit=50, with_body=False)
+        latencies.append((perf_counter() - start) * 1000)
+    metrics['listing.results.page.p50_ms'] = percentile(latencies, 50)
+    return metrics
+
+
+async def bench_binary(ctx: BenchContext) -> Metrics:
+    """
+    Round trip of a job carrying a 1MB bytes argument, pickled whole by a plain function serializer or written as a
+    raw envelope segment by a named codec.
+    """
+    args = (os.urandom(1024 * 1024),)
+    number = max(ctx.jobs // 10, 50)
+    metrics: Metrics = {}
+    serializers: Dict[str, Any] = {'pickle_function': pickle.dumps, 'pickle': 'pickle', 'json': 'json'}
+    for name, serializer in serializers.items():
+        deserializer = pickle.loads if callable(serializer) else None
+        job = serialize_job('noop', args, {}, 1, 0, ctx.queue_name, serializer=serializer)
+        prefix = f'binary.{name}'
+        metrics[f'{prefix}.serialize_job_us'] = time_per_op_us(
+            lambda: serialize_job('noop', args, {}, 1, 0, ctx.queue_name, serializer=serializer), number
+        )
+        metrics[f'{prefix}.deserialize_job_us'] = time_per_op_us(
+            lambda: deserialize_job_raw(job, deserializer=deserializer, accept=accept_all), number
+        )
+    return metrics
+
+
+async def bench_cron(ctx: BenchContext) -> Metrics:
+    """
+    ``next_cron`` on dense and sparse schedules, against the step by step search of earlier versions,
+    ``precomputed`` is the path of cron jobs whose :class:`aiorq.cron.Schedule` is built once.
+    """
+    schedules: Dict[str, Dict[str, Any]] = {
+        'every_second': dict(second=None),
+        'every_minute': dict(),
+        'hourly': dict(minute=30),
+        'daily': dict(hour=3, minute=0),
+        'friday_13th': dict(day=13, weekday='fri', hour=0, minute=0),
+        'feb_29th': dict(month=2, day=29, hour=3, minute=0),
+    }
+    start = datetime(2021, 3, 1)
+    previous = [start + timedelta(seconds=random.random() * 86400 * 365) for _ in range(100)]
+    metrics: Metrics = {}
+    for name, kwargs in schedules.items():
+        impls: Dict[str, Callable[..., datetime]] = {
+            'precomputed': lambda dt, schedule=Schedule.from_options(**kwargs), **_: schedule.next_after(dt),
+            'closed_form': next_cron,
+            'stepwise': stepwise_cron.next_cron,
+        }
+        for impl, f in impls.items():
+            number = max(ctx.jobs // 100, 1)
+            start_time = perf_counter()
+            for _ in range(number):
+                for dt in previous:
+                    f(dt, **kwargs)
+            metrics[f'cron.{name}.{impl}_us'] = (perf_counter() - start_time) / (number * len(previous)) * 1e6
+    return metrics
+
+
+async def bench_enqueue(ctx: BenchContext) -> Metrics:
+    async def sequential() -> float:
+        start = perf_counter()
+        for i in range(ctx.jobs):
+            await ctx.redis.enqueue_job('noop', i, queue_name=ctx.queue_name)
+        return ctx.jobs / (perf_counter() - start)
+
+    async def concurrent(concurrency: int = 50) -> float:
+        ids = iter(range(ctx.jobs))
+
+        async def producer() -> None:
+            for i in ids:
+                await ctx.redis.enqueue_job('noop', i, queue_name=ctx.queue_name)
+
+        start = perf_counter()
+        await asyncio.gather(*[producer() for _ in range(concurrency)])
+        return ctx.jobs / (perf_counter() - start)
+
+    return {
+        'enqueue.sequential.jobs_per_s': await best_of(ctx, sequential),
+        'enqueue.concurrent.jobs_per_s': await best_of(ctx, concurrent),
+    }
+
+
+async def bench_worker(ctx: BenchContext) -> Metrics:
+    metrics: Metrics = {}
+    for max_jobs in (1, 10, 50):
+
+        async def run() -> float:
+            for i in range(ctx.jobs):
+                await ctx.redis.enqueue_job('noop', i, queue_name=ctx.queue_name)
+            worker = make_worker(ctx, burst=True, max_jobs=max_jobs)
+            start = perf_counter()
+            await worker.main()
+            assert worker.jobs_complete == ctx.jobs, f'{worker.jobs_complete} of {ctx.jobs} jobs completed'
+            return ctx.jobs / (perf_counter() - start)
+
+        metrics[f'worker.max_jobs_{max_jobs}.jobs_per_s'] = await best_of(ctx, run)
+    return metrics
+
+
+async def bench_latency(ctx: BenchContext) -> Metrics:
+    """
+    Pickup latency (due time to job start) and ``Job.result`` latency with a worker polling in the background.
+    """
+    await ctx.redis.flushdb()
+    loop = asyncio.get_event_loop()
+    started: Dict[str, float] = {}
+
+    async def record(ctx_: Dict[Any, Any]) -> None:
+        started[ctx_['job_id']] = loop.time()
+
+    worker = Worker(
+        functions=[func(record, name='record')],
+        redis_pool=ctx.redis,
+        queue_name=ctx.queue_name,
+        handle_signals=False,
+        poll_delay=ctx.poll_delay,
+    )
+    worker_task = loop.create_task(worker.main())
+    pickup, e2e, ready = [], [], []
+    try:
+        for _ in range(ctx.samples):
+            # spread enqueues over the poll interval so latency isn't synchronised with polling
+            await asyncio.sleep(random.random() * ctx.poll_delay)
+            enqueued = loop.time()
+            job = await ctx.redis.enqueue_job('record', queue_name=ctx.queue_name)
+            await job.result(poll_delay=0.001)
+            done = loop.time()
+            pickup.append((started[job.job_id] - enqueued) * 1000)
+            e2e.append((done - enqueued) * 1000)
+
+            start = perf_counter()
+            await job.result(poll_delay=0)
+            ready.append((perf_counter() - start) * 1000)
+    finally:
+        worker_task.cancel()
+        await asyncio.gather(worker_task, return_exceptions=True)
+
+    return {
+        'pickup.p50_ms': percentile(pickup, 50),
+        'pickup.p99_ms': percentile(pickup, 99),
+        'result.e2e_p50_ms': percentile(e2e, 50),
+        'result.e2e_p99_ms': percentile(e2e, 99),
+        'result.ready_p50_ms': percentile(ready, 50),
+        'result.ready_p99_ms': percentile(ready, 99),
+    }
+
+
+CASES: Dict[str, Callable[[BenchContext], Awaitable[Metrics]]] = {
+    'serializers': bench_serializers,
+    'compression': bench_compression,
+    'listing': bench_listing,
+    'binary': bench_binary,
+    'cron': bench_cron,
+    'enqueue': bench_enqueue,
+    'worker': bench_worker,
+    'latency': bench_latency,
+}
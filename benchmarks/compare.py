@@ -0,0 +1,41 @@
+from typing import Dict, List, NamedTuple
+
+
+class Change(NamedTuple):
+    metric: str
+    baseline: float
+    current: float
+    #: relative change, positive means better
+    improvement: float
+    regressed: bool
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith('_per_s')
+
+
+def compare(baseline: Dict[str, float], current: Dict[str, float], threshold: float) -> List[Change]:
+    """
+    Compare the metrics present in both runs, a metric regresses when it gets worse by more than ``threshold``,
+    a fraction of the baseline value.
+    """
+    changes = []
+    for metric in sorted(baseline.keys() & current.keys()):
+        base, cur = baseline[metric], current[metric]
+        if base == 0:
+            improvement = 0.0
+        elif higher_is_better(metric):
+            improvement = (cur - base) / base
+        else:
+            improvement = (base - cur) / base
+        changes.append(Change(metric, base, cur, improvement, improvement < -threshold))
+    return changes
+
+
+def format_changes(changes: List[Change]) -> str:
+    width = max((len(c.metric) for c in changes), default=6)
+    lines = [f'{"metric":<{width}} {"baseline":>12} {"current":>12} {"change":>8}']
+    for c in changes:
+        flag = '  REGRESSION' if c.regressed else ''
+        lines.append(f'{c.metric:<{width}} {c.baseline:>12.2f} {c.current:>12.2f} {c.improvement:>+8.1%}{flag}')
+    return '\n'.join(lines)
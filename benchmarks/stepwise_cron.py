@@ -0,0 +1,89 @@
+"""
+The step by step ``next_cron`` of aiorq 1.1.9 and earlier, kept as a baseline for the cron benchmark case.
+"""
+import dataclasses
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiorq.typing_ import WEEKDAYS, OptionType, WeekdayOptionType
+
+
+@dataclass
+class Options:
+    month: OptionType
+    day: OptionType
+    weekday: WeekdayOptionType
+    hour: OptionType
+    minute: OptionType
+    second: OptionType
+    microsecond: int
+
+
+def next_cron(
+    previous_dt: datetime,
+    *,
+    month: OptionType = None,
+    day: OptionType = None,
+    weekday: WeekdayOptionType = None,
+    hour: OptionType = None,
+    minute: OptionType = None,
+    second: OptionType = 0,
+    microsecond: int = 123_456
+) -> datetime:
+    """
+    Find the next datetime matching the given parameters.
+    """
+    dt = previous_dt + timedelta(seconds=1)
+    if isinstance(weekday, str):
+        weekday = WEEKDAYS.index(weekday.lower())
+    options = Options(
+        month=month,
+        day=day,
+        weekday=weekday,
+        hour=hour,
+        minute=minute,
+        second=second,
+        microsecond=microsecond
+    )
+
+    while True:
+        next_dt = _get_next_dt(dt, options)
+        if next_dt is None:
+            return dt
+        dt = next_dt
+
+
+def _get_next_dt(dt_: datetime, options: Options) -> Optional[datetime]:  # noqa: C901
+    for field, v in dataclasses.asdict(options).items():
+        if v is None:
+            continue
+        next_v = dt_.weekday() if field == 'weekday' else getattr(dt_, field)
+        if isinstance(v, int):
+            mismatch = next_v != v
+        else:
+            assert isinstance(v, (set, list, tuple)), v
+            mismatch = next_v not in v
+        if mismatch:
+            micro = max(dt_.microsecond - options.microsecond, 0)
+            if field == 'month':
+                if dt_.month == 12:
+                    return datetime(dt_.year + 1, 1, 1)
+                else:
+                    return datetime(dt_.year, dt_.month + 1, 1)
+            elif field in ('day', 'weekday'):
+                return (
+                    dt_
+                    + timedelta(days=1)
+                    - timedelta(hours=dt_.hour, minutes=dt_.minute, seconds=dt_.second, microseconds=micro)
+                )
+            elif field == 'hour':
+                return dt_ + timedelta(hours=1) - timedelta(minutes=dt_.minute, seconds=dt_.second, microseconds=micro)
+            elif field == 'minute':
+                return dt_ + timedelta(minutes=1) - timedelta(seconds=dt_.second, microseconds=micro)
+            elif field == 'second':
+                return dt_ + timedelta(seconds=1) - timedelta(microseconds=micro)
+            else:
+                assert field == 'microsecond', field
+                return dt_ + timedelta(microseconds=options.microsecond - dt_.microsecond)
+    return None
@@ -43,7 +43,7 @@ setup(
     author_email='341796767@qq.com',
     url='https://github.com/PY-GZKY/aiorq',
     license='MIT',
-    packages=find_packages(),
+    packages=find_packages(exclude=('benchmarks', 'benchmarks.*')),
     zip_safe=True,
     entry_points="""
         [console_scripts]
@@ -0,0 +1,182 @@
+import asyncio
+import json
+
+import pytest
+
+import aiorq.app_server.cache
+from aiorq.app_server.cache import ResponseCache
+from aiorq.app_server.stream import StatsStream, diff, encode_event
+
+
+class Fetch:
+    def __init__(self, result='r', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return f'{self.result}{self.calls}'
+
+
+@pytest.fixture(name='clock')
+def fix_clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(aiorq.app_server.cache, 'monotonic', lambda: now[0])
+    return now
+
+
+async def test_cache_coalesces_concurrent_requests():
+    cache = ResponseCache()
+    fetch = Fetch()
+    fetch.release.clear()
+    waiters = [asyncio.ensure_future(cache.get('jobs', 'k', 10, fetch)) for _ in range(3)]
+    await asyncio.sleep(0)
+    fetch.release.set()
+    assert await asyncio.gather(*waiters) == ['r1', 'r1', 'r1']
+    assert fetch.calls == 1
+    assert await cache.get('jobs', 'k', 10, fetch) == 'r1'
+    assert cache.stats() == {
+        'size': 1,
+        'max_size': 256,
+        'endpoints': {'jobs': {'hits': 1, 'coalesced': 2, 'misses': 1, 'hit_rate': 0.75}},
+    }
+
+
+async def test_cache_ttl(clock):
+    cache = ResponseCache()
+    fetch = Fetch()
+    assert await cache.get('jobs', 'k', 10, fetch) == 'r1'
+    clock[0] += 9
+    assert await cache.get('jobs', 'k', 10, fetch) == 'r1'
+    clock[0] += 1
+    assert await cache.get('jobs', 'k', 10, fetch) == 'r2'
+    # no ttl, neither cached nor coalesced
+    assert await cache.get('jobs', 'k', 0, fetch) == 'r3'
+    assert await cache.get('jobs', 'k', 0, fetch) == 'r4'
+
+
+async def test_cache_lru_eviction():
+    cache = ResponseCache(max_size=2)
+    fetch = Fetch()
+    assert await cache.get('jobs', 'a', 10, fetch) == 'r1'
+    assert await cache.get('jobs', 'b', 10, fetch) == 'r2'
+    # 'a' is now the most recently used, adding 'c' evicts 'b'
+    assert await cache.get('jobs', 'a', 10, fetch) == 'r1'
+    assert await cache.get('jobs', 'c', 10, fetch) == 'r3'
+    assert cache.stats()['size'] == 2
+    assert await cache.get('jobs', 'a', 10, fetch) == 'r1'
+    assert await cache.get('jobs', 'b', 10, fetch) == 'r4'
+    # keys are per endpoint
+    assert await cache.get('results', 'a', 10, fetch) == 'r5'
+
+
+async def test_cache_failure_not_cached():
+    cache = ResponseCache()
+    fetch = Fetch(error=ValueError('redis down'))
+    fetch.release.clear()
+    waiters = [asyncio.ensure_future(cache.get('jobs', 'k', 10, fetch)) for _ in range(2)]
+    await asyncio.sleep(0)
+    fetch.release.set()
+    for r in await asyncio.gather(*waiters, return_exceptions=True):
+        assert isinstance(r, ValueError)
+    assert fetch.calls == 1
+    assert cache.stats()['size'] == 0
+
+    fetch.error = None
+    assert await cache.get('jobs', 'k', 10, fetch) == 'r2'
+
+
+async def test_cache_cancelled_waiter():
+    cache = ResponseCache()
+    fetch = Fetch()
+    fetch.release.clear()
+    first = asyncio.ensure_future(cache.get('jobs', 'k', 10, fetch))
+    second = asyncio.ensure_future(cache.get('jobs', 'k', 10, fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    assert first.cancelled()
+
+    fetch.release.set()
+    assert await second == 'r1'
+    assert fetch.calls == 1
+    # the fetch finished and was cached even though the request which started it was cancelled
+    assert await cache.get('jobs', 'k', 10, fetch) == 'r1'
+
+
+def test_stream_diff():
+    old = {'workers': {'w1': {'queued': 1}, 'w2': {'queued': 2}}, 'queues': {'q': 3}}
+    new = {'workers': {'w1': {'queued': 1}, 'w2': {'queued': 5}, 'w3': {'queued': 0}}, 'queues': {}}
+    assert diff(old, new) == {'workers': {'w2': {'queued': 5}, 'w3': {'queued': 0}}, 'queues': {'q': None}}
+    assert diff(new, new) == {}
+    assert diff({}, {'queues': {'q': 1}}) == {'queues': {'q': 1}}
+
+
+def test_encode_event():
+    assert encode_event('delta', {'queues': {'q': None}}) == 'event: delta\ndata: {"queues":{"q":null}}\n\n'
+
+
+class ScriptedStream(StatsStream):
+    def __init__(self, snapshots, **kwargs):
+        super().__init__(interval=0, **kwargs)
+        self.snapshots = iter(snapshots)
+        self.samples = 0
+
+    async def sample(self, redis):
+        self.samples += 1
+        return next(self.snapshots, self.snapshot)
+
+
+def event(message):
+    name, data = message.split('\n')[:2]
+    return name[len('event: '):], json.loads(data[len('data: '):])
+
+
+async def test_stream_snapshot_then_deltas():
+    stream = ScriptedStream([{'queues': {'q': 1}}, {'queues': {'q': 2}}, {'queues': {}}])
+    events = stream.subscribe(None)
+    assert event(await events.__anext__()) == ('snapshot', {'queues': {'q': 1}})
+    assert event(await events.__anext__()) == ('delta', {'queues': {'q': 2}})
+    assert event(await events.__anext__()) == ('delta', {'queues': {'q': None}})
+
+    # a later subscriber starts with the current snapshot
+    late = stream.subscribe(None)
+    assert event(await late.__anext__()) == ('snapshot', {'queues': {}})
+    await events.aclose()
+    await late.aclose()
+    await stream.close()
+
+
+async def test_stream_slow_subscriber():
+    stream = StatsStream(max_pending=2)
+    slow: 'asyncio.Queue[str]' = asyncio.Queue(stream.max_pending)
+    stream.subscribers.add(slow)
+    stream.snapshot = {'queues': {'q': 1}}
+    stream._publish(encode_event('delta', {'queues': {'q': 1}}))
+    stream.snapshot = {'queues': {'q': 2}}
+    stream._publish(encode_event('delta', {'queues': {'q': 2}}))
+    stream.snapshot = {'queues': {'q': 3}}
+    stream._publish(encode_event('delta', {'queues': {'q': 3}}))
+    # the backlog was dropped and replaced by the full current snapshot
+    assert slow.qsize() == 1
+    assert event(slow.get_nowait()) == ('snapshot', {'queues': {'q': 3}})
+
+
+async def test_stream_stops_without_subscribers():
+    stream = ScriptedStream([{'queues': {'q': 1}}])
+    events = stream.subscribe(None)
+    assert event(await events.__anext__()) == ('snapshot', {'queues': {'q': 1}})
+    task = stream._task
+    await events.aclose()
+    assert not stream.subscribers
+    await asyncio.wait_for(task, 1)
+    samples = stream.samples
+    await asyncio.sleep(0.01)
+    assert stream.samples == samples
+    assert stream.snapshot is None
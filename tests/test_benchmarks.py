@@ -0,0 +1,12 @@
+import pytest
+
+from aiorq.connections import AioRedis
+from benchmarks.cases import CASES, BenchContext
+
+
+@pytest.mark.parametrize('case', list(CASES))
+async def test_bench_case(aio_redis: AioRedis, case):
+    ctx = BenchContext(aio_redis, jobs=20, samples=3, repeat=1, poll_delay=0.01)
+    metrics = await CASES[case](ctx)
+    assert metrics
+    assert all(isinstance(v, (int, float)) for v in metrics.values())
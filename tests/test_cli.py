@@ -1,5 +1,7 @@
+import pytest
 from click.testing import CliRunner
 
+from aiorq.bench import parse_defer, parse_kwargs, parse_mix
 from aiorq.cli import cli
 
 
@@ -43,3 +45,33 @@ def test_run_watch(mocker):
     result = runner.invoke(cli, ['tests.test_cli.WorkerSettings', '--watch', 'tests'])
     assert result.exit_code == 0
     assert '1 files changes, reloading aiorq worker...'
+
+
+def test_bench_invalid_defer():
+    runner = CliRunner()
+    result = runner.invoke(cli, ['tests.test_cli.WorkerSettings', 'bench', '--defer', 'normal:1'])
+    assert result.exit_code == 2
+    assert 'invalid defer distribution' in result.output
+
+
+def test_bench_invalid_mix():
+    runner = CliRunner()
+    result = runner.invoke(cli, ['tests.test_cli.WorkerSettings', 'bench', '--mix', 'foobar=x'])
+    assert result.exit_code == 2
+    assert "invalid mix 'foobar=x'" in result.output
+    result = runner.invoke(cli, ['tests.test_cli.WorkerSettings', 'bench', '--kwargs', 'foobar=[1]'])
+    assert result.exit_code == 2
+    assert "invalid kwargs 'foobar=[1]'" in result.output
+
+
+def test_bench_parse_options():
+    assert parse_mix(('foobar=3', 'spam')) == {'foobar': 3, 'spam': 1}
+    assert parse_kwargs(('foobar={"a": 1}',)) == {'foobar': {'a': 1}}
+    assert parse_defer('none')() == 0
+    assert 1 <= parse_defer('uniform:1:2')() <= 2
+    for mix in ('foobar=x', 'foobar=-1', 'foobar=inf', '=2'):
+        with pytest.raises(ValueError, match='invalid mix'):
+            parse_mix((mix,))
+    for kwargs in ('foobar={', 'foobar=1', 'foobar'):
+        with pytest.raises(ValueError, match='invalid kwargs'):
+            parse_kwargs((kwargs,))
@@ -1,13 +1,23 @@
+import asyncio
 import logging
 import re
+from collections import Counter
 from datetime import datetime, timedelta
 from random import random
 
 import pytest
 
 from aiorq import Worker
-from aiorq.constants import in_progress_key_prefix
-from aiorq.cron import cron, next_cron
+from aiorq.connections import AioRedis
+from aiorq.constants import (
+    blob_refs_key_prefix,
+    cron_last_run_key_prefix,
+    cron_leader_key_prefix,
+    in_progress_key_prefix,
+    result_key_prefix,
+)
+from aiorq.cron import Schedule, cron, next_cron
+from aiorq.utils import to_unix_ms
 
 
 @pytest.mark.parametrize(
@@ -40,6 +50,17 @@ from aiorq.cron import cron, next_cron
         (datetime(2001, 1, 1, 0, 0, 0), datetime(2001, 1, 7, 0, 0, 0, microsecond=123_456), dict(weekday=6)),  # Sunday
         (datetime(2001, 1, 1, 0, 0, 0), datetime(2001, 11, 7, 0, 0, 0, microsecond=123_456), dict(month=11, weekday=2)),
         (datetime(2001, 1, 1, 0, 0, 0), datetime(2001, 1, 3, 0, 0, 0, microsecond=123_456), dict(weekday='wed')),
+        (
+            datetime(2021, 3, 1, 0, 0, 0),
+            datetime(2024, 2, 29, 3, 0, 0, microsecond=123_456),
+            dict(month=2, day=29, hour=3, minute=0),
+        ),
+        (
+            datetime(2021, 3, 1, 0, 0, 0),
+            datetime(2036, 2, 29, 23, 59, 59, microsecond=123_456),
+            dict(month=2, day=29, weekday='fri', hour=23, minute=59, second=59),
+        ),
+        (datetime(2016, 12, 31, 23, 59, 59), datetime(2017, 1, 1, 0, 0, 0), dict(second=None, microsecond=0)),
     ],
 )
 def test_next_cron(previous, expected, kwargs):
@@ -49,9 +70,12 @@ def test_next_cron(previous, expected, kwargs):
     print(f'{diff.total_seconds() * 1000:0.3f}ms')
 
 
-def test_next_cron_invalid():
+@pytest.mark.parametrize(
+    'kwargs', [dict(weekday='monday'), dict(hour=24), dict(minute={1, 60}), dict(month=2, day=30), dict(second=set())]
+)
+def test_next_cron_invalid(kwargs):
     with pytest.raises(ValueError):
-        next_cron(datetime(2001, 1, 1, 0, 0, 0), weekday='monday')
+        next_cron(datetime(2001, 1, 1, 0, 0, 0), **kwargs)
 
 
 @pytest.mark.parametrize(
@@ -86,6 +110,51 @@ def test_next_cron_random(max_previous, kwargs, expected):
             assert v == expected
 
 
+@pytest.mark.parametrize(
+    'expression,previous,expected',
+    [
+        ('*/15 9-17 * * mon-fri', datetime(2032, 1, 2, 17, 50), datetime(2032, 1, 5, 9, 0)),
+        ('0 0 13 * fri', datetime(2032, 1, 2, 12, 0), datetime(2032, 1, 9, 0, 0)),
+        ('0 0 13 * fri', datetime(2032, 1, 9, 12, 0), datetime(2032, 1, 13, 0, 0)),
+        ('30 4 1,15 jan,jul *', datetime(2032, 1, 16), datetime(2032, 7, 1, 4, 30)),
+        ('@weekly', datetime(2032, 1, 1), datetime(2032, 1, 4)),
+        ('0 12 * * 7', datetime(2032, 1, 1), datetime(2032, 1, 4, 12, 0)),
+        ('5/20 * * * *', datetime(2032, 1, 1, 0, 30), datetime(2032, 1, 1, 0, 45)),
+        ('*/10 * * * * *', datetime(2032, 1, 1, 0, 0, 5), datetime(2032, 1, 1, 0, 0, 10)),
+        ('0 0 31 2 mon', datetime(2032, 1, 1), datetime(2032, 2, 2)),
+        ('0 0 */2 * mon', datetime(2032, 1, 1), datetime(2032, 1, 5)),
+    ],
+)
+def test_crontab(expression, previous, expected):
+    assert Schedule.from_crontab(expression, microsecond=0).next_after(previous) == expected
+
+
+@pytest.mark.parametrize(
+    'expression', ['* * * *', '60 * * * *', '* * * foo *', '*/0 * * * *', '5-1 * * * *', '* * * * 8']
+)
+def test_crontab_invalid(expression):
+    with pytest.raises(ValueError):
+        Schedule.from_crontab(expression)
+
+
+@pytest.mark.parametrize(
+    'expression,previous,expected',
+    [
+        # clocks go forward at 02:00 on 2032-03-28, 02:30 doesn't exist that day
+        ('30 2 * * *', '2032-03-27T12:00:00+01:00', '2032-03-28T03:30:00+02:00'),
+        ('30 2 * * *', '2032-03-28T03:30:00+02:00', '2032-03-29T02:30:00+02:00'),
+        # clocks go back at 03:00 on 2032-10-31, 02:30 happens twice
+        ('30 2 * * *', '2032-10-31T00:00:00+02:00', '2032-10-31T02:30:00+02:00'),
+        ('30 2 * * *', '2032-10-31T02:30:00+02:00', '2032-11-01T02:30:00+01:00'),
+        ('30 * * * *', '2032-10-31T02:30:00+02:00', '2032-10-31T03:30:00+01:00'),
+        ('0 9 * * *', '2032-10-31T07:00:00+00:00', '2032-10-31T09:00:00+01:00'),
+    ],
+)
+def test_crontab_tz(expression, previous, expected):
+    schedule = Schedule.from_crontab(expression, microsecond=0, tz='Europe/Berlin')
+    assert schedule.next_after(datetime.fromisoformat(previous)).isoformat() == expected
+
+
 async def foobar(ctx):
     return 42
 
@@ -142,3 +211,194 @@ async def test_repr():
 async def test_str_function():
     cj = cron('asyncio.sleep', hour=1, run_at_startup=True)
     assert str(cj).startswith('<CronJob name=cron:asyncio.sleep coroutine=<function sleep at')
+
+
+async def test_add_remove_cron_job(worker, aio_redis):
+    worker: Worker = worker(cron_jobs=[cron(foobar, name='a', kwargs={}, second=None, run_at_startup=True)])
+    n = datetime.now()
+    await worker.run_cron(n, 0.5)
+    worker.add_cron_job(cron(foobar, name='b', kwargs={}, second=None, run_at_startup=True))
+    await worker.run_cron(n + timedelta(seconds=1), 0.5)
+    assert worker.remove_cron_job('a').name == 'a'
+    assert worker.remove_cron_job('a') is None
+    await worker.run_cron(n + timedelta(seconds=2), 0.5)
+    assert [cj.name for cj in worker.cron_jobs] == ['b']
+
+    jobs = await aio_redis.queued_jobs()
+    assert Counter(j.function for j in jobs) == {'a': 2, 'b': 2}
+
+
+async def test_cron_leader(worker, aio_redis):
+    def cron_jobs():
+        return [cron(foobar, name='a', kwargs={}, second=None, microsecond=0)]
+
+    # the fixture closes w1, w2 is closed below
+    w1: Worker = worker(cron_jobs=cron_jobs(), worker_name='w1', cron_leader_lease=0.3)
+    w2 = Worker(
+        functions=[], redis_pool=aio_redis, burst=True, poll_delay=0, cron_jobs=cron_jobs(), worker_name='w2',
+        cron_leader_lease=0.3,
+    )
+    await w1.heart_beat()
+    await w2.heart_beat()
+    assert (w1.cron_lease.held, w2.cron_lease.held) == (True, False)
+    assert await aio_redis.get(cron_leader_key_prefix + w1.queue_name) == w1.cron_lease.token.encode()
+
+    # w1 stops renewing, w2 takes over once the lease lapses
+    await asyncio.sleep(0.4)
+    await w2.heart_beat()
+    await w1.heart_beat()
+    assert (w1.cron_lease.held, w2.cron_lease.held) == (False, True)
+
+    # w1 never got past the first heartbeat, which doesn't enqueue, w2 enqueues its first run straight away
+    jobs = await aio_redis.queued_jobs()
+    assert [j.function for j in jobs] == ['a']
+
+    await w2.close()
+    assert await aio_redis.get(cron_leader_key_prefix + w2.queue_name) is None
+
+
+def test_cron_crontab():
+    cj = cron(foobar, kwargs={}, crontab='0 3 * * *')
+    assert cj.schedule == Schedule.from_crontab('0 3 * * *')
+    cj.calculate_next(datetime(2032, 1, 1, 12))
+    assert cj.next_run == datetime(2032, 1, 2, 3, 0, 0, 123_456)
+    with pytest.raises(AssertionError):
+        cron(foobar, kwargs={}, crontab='0 3 * * *', hour=3)
+
+
+async def test_cron_tz(worker, aio_redis):
+    worker: Worker = worker(
+        cron_jobs=[
+            cron(foobar, name='naive', kwargs={}, second=None, microsecond=0, run_at_startup=True),
+            cron(foobar, name='tokyo', kwargs={}, second=None, microsecond=0, tz='Asia/Tokyo'),
+        ]
+    )
+    n = datetime.now()
+    await worker.run_cron(n, 0.5)
+    await worker.run_cron(n + timedelta(seconds=1), 0.5)
+    tokyo = worker.functions['tokyo']
+    assert tokyo.next_run.utcoffset() == timedelta(hours=9)
+
+    jobs = await aio_redis.queued_jobs()
+    assert Counter(j.function for j in jobs) == {'naive': 2, 'tokyo': 1}
+
+
+def test_cron_missed_runs():
+    last_run_ms = to_unix_ms(datetime(2032, 1, 1, 12))
+    n = datetime(2032, 1, 1, 13, 5)
+    cj = cron(foobar, kwargs={}, crontab='*/10 * * * *', microsecond=0, catch_up='all', catch_up_window=None)
+    assert cj.missed_runs(last_run_ms, n) == [datetime(2032, 1, 1, 12, m) for m in (10, 20, 30, 40, 50)] + [
+        datetime(2032, 1, 1, 13)
+    ]
+    cj = cron(foobar, kwargs={}, crontab='*/10 * * * *', microsecond=0, catch_up='all', catch_up_window=1800)
+    assert cj.missed_runs(last_run_ms, n) == [datetime(2032, 1, 1, 12, 40), datetime(2032, 1, 1, 12, 50),
+                                              datetime(2032, 1, 1, 13)]
+    cj = cron(foobar, kwargs={}, crontab='*/10 * * * *', microsecond=0, catch_up='latest')
+    assert cj.missed_runs(last_run_ms, n) == [datetime(2032, 1, 1, 13)]
+    cj = cron(foobar, kwargs={}, crontab='*/10 * * * *', microsecond=0)
+    assert cj.missed_runs(last_run_ms, n) == []
+    with pytest.raises(AssertionError):
+        cron(foobar, kwargs={}, catch_up='some')
+
+
+async def test_cron_catch_up(worker, aio_redis):
+    worker: Worker = worker(
+        cron_jobs=[
+            cron(foobar, name='all', kwargs={}, second=0, microsecond=0, catch_up='all'),
+            cron(foobar, name='latest', kwargs={}, second=0, microsecond=0, catch_up='latest'),
+            cron(foobar, name='new', kwargs={}, second=0, microsecond=0, catch_up='all'),
+        ]
+    )
+    n = datetime.now().replace(second=30, microsecond=0)
+    last_run = to_unix_ms(n.replace(second=0) - timedelta(minutes=3))
+    await aio_redis.hset(cron_last_run_key_prefix + worker.queue_name, mapping={'all': last_run, 'latest': last_run})
+
+    await worker.run_cron(n, 0.5)
+    jobs = await aio_redis.queued_jobs()
+    # 'new' never ran, so there's nothing to catch up
+    assert Counter(j.function for j in jobs) == {'all': 3, 'latest': 1}
+    assert await aio_redis.hgetall(cron_last_run_key_prefix + worker.queue_name) == {
+        b'all': str(to_unix_ms(n.replace(second=0))).encode(),
+        b'latest': str(to_unix_ms(n.replace(second=0))).encode(),
+    }
+
+    # the next run is recorded once it's enqueued
+    await worker.run_cron(n + timedelta(seconds=30), 0.5)
+    assert len(await aio_redis.queued_jobs()) == 7
+    last_runs = await aio_redis.hgetall(cron_last_run_key_prefix + worker.queue_name)
+    assert last_runs[b'new'] == str(to_unix_ms(n.replace(second=0) + timedelta(minutes=1))).encode()
+
+
+async def test_cron_catch_up_workers(worker, aio_redis):
+    def cron_jobs():
+        return [cron(foobar, name='all', kwargs={}, second=0, microsecond=0, catch_up='all')]
+
+    # two workers without a leader lease starting together catch up the same runs only once
+    w1: Worker = worker(cron_jobs=cron_jobs())
+    w2 = Worker(functions=[], redis_pool=aio_redis, burst=True, poll_delay=0, cron_jobs=cron_jobs())
+    n = datetime.now().replace(second=30, microsecond=0)
+    last_run = to_unix_ms(n.replace(second=0) - timedelta(minutes=3))
+    await aio_redis.hset(cron_last_run_key_prefix + w1.queue_name, mapping={'all': last_run})
+    await w1.run_cron(n, 0.5)
+    await w2.run_cron(n, 0.5)
+    assert len(await aio_redis.queued_jobs()) == 3
+    await w2.close()
+
+    with pytest.raises(AssertionError, match='catch_up requires unique'):
+        cron(foobar, kwargs={}, catch_up='latest', unique=False)
+
+
+async def test_cron_catch_up_blobs(worker, aio_redis):
+    redis = AioRedis(aio_redis.connection_pool, blob_threshold=100)
+    cj = cron(foobar, name='all', kwargs={'data': 'x' * 1000}, second=0, microsecond=0, catch_up='all')
+    worker: Worker = worker(cron_jobs=[cj], aio_redis=redis)
+    n = datetime.now().replace(second=30, microsecond=0)
+    first_run = n.replace(second=0) - timedelta(minutes=2)
+    await redis.hset(cron_last_run_key_prefix + worker.queue_name, mapping={'all': to_unix_ms(first_run) - 60_000})
+    # the first missed run already ran before a restart and released its blob, it's the run which would carry the
+    # blob's payload in the batch
+    await redis.set(result_key_prefix + f'all:{to_unix_ms(first_run)}', b'1')
+
+    await worker.run_cron(n, 0.5)
+    jobs = await redis.queued_jobs()
+    assert sorted(j.job_id for j in jobs) == [f'all:{to_unix_ms(first_run + timedelta(minutes=i))}' for i in (1, 2)]
+    refs_key, = await redis.keys(blob_refs_key_prefix + '*')
+    assert await redis.get(refs_key) == b'2'
+
+
+def test_cron_jitter():
+    offsets = {cron(foobar, name=f'job{i}', kwargs={}, jitter=30).jitter_offset for i in range(50)}
+    assert len(offsets) > 40
+    assert all(timedelta(0) <= o < timedelta(seconds=30) for o in offsets)
+    cj = cron(foobar, name='job1', kwargs={}, second=0, microsecond=0, jitter=timedelta(seconds=30))
+    assert cj.jitter_offset == cron(foobar, name='job1', kwargs={}, jitter=30).jitter_offset
+    cj.calculate_next(datetime(2032, 1, 1, 12, 0, 30))
+    assert cj.next_run == datetime(2032, 1, 1, 12, 1)
+    assert cj.run_at == datetime(2032, 1, 1, 12, 1) + cj.jitter_offset
+    assert cron(foobar, kwargs={}).jitter_offset == timedelta(0)
+
+
+async def test_cron_jitter_worker(worker, aio_redis):
+    cj = cron(foobar, name='jittered', kwargs={}, second=None, microsecond=0, jitter=60, run_at_startup=True)
+    worker: Worker = worker(cron_jobs=[cj])
+    n = datetime.now().replace(microsecond=0)
+    await worker.run_cron(n, 0.5)
+    # not due until the offset has passed
+    assert await aio_redis.queued_jobs() == []
+
+    await worker.run_cron(n + cj.jitter_offset, 0.5)
+    (job,) = await aio_redis.queued_jobs()
+    assert job.job_id == f'jittered:{to_unix_ms(n)}'
+    assert job.score == to_unix_ms(n + cj.jitter_offset)
+
+
+async def test_cron_jitter_takeover(worker):
+    cj = cron(foobar, name='jittered', kwargs={}, second=0, microsecond=0, jitter=60)
+    assert cj.jitter_offset > timedelta(0)
+    worker: Worker = worker(cron_jobs=[cj])
+    cj.next_run = datetime(2032, 1, 1, 12)
+    # a follower taking over after the run's time but before it's due with its jitter keeps it
+    worker._skip_missed_cron_runs(cj.run_at - timedelta(microseconds=1000))
+    assert cj.next_run == datetime(2032, 1, 1, 12)
+    worker._skip_missed_cron_runs(cj.run_at + timedelta(seconds=1))
+    assert cj.next_run == datetime(2032, 1, 1, 12, 1)
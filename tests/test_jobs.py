@@ -1,13 +1,37 @@
 import asyncio
+import os
 import pickle
+from datetime import datetime, timedelta
 
+import msgpack
 import pytest
 from pytest_toolbox.comparison import CloseToNow
 
 from aiorq import Worker, func
-from aiorq.connections import AioRedis, RedisSettings, create_pool
-from aiorq.constants import default_queue_name, in_progress_key_prefix, job_key_prefix, result_key_prefix
+from aiorq.connections import AioRedis, RedisSettings, create_pool, index_result, results_filters_key, results_index_key
+from aiorq.constants import (
+    default_queue_name,
+    in_progress_key_prefix,
+    job_key_prefix,
+    result_key_prefix,
+    results_index_key_prefix,
+)
+from aiorq.exception import SerializationError
 from aiorq.jobs import DeserializationError, Job, JobResult, JobStatus, deserialize_job_raw, serialize_result
+from aiorq.serialize import (
+    Compression,
+    accepted_codecs,
+    compress,
+    compressors,
+    deserialize_job,
+    deserialize_result,
+    envelope_flag,
+    envelope_size,
+    get_codec,
+    serialize_job,
+)
+from aiorq.specs import JobResultBatch
+from aiorq.utils import ms_to_datetime
 
 
 async def test_job_in_progress(aio_redis: AioRedis):
@@ -175,3 +199,414 @@ async def test_result_pole_delay_dep(aio_redis: AioRedis):
         DeprecationWarning, match='"pole_delay" is deprecated, use the correct spelling "poll_delay" instead'
     ):
         assert await j.result(pole_delay=0) == 42
+
+
+async def test_result_latency_breakdown(aio_redis: AioRedis, worker):
+    async def foobar(ctx):
+        await asyncio.sleep(0.05)
+        return 42
+
+    j = await aio_redis.enqueue_job('foobar', defer_by=0.01)
+    worker: Worker = worker(functions=[func(foobar, name='foobar')])
+    await worker.main()
+    info = await j.result_info()
+    assert info.enqueue_ms <= info.due_ms <= info.claim_ms <= info.start_ms <= info.finish_ms <= info.record_ms
+    assert info.run_ms >= 50
+    assert info.queue_wait_ms == info.claim_ms - info.due_ms
+    assert info.setup_ms == info.start_ms - info.claim_ms
+    assert info.wrap_up_ms == info.record_ms - info.finish_ms
+    assert info.finish_time.microsecond == (info.finish_ms % 1000) * 1000
+
+
+@pytest.mark.parametrize('serializer', ['json', 'pickle', 'msgpack', 'orjson'])
+def test_tagged_serializers(serializer):
+    codec = get_codec(serializer)
+    r = serialize_job('foobar', (1, 'a'), {'b': [2]}, 1, 123, 'test-queue', serializer=serializer)
+    assert r[0] == envelope_flag
+    assert r[envelope_size(r)] == codec.tag
+    # tagged payloads are decoded by their tag, whatever deserializer is configured, if the codec is accepted
+    function, args, kwargs, job_try, enqueue_time = deserialize_job_raw(
+        r, deserializer=pickle.loads, accept=accepted_codecs(accept=[serializer])
+    )
+    assert (function, list(args), kwargs, job_try, enqueue_time) == ('foobar', [1, 'a'], {'b': [2]}, 1, 123)
+
+
+async def test_accepted_codecs(aio_redis: AioRedis, worker):
+    assert accepted_codecs() == {'json'}
+    assert accepted_codecs('msgpack', 'msgpack') == {'msgpack'}
+    assert accepted_codecs('msgpack', accept=['orjson']) == {'msgpack', 'json', 'orjson'}
+    with pytest.raises(ValueError, match="unknown serializer 'foobar'"):
+        accepted_codecs(accept=['foobar'])
+
+    r = serialize_job('foobar', (1,), {}, 1, 123, 'test-queue', serializer='pickle')
+    # pickle is never decoded unless configured
+    with pytest.raises(DeserializationError, match='unable to deserialize job') as exc_info:
+        deserialize_job(r)
+    assert "encoded with 'pickle' which is not an accepted codec" in str(exc_info.value.__cause__)
+    with pytest.raises(DeserializationError):
+        deserialize_job(r, deserializer=pickle.loads)
+    assert deserialize_job(r, deserializer='pickle').args == (1,)
+
+    async def foobar(ctx):
+        return 42
+
+    await aio_redis.set(job_key_prefix + 'testing', r)
+    await aio_redis.zadd(default_queue_name, {'testing': 1})
+    worker: Worker = worker(functions=[func(foobar, name='foobar')])
+    await worker.main()
+    assert (worker.jobs_complete, worker.jobs_failed) == (0, 1)
+
+
+def test_untagged_payloads_still_readable():
+    r = serialize_job('foobar', (1,), {}, 1, 123, 'test-queue')
+    assert isinstance(r, str)
+    assert deserialize_job_raw(r.encode()) == ('foobar', [1], {}, 1, 123)
+    r = msgpack.packb({'function': 'foobar', 'args': [], 'kwargs': {}, 'job_try': 1, 'enqueue_time': 123})
+    assert deserialize_job_raw(r, deserializer='msgpack') == ('foobar', [], {}, 1, 123)
+
+
+def test_unknown_serializer():
+    with pytest.raises(SerializationError):
+        serialize_job('foobar', (), {}, 1, 123, 'test-queue', serializer='foobar')
+    with pytest.raises(ValueError, match="unknown serializer 'foobar'"):
+        get_codec('foobar')
+
+
+async def test_mixed_serializers(aio_redis: AioRedis, worker):
+    async def foobar(ctx, v):
+        return v
+
+    # producers and workers using other codecs opt in to them
+    pickle_redis = AioRedis(aio_redis.connection_pool, job_serializer='pickle', accept_codecs=['msgpack'])
+    json_redis = AioRedis(aio_redis.connection_pool, accept_codecs=['msgpack'])
+    j1 = await pickle_redis.enqueue_job('foobar', b'binary')
+    j2 = await json_redis.enqueue_job('foobar', 'text')
+    worker: Worker = worker(
+        functions=[func(foobar, name='foobar')], job_serializer='msgpack', accept_codecs=['pickle']
+    )
+    await worker.main()
+    assert await j1.result(poll_delay=0) == b'binary'
+    assert await j2.result(poll_delay=0) == 'text'
+
+
+@pytest.mark.parametrize('method', ['zlib', 'lzma'])
+@pytest.mark.parametrize('serializer', [None, 'json', 'pickle'])
+def test_compression(method, serializer):
+    args = (['x' * 10 for _ in range(500)],)
+    compression = Compression(method, threshold=1000)
+    r = serialize_job('foobar', args, {}, 1, 123, 'test-queue', serializer=serializer, compression=compression)
+    # with a named codec only the body of the envelope is compressed
+    body = r[envelope_size(r):] if serializer else r
+    assert body[0] == compressors[method].flag
+    assert len(r) < len(serialize_job('foobar', args, {}, 1, 123, 'test-queue', serializer=serializer))
+    function, args_, *_ = deserialize_job_raw(r, deserializer=serializer)
+    assert function == 'foobar'
+    assert list(args_) == [args[0]]
+
+
+def test_compression_threshold():
+    r = serialize_job('foobar', (1,), {}, 1, 123, 'test-queue', compression=Compression(threshold=1000))
+    assert isinstance(r, str)
+    # payloads which don't shrink are stored as is
+    r = os.urandom(100)
+    assert compress(r, Compression(threshold=0)) is r
+    with pytest.raises(SerializationError):
+        serialize_job('foobar', (), {}, 1, 123, 'test-queue', compression=Compression('foobar', threshold=0))
+
+
+async def test_queue_compression(aio_redis: AioRedis, worker):
+    async def foobar(ctx, v):
+        return v
+
+    v = ['x' * 10 for _ in range(500)]
+    redis = AioRedis(aio_redis.connection_pool, queue_compression={'compressed': Compression('lzma')})
+    j1 = await redis.enqueue_job('foobar', v, queue_name='compressed')
+    j2 = await redis.enqueue_job('foobar', v)
+    assert (await aio_redis.get(job_key_prefix + j1.job_id))[0] == compressors['lzma'].flag
+    assert (await aio_redis.get(job_key_prefix + j2.job_id))[0] == ord('{')
+
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis, queue_name='compressed')
+    assert worker.compression == Compression('lzma')
+    await worker.main()
+    assert (await aio_redis.get(result_key_prefix + j1.job_id))[0] == compressors['lzma'].flag
+    assert await j1.result(poll_delay=0) == v
+
+
+def test_envelope_header():
+    r = serialize_job('foobar', (1, 'a'), {'b': [2]}, 1, 123, 'test-queue', serializer='pickle')
+    header = r[:envelope_size(r)]
+    jd = deserialize_job(header, with_body=False)
+    assert (jd.function, jd.job_try, jd.args, jd.kwargs) == ('foobar', 1, None, None)
+    jd = deserialize_job(r, deserializer='pickle')
+    assert (jd.function, jd.args, jd.kwargs) == ('foobar', (1, 'a'), {'b': [2]})
+
+    r = serialize_result(
+        'foobar', (1,), {}, 1, 123, True, 'x' * 1000, 124, 125, 'ref', 'test-queue', 'worker', 'testing',
+        serializer='json',
+    )
+    assert envelope_size(r) < 512
+    jr = deserialize_result(r[:envelope_size(r)], with_body=False)
+    assert (jr.success, jr.worker_name, jr.job_id, jr.finish_ms, jr.result) == (True, 'worker', 'testing', 125, None)
+    assert deserialize_result(r).result == 'x' * 1000
+
+
+async def test_list_headers(aio_redis: AioRedis, worker):
+    async def foobar(ctx, v):
+        return v * 2
+
+    redis = AioRedis(aio_redis.connection_pool, job_serializer='json')
+    await redis.enqueue_job('foobar', 'x' * 1000, job_id='envelope')
+    await aio_redis.enqueue_job('foobar', 'y', job_id='legacy')
+    jobs = await redis.queued_jobs(with_body=False)
+    assert {(j.job_id, j.function, j.args) for j in jobs} == {('envelope', 'foobar', None), ('legacy', 'foobar', None)}
+
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis)
+    await worker.main()
+    results = await redis.all_job_results(with_body=False)
+    assert {(r.job_id, r.success, r.result) for r in results} == {('envelope', True, None), ('legacy', True, None)}
+    results = await redis.all_job_results()
+    assert {r.job_id: r.result for r in results} == {'envelope': 'x' * 2000, 'legacy': 'yy'}
+
+
+def test_job_result_record():
+    r = serialize_result('foobar', (1,), {}, 1, 1_000, True, 42, 2_000, 2_500, 'ref', 'test-queue', 'worker', 'testing')
+    jr = deserialize_result(r)
+    assert not hasattr(jr, '__dict__')
+    assert (jr.enqueue_ms, jr.start_ms, jr.finish_ms) == (1_000, 2_000, 2_500)
+    # datetimes are only built when accessed
+    assert jr._finish_time is None
+    assert jr.finish_time == ms_to_datetime(2_500)
+    assert jr.finish_time is jr.finish_time
+    jr.finish_ms = 3_000
+    assert jr.finish_time == ms_to_datetime(3_000)
+
+    assert jr == JobResult(
+        function='foobar',
+        args=[1],
+        kwargs={},
+        job_try=1,
+        enqueue_time=ms_to_datetime(1_000),
+        start_time=ms_to_datetime(2_000),
+        finish_time=ms_to_datetime(3_000),
+        success=True,
+        result=42,
+        queue_name='test-queue',
+        worker_name='worker',
+        job_id='testing',
+    )
+    d = jr.to_dict()
+    assert d['start_time'] == ms_to_datetime(2_000)
+    assert d['result'] == 42
+    assert jr.to_dict(datetimes=False)['start_time'] == 2_000
+
+
+def test_job_result_batch():
+    results = [
+        deserialize_result(
+            serialize_result('foobar', (), {}, 1, i, i % 2 == 0, i, i, i + 1, 'ref', 'test-queue', 'worker', str(i))
+        )
+        for i in range(10)
+    ]
+    batch = JobResultBatch.from_records(results)
+    assert len(batch) == 10
+    assert batch.columns['job_id'] == [str(i) for i in range(10)]
+    failed = batch.where('success', lambda v: not v).sort('enqueue_ms', reverse=True)
+    assert [r['job_id'] for r in failed.rows()] == ['9', '7', '5', '3', '1']
+    row = failed.rows(0, 1)[0]
+    assert row['finish_ms'] == 10
+    assert row['finish_time'] == ms_to_datetime(10)
+
+
+@pytest.mark.parametrize('serializer', ['json', 'pickle', 'msgpack'])
+def test_binary_arguments(serializer):
+    image = os.urandom(5000)
+    r = serialize_job(
+        'foobar', (image, 1), {'mask': bytearray(b'\x00\xff'), 'name': 'x'}, 1, 123, 'test-queue',
+        serializer=serializer, compression=Compression(),
+    )
+    assert image in r
+    jd = deserialize_job(r, deserializer=serializer)
+    assert isinstance(jd.args[0], memoryview)
+    assert jd.args[0].obj is r
+    assert (bytes(jd.args[0]), jd.args[1]) == (image, 1)
+    assert (jd.kwargs['mask'], jd.kwargs['name']) == (b'\x00\xff', 'x')
+    assert deserialize_job(r[:envelope_size(r)], with_body=False).function == 'foobar'
+
+    r = serialize_result(
+        'foobar', (jd.args[0],), {}, 1, 123, True, b'out', 124, 125, 'ref', 'test-queue', 'worker', 'testing',
+        serializer=serializer,
+    )
+    jr = deserialize_result(r, deserializer=serializer)
+    assert (jr.args[0], jr.result) == (image, b'out')
+
+
+async def test_binary_arguments_worker(aio_redis: AioRedis, worker):
+    async def foobar(ctx, data, *, suffix):
+        assert isinstance(data, memoryview)
+        return bytes(data[::-1]) + suffix
+
+    with pytest.raises(SerializationError, match='bytes arguments need a named job_serializer'):
+        await aio_redis.enqueue_job('foobar', b'abc', suffix=b'!')
+    redis = AioRedis(aio_redis.connection_pool, job_serializer='json')
+    j = await redis.enqueue_job('foobar', b'abc', suffix=b'!')
+    # the worker doesn't take the pool's serializer, results with buffers need it set too
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis, job_serializer='json')
+    await worker.main()
+    assert worker.jobs_complete == 1
+    assert await j.result(poll_delay=0) == b'cba!'
+
+
+async def test_iter_job_results(aio_redis: AioRedis, worker):
+    async def foobar(ctx, v):
+        return v
+
+    redis = AioRedis(aio_redis.connection_pool, job_serializer='json')
+    for i in range(20):
+        await (redis if i % 2 else aio_redis).enqueue_job('foobar', i, job_id=f'job{i}')
+    await redis.set('other', 'not a result')
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis, max_jobs=20)
+    await worker.main()
+
+    results = [r async for r in redis.iter_job_results(count=3)]
+    assert {r.job_id: r.result for r in results} == {f'job{i}': i for i in range(20)}
+    results = [r async for r in redis.iter_job_results(with_body=False, count=3)]
+    assert {(r.job_id, r.result) for r in results} == {(f'job{i}', None) for i in range(20)}
+    results = await redis.all_job_results()
+    assert len(results) == 20
+    assert [r.enqueue_ms for r in results] == sorted(r.enqueue_ms for r in results)
+
+
+async def test_job_results_page(aio_redis: AioRedis, worker):
+    async def foobar(ctx, v):
+        return v
+
+    redis = AioRedis(aio_redis.connection_pool, job_serializer='json')
+    for i in range(10):
+        await redis.enqueue_job('foobar', i, job_id=f'job{i}')
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis, max_jobs=1)
+    await worker.main()
+    index_key = results_index_key_prefix + redis.queue_name
+    assert await redis.zcard(index_key) == 10
+
+    # make finish times distinct to page deterministically
+    await redis.zadd(index_key, {f'job{i}': 1_000 * (i + 1) for i in range(10)})
+    page = await redis.job_results_page(limit=4)
+    assert [r.job_id for r in page] == ['job9', 'job8', 'job7', 'job6']
+    page = await redis.job_results_page(limit=4, before=7_000, with_body=False)
+    assert [(r.job_id, r.result) for r in page] == [('job5', None), ('job4', None), ('job3', None), ('job2', None)]
+    page = await redis.job_results_page(limit=4, before=3_000, after=1_000)
+    assert [r.result for r in page] == [1]
+
+    # expired results are skipped and dropped from the index
+    await redis.delete(result_key_prefix + 'job8', result_key_prefix + 'job7')
+    page = await redis.job_results_page(limit=3)
+    assert [r.job_id for r in page] == ['job9', 'job6', 'job5']
+    assert await redis.zcard(index_key) == 8
+
+    # results finishing while a page is read don't repeat entries of the page
+    await redis.delete(result_key_prefix + 'job6', result_key_prefix + 'job5')
+    mget = redis.mget
+
+    async def mget_and_finish(keys):
+        redis.mget = mget
+        await redis.zadd(index_key, {'job0': 99_000})
+        return await mget(keys)
+
+    redis.mget = mget_and_finish
+    page = await redis.job_results_page(limit=3)
+    assert [r.job_id for r in page] == ['job9', 'job4', 'job3']
+
+    # a cursor of score and job id doesn't skip results finishing in the same millisecond across pages
+    await redis.zadd(index_key, {'job9': 50_000, 'job4': 50_000, 'job3': 50_000, 'job2': 50_000, 'job1': 40_000})
+    page = await redis.job_results_page(limit=2)
+    assert [(r.job_id, r.score) for r in page] == [('job0', 99_000), ('job9', 50_000)]
+    page = await redis.job_results_page(limit=2, before=page[-1].score, before_id=page[-1].job_id)
+    assert [r.job_id for r in page] == ['job4', 'job3']
+    page = await redis.job_results_page(limit=2, before=page[-1].score, before_id=page[-1].job_id)
+    assert [r.job_id for r in page] == ['job2', 'job1']
+    # without before_id the bound is exclusive
+    page = await redis.job_results_page(limit=2, before=50_000)
+    assert [r.job_id for r in page] == ['job1']
+
+    # scores are long past the worker's keep_result
+    worker._last_results_trim = 0
+    await worker.trim_results_index()
+    assert await redis.zcard(index_key) == 0
+
+
+async def test_job_results_page_filters(aio_redis: AioRedis, worker):
+    async def foo(ctx, v):
+        if v % 3 == 0:
+            raise ValueError(v)
+        return v
+
+    async def bar(ctx, v):
+        return v
+
+    redis = AioRedis(aio_redis.connection_pool, job_serializer='json')
+    for i in range(12):
+        await redis.enqueue_job('foo' if i % 2 else 'bar', i, job_id=f'job{i}')
+    worker: Worker = worker(
+        functions=[func(foo, name='foo', max_tries=1), func(bar, name='bar')], aio_redis=redis, worker_name='w1'
+    )
+    await worker.main()
+
+    page = await redis.job_results_page(function='foo')
+    assert {r.job_id for r in page} == {'job1', 'job3', 'job5', 'job7', 'job9', 'job11'}
+    page = await redis.job_results_page(success=False)
+    assert {r.job_id for r in page} == {'job3', 'job9'}
+    page = await redis.job_results_page(function='foo', success=True, worker_name='w1', with_body=False)
+    assert {r.job_id for r in page} == {'job1', 'job5', 'job7', 'job11'}
+    page = await redis.job_results_page(function='foo', success=True, limit=3)
+    assert len(page) == 3 and {r.job_id for r in page} < {'job1', 'job5', 'job7', 'job11'}
+    assert await redis.job_results_page(function='bar', success=False) == []
+    assert await redis.job_results_page(worker_name='w2') == []
+    # the filter indexes of both functions, the worker and both outcomes are recorded for trimming
+    assert await redis.scard(results_filters_key(redis.queue_name)) == 5
+
+    await redis.delete(result_key_prefix + 'job5')
+    page = await redis.job_results_page(function='foo', success=True)
+    assert {r.job_id for r in page} == {'job1', 'job7', 'job11'}
+    assert await redis.zscore(results_index_key(redis.queue_name, 'function', 'foo'), 'job5') is None
+
+    # a queue named like a filter index has its own keys
+    assert results_index_key('q:function:foo') != results_index_key('q', 'function', 'foo')
+    # indexes of previous worker names and removed functions are trimmed too
+    async with redis.pipeline(transaction=False) as pipe:
+        index_result(pipe, redis.queue_name, 'old', 1, 'gone', 'host.123', True)
+        index_result(pipe, 'other', 'old', 1, 'foo', 'w1', True)
+        await pipe.execute()
+    orphans = [
+        results_index_key(redis.queue_name, 'worker', 'host.123'),
+        results_index_key(redis.queue_name, 'function', 'gone'),
+    ]
+    other_queue = results_index_key('other', 'worker', 'w1')
+    worker._last_results_trim = 0
+    await worker.trim_results_index()
+    assert [await redis.exists(key) for key in orphans] == [0, 0]
+    filters_key = results_filters_key(redis.queue_name)
+    assert not await redis.sismember(filters_key, orphans[0])
+    assert await redis.sismember(filters_key, results_index_key(redis.queue_name, 'worker', 'w1'))
+    assert await redis.exists(other_queue)
+
+
+async def test_queued_jobs_page(aio_redis: AioRedis):
+    redis = AioRedis(aio_redis.connection_pool, job_serializer='json')
+    now = datetime.now()
+    for i in range(10):
+        # runs share scores to check the cursor copes with ties
+        await redis.enqueue_job('foobar', i, job_id=f'job{i}', defer_until=now + timedelta(seconds=i // 4 * 10))
+    await redis.set(in_progress_key_prefix + 'job1', b'1')
+    await redis.set(result_key_prefix + 'job2', b'1')
+    await redis.delete(job_key_prefix + 'job3')
+
+    page = await redis.queued_jobs_page(offset=4, limit=4, with_body=False)
+    assert [(j.job_id, j.args, j.state) for j in page] == [(f'job{i}', None, 'deferred') for i in range(4, 8)]
+
+    jobs = []
+    async for jd in redis.iter_queued_jobs(page_size=2):
+        jobs.append(jd)
+        # jobs leaving the queue while iterating don't shift later pages
+        await redis.zrem(redis.queue_name, jd.job_id)
+    assert [list(j.args) for j in jobs] == [[i] for i in range(10) if i != 3]
+    assert {j.job_id: j.state for j in jobs[:3]} == {'job0': 'queued', 'job1': 'in_progress', 'job2': 'complete'}
@@ -1,5 +1,4 @@
 import asyncio
-import dataclasses
 import functools
 import logging
 from collections import Counter
@@ -243,7 +242,7 @@ async def test_get_jobs(aio_redis: AioRedis):
     await asyncio.sleep(0.01)
     await aio_redis.enqueue_job('third', 7, b=8)
     jobs = await aio_redis.queued_jobs()
-    assert [dataclasses.asdict(j) for j in jobs] == [
+    assert [j.to_dict() for j in jobs] == [
         {
             'function': 'foobar',
             'args': (),
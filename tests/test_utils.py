@@ -88,6 +88,12 @@ def test_to_ms(input, output):
     assert aiorq.utils.to_ms(input) == output
 
 
+def test_ms_to_datetime_keeps_ms():
+    dt = aiorq.utils.ms_to_datetime(1_600_000_000_123)
+    assert dt.microsecond == 123_000
+    assert aiorq.utils.to_unix_ms(dt) == 1_600_000_000_123
+
+
 @pytest.mark.parametrize('input,output', [(timedelta(days=1), 86400), (42, 42), (42.123, 42.123), (None, None)])
 def test_to_seconds(input, output):
     assert aiorq.utils.to_seconds(input) == output
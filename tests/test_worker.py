@@ -1,5 +1,6 @@
 import asyncio
 import functools
+import json
 import logging
 import re
 import signal
@@ -10,9 +11,24 @@ import msgpack
 import pytest
 from aioredis import create_redis_pool
 
+from aiorq.blobs import offload_blobs
 from aiorq.connections import AioRedis
-from aiorq.constants import abort_jobs_ss, default_queue_name, health_check_key_suffix, job_key_prefix
+from aiorq.constants import (
+    abort_jobs_ss,
+    blob_key_prefix,
+    blob_refs_key_prefix,
+    default_queue_name,
+    health_check_key_suffix,
+    job_key_prefix,
+    profile_key_prefix,
+    workers_health_key,
+    workers_key,
+    workers_seen_key,
+)
+from aiorq.hooks import Hooks
 from aiorq.jobs import Job, JobStatus
+from aiorq.serialize import BlobRef, dump_health
+from aiorq.utils import timestamp_ms
 from aiorq.worker import (
     FailedJobs,
     JobExecutionFailed,
@@ -835,3 +851,221 @@ async def test_job_timeout(aio_redis: AioRedis, worker, caplog):
     assert worker.jobs_retried == 0
     log = re.sub(r'\d+.\d\ds', 'X.XXs', '\n'.join(r.message for r in caplog.records))
     assert 'X.XXs ! testing:longfunc failed, TimeoutError:' in log
+
+
+async def test_profile_job(aio_redis: AioRedis, worker):
+    def slow_part():
+        return sum(range(10_000))
+
+    async def foo(ctx):
+        await asyncio.sleep(0)
+        return slow_part()
+
+    await aio_redis.enqueue_job('foo', job_id='testing')
+    worker: Worker = worker(functions=[func(foo, name='foo', profile_sample_rate=1)])
+    await worker.main()
+    assert worker.jobs_complete == 1
+    assert await aio_redis.llen(profile_key_prefix + 'foo') == 1
+    rows = await aio_redis.get_job_profile('foo')
+    assert any('slow_part' in r['function'] for r in rows)
+    assert rows == sorted(rows, key=lambda r: r['cumtime'], reverse=True)
+
+
+async def test_profile_not_sampled(aio_redis: AioRedis, worker):
+    async def foo(ctx):
+        return 1
+
+    await aio_redis.enqueue_job('foo', job_id='testing')
+    worker: Worker = worker(functions=[func(foo, name='foo')], profile_sample_rate=0)
+    await worker.main()
+    assert worker.jobs_complete == 1
+    assert await aio_redis.get_job_profile('foo') == []
+
+
+async def test_lifecycle_hooks(aio_redis: AioRedis, worker):
+    events = []
+
+    async def async_hook(event):
+        events.append(event)
+
+    hooks = Hooks(before_enqueue=[events.append], after_enqueue=[events.append])
+    for name in ('job_claimed', 'job_started', 'job_finished'):
+        hooks.register(name, events.append)
+    hooks.register('result_written', async_hook)
+    aio_redis.hooks = hooks
+
+    await aio_redis.enqueue_job('foobar', job_id='testing')
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], hooks=hooks)
+    await worker.main()
+    assert [e.hook for e in events] == [
+        'before_enqueue',
+        'after_enqueue',
+        'job_claimed',
+        'job_started',
+        'job_finished',
+        'result_written',
+    ]
+    assert all(e.job_id == 'testing' for e in events)
+    finished = events[4]
+    assert finished.function == 'foobar'
+    assert finished.success is True
+    assert finished.enqueue_time_ms <= finished.claim_ms <= finished.start_ms <= finished.finish_ms
+    assert events[5].result_ms >= finished.finish_ms
+
+
+async def test_lifecycle_hooks_pool(aio_redis: AioRedis, worker):
+    events = []
+    redis = AioRedis(aio_redis.connection_pool, hooks=Hooks(after_enqueue=[events.append], job_finished=[events.append]))
+    await redis.enqueue_job('foobar', job_id='testing')
+    # a worker given a pool uses the pool's hooks by default
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis)
+    assert worker.hooks is redis.hooks
+    await worker.main()
+    assert [e.hook for e in events] == ['after_enqueue', 'job_finished']
+
+    # hooks given to the worker don't replace those of the pool
+    other = Hooks()
+    assert Worker(functions=[foobar], redis_pool=redis, hooks=other).hooks is other
+    assert redis.hooks.after_enqueue == [events.append]
+
+
+async def test_lifecycle_hook_error(aio_redis: AioRedis, worker, caplog):
+    def broken_hook(event):
+        raise RuntimeError('broken hook')
+
+    await aio_redis.enqueue_job('foobar', job_id='testing')
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], hooks=Hooks(job_started=[broken_hook]))
+    await worker.main()
+    assert worker.jobs_complete == 1
+    assert 'job_started hook' in caplog.text
+
+
+async def test_job_claimed_hook_runs_in_job_task(aio_redis: AioRedis, worker, caplog):
+    claimed = []
+    all_claimed = asyncio.Event()
+
+    async def slow_hook(event):
+        # only returns once the other job has been claimed too
+        claimed.append(event.job_id)
+        if len(claimed) == 2:
+            all_claimed.set()
+        await asyncio.wait_for(all_claimed.wait(), 1)
+
+    await aio_redis.enqueue_job('foobar', job_id='job1')
+    await aio_redis.enqueue_job('foobar', job_id='job2')
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], hooks=Hooks(job_claimed=[slow_hook]))
+    await worker.main()
+    assert worker.jobs_complete == 2
+    assert sorted(claimed) == ['job1', 'job2']
+    # the first hook didn't time out waiting for the second claim
+    assert 'job_claimed hook' not in caplog.text
+
+
+async def test_blob_arguments(aio_redis: AioRedis, worker):
+    calls = []
+
+    async def count(ctx, data, n, extra=None):
+        calls.append((len(data), len(extra)))
+        return n
+
+    data = [f'row{i}' for i in range(200)]
+    redis = AioRedis(aio_redis.connection_pool, blob_threshold=1000)
+    jobs = [await redis.enqueue_job('count', data, i, extra='x' * 1000) for i in range(10)]
+    blob_keys = await aio_redis.keys(blob_key_prefix + '*')
+    assert len(blob_keys) == 2
+    for key in blob_keys:
+        assert await aio_redis.get(blob_refs_key_prefix + key.decode()[len(blob_key_prefix):]) == b'10'
+    assert len(await aio_redis.get(job_key_prefix + jobs[0].job_id)) < 1000
+
+    worker: Worker = worker(functions=[func(count, name='count')], aio_redis=redis)
+    await worker.main()
+    assert worker.jobs_complete == 10
+    assert calls == [(200, 1000)] * 10
+    assert worker.blob_cache.misses == 2
+    assert worker.blob_cache.hits == 18
+    # references are dropped as jobs finish, the last one deletes the blobs
+    assert await aio_redis.keys('aiorq:blob*') == []
+    assert await jobs[0].result(poll_delay=0) == 0
+
+
+def test_offload_blobs():
+    rows = ['x' * 600, 'y' * 600]
+    args, kwargs, blobs = offload_blobs(([1, 2], rows), {'small': {'a': 1}, 'big': 'z' * 1000}, 1000, None, None)
+    assert args[0] == [1, 2]
+    assert kwargs['small'] == {'a': 1}
+    assert isinstance(args[1], BlobRef)
+    assert isinstance(kwargs['big'], BlobRef)
+    # the blob payload is the argument serialized once
+    assert blobs[args[1].digest] == json.dumps(rows).encode()
+
+
+async def test_blob_lookalike_argument(aio_redis: AioRedis, worker):
+    async def echo(ctx, v, big):
+        return v
+
+    # only arguments the producer offloaded are resolved, a dict which looks like a reference is passed as is
+    lookalike = {'__aiorq_blob__': 'f' * 64}
+    redis = AioRedis(aio_redis.connection_pool, blob_threshold=1000)
+    j1 = await redis.enqueue_job('echo', lookalike, 'x' * 1000)
+    j2 = await aio_redis.enqueue_job('echo', lookalike, 'x')
+    worker: Worker = worker(functions=[func(echo, name='echo')], aio_redis=redis)
+    await worker.main()
+    assert worker.jobs_complete == 2
+    assert await j1.result(poll_delay=0) == lookalike
+    assert await j2.result(poll_delay=0) == lookalike
+
+
+async def test_blob_missing(aio_redis: AioRedis, worker):
+    redis = AioRedis(aio_redis.connection_pool, blob_threshold=1000)
+    await redis.enqueue_job('foobar', 'x' * 1000)
+    await aio_redis.delete(*await aio_redis.keys(blob_key_prefix + '*'))
+
+    # the producer resends blobs it believes are stored but have gone
+    await redis.enqueue_job('foobar', 'x' * 1000)
+    assert len(await aio_redis.keys(blob_key_prefix + '*')) == 1
+
+    await aio_redis.delete(*await aio_redis.keys(blob_key_prefix + '*'))
+    worker: Worker = worker(functions=[func(foobar, name='foobar')], aio_redis=redis)
+    await worker.main()
+    assert worker.jobs_failed == 2
+    assert await aio_redis.keys('aiorq:blob*') == []
+
+
+async def test_worker_registry(aio_redis: AioRedis, worker):
+    # the fixture closes w2, w1 is closed below
+    w1 = Worker(functions=[foobar], redis_pool=aio_redis, burst=True, poll_delay=0, worker_name='w1',
+                health_check_interval=0)
+    w2: Worker = worker(functions=[foobar], worker_name='w2', health_check_interval=0)
+    await w1.main()
+    await w2.main()
+    workers = await aio_redis.get_job_workers()
+    assert {w.worker_name: (w.is_action, w.functions, w.health_check['queued']) for w in workers} == {
+        'w1': (True, ['foobar'], 0),
+        'w2': (True, ['foobar'], 0),
+    }
+    assert await aio_redis._get_health_check('w1') == workers[0].health_check
+
+    # a worker which stopped recording health, eg. it crashed, loses it after health_check_interval + 1 seconds
+    await aio_redis.hset(workers_health_key, 'w1', dump_health({'queued': 0}, timestamp_ms() - 1))
+    assert await aio_redis._get_health_check('w1') == {}
+
+    # w1 hasn't been seen for longer than stale_after
+    await aio_redis.zadd(workers_seen_key, {'w1': 1})
+    workers = await aio_redis.get_job_workers()
+    assert [(w.worker_name, w.is_action, bool(w.health_check)) for w in workers] == [('w2', True, True)]
+    assert await aio_redis.hkeys(workers_key) == [b'w2']
+    assert await aio_redis.hkeys(workers_health_key) == [b'w2']
+    assert await aio_redis.zrange(workers_seen_key, 0, -1) == [b'w2']
+
+    await w2.close()
+    workers = await aio_redis.get_job_workers()
+    assert [(w.worker_name, w.is_action, w.health_check) for w in workers] == [('w2', False, {})]
+    await w1.close()
+
+
+async def test_worker_registry_health_name(aio_redis: AioRedis, worker):
+    # a worker name ending in :health has nothing to do with another worker's health check
+    worker: Worker = worker(functions=[foobar], worker_name='w1:health', health_check_interval=0)
+    await worker.main()
+    (w,) = await aio_redis.get_job_workers()
+    assert (w.worker_name, w.is_action, w.health_check['queued']) == ('w1:health', True, 0)